@@ -0,0 +1,122 @@
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+POWER_FIELDS = ['production', 'grid', 'consumption']
+MAX_SAMPLE_GAP_SECONDS = 300
+BATTERY_MAX = 100
+
+
+def sample_hours(frame):
+    timestamps = frame['timestamp'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    seconds = np.diff(timestamps, append=timestamps[-1:]) / 1e9
+    if len(seconds) > 1:
+        seconds[-1] = np.median(seconds[:-1])
+    return np.clip(seconds, 0, MAX_SAMPLE_GAP_SECONDS) / 3600
+
+
+def local_days(frame):
+    return frame['timestamp'].dt.tz_localize(None).dt.normalize().to_numpy()
+
+
+def energy_columns(frame):
+    hours = sample_hours(frame)
+    production = np.nan_to_num(frame['production'].to_numpy(dtype=np.float64)) * hours
+    consumption = np.nan_to_num(frame['consumption'].to_numpy(dtype=np.float64)) * hours
+    grid = np.nan_to_num(frame['grid'].to_numpy(dtype=np.float64)) * hours
+    return pd.DataFrame({
+        'production': np.maximum(production, 0),
+        'consumption': np.maximum(consumption, 0),
+        'grid_import': np.maximum(grid, 0),
+        'grid_export': np.maximum(-grid, 0),
+    })
+
+
+def daily_totals(frame):
+    if frame.empty:
+        return pd.DataFrame(columns=['production', 'consumption', 'grid_import', 'grid_export'])
+    energy = energy_columns(frame)
+    totals = energy.groupby(local_days(frame)).sum()
+    totals.index = pd.Index([day.date().isoformat() for day in totals.index], name='date')
+    return totals.round(2)
+
+
+def self_consumption(frame):
+    totals = daily_totals(frame)
+    totals.loc['total'] = totals.sum()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratios = pd.DataFrame({
+            'self_consumption_ratio': 1 - totals['grid_export'] / totals['production'],
+            'autarky_ratio': 1 - totals['grid_import'] / totals['consumption'],
+        }, index=totals.index)
+    return ratios.clip(0, 1).round(3)
+
+
+def peak_production_hour(frame):
+    if frame.empty:
+        return {}
+    timestamps = frame['timestamp']
+    production = frame['production'].to_numpy(dtype=np.float64)
+    hour_of_day = timestamps.dt.hour.to_numpy()
+    means = pd.Series(production).groupby(hour_of_day).mean()
+    hourly = pd.Series(production).groupby(timestamps.dt.tz_localize(None).dt.floor('h').to_numpy()).mean()
+    best_slot = hourly.idxmax()
+    return {
+        'typical_peak_hour': f"{int(means.idxmax()):02d}:00",
+        'typical_peak_mean_kw': round(float(means.max()), 3),
+        'peak_hour': pd.Timestamp(best_slot).strftime("%Y-%m-%d %H:00"),
+        'peak_hour_mean_kw': round(float(hourly.max()), 3),
+        'peak_sample': timestamps.iloc[int(np.nanargmax(production))].strftime("%Y-%m-%d %H:%M"),
+        'peak_sample_kw': round(float(np.nanmax(production)), 3),
+    }
+
+
+def battery_extremes(frame):
+    battery = frame['battery_status'].to_numpy(dtype=np.float64)
+    valid = (battery >= 0) & (battery <= BATTERY_MAX)
+    if not valid.any():
+        return pd.DataFrame(columns=['min', 'min_at', 'max', 'max_at'])
+    frame = frame.loc[valid, ['timestamp', 'battery_status']]
+    days = local_days(frame)
+    grouped = frame.groupby(days)['battery_status']
+    minimum = frame.loc[grouped.idxmin()].set_index(np.unique(days))
+    maximum = frame.loc[grouped.idxmax()].set_index(np.unique(days))
+    extremes = pd.DataFrame({
+        'min': minimum['battery_status'],
+        'min_at': minimum['timestamp'].dt.strftime("%H:%M"),
+        'max': maximum['battery_status'],
+        'max_at': maximum['timestamp'].dt.strftime("%H:%M"),
+    })
+    extremes.index = pd.Index([day.date().isoformat() for day in extremes.index], name='date')
+    return extremes
+
+
+def energy_plot(frame, resolution='15min'):
+    from matplotlib.figure import Figure
+
+    series = frame.set_index('timestamp')[POWER_FIELDS].resample(resolution).mean()
+    figure = Figure(figsize=(10, 4))
+    axis = figure.subplots()
+    for field in POWER_FIELDS:
+        axis.plot(series.index, series[field], label=field, linewidth=1)
+    axis.axhline(0, color="grey", linewidth=0.5)
+    axis.set_ylabel("kW")
+    axis.set_title(f"Production, consumption and grid ({resolution} means)")
+    axis.legend(loc="upper left")
+    figure.autofmt_xdate()
+    buffer = BytesIO()
+    figure.savefig(buffer, format="png", bbox_inches="tight")
+    return buffer.getvalue()
+
+
+def slot_profile(frame, field, slot_minutes=15):
+    slots = 24 * 60 // slot_minutes
+    local = frame['timestamp'].dt.tz_localize(None)
+    slot_index = ((local.dt.hour * 60 + local.dt.minute) // slot_minutes).to_numpy()
+    values = frame[field].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(values)
+    sums = np.bincount(slot_index[valid], weights=values[valid], minlength=slots)
+    counts = np.bincount(slot_index[valid], minlength=slots)
+    profile = pd.Series(np.where(counts > 0, sums / np.maximum(counts, 1), np.nan))
+    return profile.interpolate(limit_direction='both').fillna(0).to_numpy()
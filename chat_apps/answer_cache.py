@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from router import EMBEDDING_DIMENSIONS, TOKEN_PATTERN, embed
+
+STOPWORDS = frozenset(
+    "a an the is are was were be been am do does did have has had i me my we our you your it its this that these "
+    "those of in on at to for from by with about as and or s please can could would will tell show give what how "
+    "much many which when where why "
+    "der die das den dem des ein eine einen einem einer ist sind war waren bin hat habe haben ich mich mir mein "
+    "meine wir unser du dein es im in am an auf zu zum zur für von vom mit und oder bitte kannst wie viel viele "
+    "was welche welcher wann wo warum".split())
+
+Answer = namedtuple("Answer", ["query", "terms", "events", "version", "seconds"])
+Hit = namedtuple("Hit", ["query", "similarity", "events", "seconds"])
+
+
+def terms(query):
+    return frozenset(word for word in TOKEN_PATTERN.findall(query.lower()) if word not in STOPWORDS)
+
+
+class AnswerCache:
+    def __init__(self, max_entries=256, min_similarity=0.85):
+        self.max_entries = max_entries
+        self.min_similarity = min_similarity
+        self.lock = threading.Lock()
+        self.vectors = np.zeros((max_entries, EMBEDDING_DIMENSIONS), dtype=np.float32)
+        self.answers = [None] * max_entries
+        self.last_used = np.full(max_entries, -np.inf)
+        self.version = None
+        self.metrics = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+        self.saved_seconds = 0.0
+        self.hit_seconds = 0.0
+
+    def invalidate(self, version=None):
+        with self.lock:
+            self.drop_outdated(version)
+            self.version = version
+
+    def drop_outdated(self, version):
+        for slot, answer in enumerate(self.answers):
+            if answer is not None and (version is None or answer.version != version):
+                self.answers[slot] = None
+                self.last_used[slot] = -np.inf
+                self.metrics["invalidations"] += 1
+
+    def lookup(self, query, version):
+        if version is None:
+            with self.lock:
+                self.metrics["misses"] += 1
+            return None
+        vector = embed(query)
+        with self.lock:
+            if version != self.version:
+                self.drop_outdated(version)
+                self.version = version
+            occupied = np.isfinite(self.last_used)
+            if occupied.any():
+                similarities = np.where(occupied, self.vectors @ vector, -1.0)
+                wanted = terms(query)
+                for slot in np.argsort(similarities)[::-1]:
+                    if similarities[slot] < self.min_similarity:
+                        break
+                    answer = self.answers[slot]
+                    if answer.terms == wanted:
+                        self.last_used[slot] = time.monotonic()
+                        self.metrics["hits"] += 1
+                        return Hit(answer.query, float(similarities[slot]), answer.events, answer.seconds)
+            self.metrics["misses"] += 1
+            return None
+
+    def store(self, query, version, events, seconds):
+        if version is None:
+            return
+        vector = embed(query)
+        with self.lock:
+            if version != self.version:
+                self.drop_outdated(version)
+                self.version = version
+            slot = int(np.argmin(self.last_used))
+            if self.answers[slot] is not None:
+                self.metrics["evictions"] += 1
+            self.vectors[slot] = vector
+            self.answers[slot] = Answer(query, terms(query), tuple(events), version, seconds)
+            self.last_used[slot] = time.monotonic()
+            self.metrics["stores"] += 1
+
+    def record_hit(self, hit, seconds):
+        with self.lock:
+            self.hit_seconds += seconds
+            self.saved_seconds += max(hit.seconds - seconds, 0.0)
+
+    def answer(self, query, data_version, compute):
+        started = time.perf_counter()
+        hit = self.lookup(query, data_version())
+        if hit is not None:
+            self.record_hit(hit, time.perf_counter() - started)
+            return dict(hit.events).get("final")
+        text = compute()
+        if text:
+            self.store(query, data_version(), [("final", text)], time.perf_counter() - started)
+        return text
+
+    def stream(self, query, data_version, events):
+        started = time.perf_counter()
+        hit = self.lookup(query, data_version())
+        if hit is not None:
+            yield "node", f"Answer cache ({hit.similarity:.0%} similar to: {hit.query})"
+            yield from hit.events
+            self.record_hit(hit, time.perf_counter() - started)
+            return
+
+        text, final, images = "", None, []
+        for kind, payload in events:
+            if kind == "token":
+                text += payload
+            elif kind == "final":
+                final = payload
+            elif kind == "image":
+                images.append((kind, payload))
+            yield kind, payload
+        if final or text:
+            self.store(query, data_version(), [*images, ("final", final or text)], time.perf_counter() - started)
+
+    def stats(self):
+        with self.lock:
+            metrics = dict(self.metrics)
+            metrics["entries"] = int(np.isfinite(self.last_used).sum())
+            saved, hit_seconds = self.saved_seconds, self.hit_seconds
+        lookups = metrics["hits"] + metrics["misses"]
+        metrics["hit_rate"] = metrics["hits"] / lookups if lookups else 0.0
+        metrics["saved_seconds"] = round(saved, 3)
+        metrics["hit_latency_ms"] = hit_seconds / metrics["hits"] * 1000 if metrics["hits"] else 0.0
+        return metrics
+
+
+CACHE_CASES = [
+    ("What is the current battery level?", "what's the current battery level", True),
+    ("Wie viel hat die Anlage heute produziert?", "Wie viel hat die Anlage heute produziert", True),
+    ("What was the lowest battery level today?", "What was the highest battery level today?", False),
+    ("How much did I import from the grid yesterday?", "How much did I export to the grid yesterday?", False),
+    ("When should I run the dishwasher?", "When should I run the washing machine?", False),
+    ("How much energy did I produce this week?", "How much energy did I consume this week?", False),
+    ("How much did I produce today?", "How much did I produce yesterday?", False),
+]
+
+
+if __name__ == "__main__":
+    failures = 0
+    for stored, asked, expected in CACHE_CASES:
+        cache = AnswerCache(max_entries=4)
+        cache.store(stored, 1, [("final", stored)], 1.0)
+        hit = cache.lookup(asked, 1) is not None
+        if hit != expected:
+            failures += 1
+            outcome = {True: "hit", False: "miss"}
+            print(f"{asked!r} after {stored!r}: expected {outcome[expected]}, got {outcome[hit]}")
+    print(f"{len(CACHE_CASES) - failures} of {len(CACHE_CASES)} cache cases passed")
+    raise SystemExit(1 if failures else 0)
@@ -0,0 +1,104 @@
+import argparse
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import pv_forecast
+
+NANOSECONDS_PER_HOUR = 3_600_000_000_000
+
+
+def load_production(path):
+    frame = pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path, parse_dates=['timestamp'])
+    timestamps = pd.to_datetime(frame['timestamp'], utc=True).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    hourly = pd.Series(frame['production'].to_numpy(dtype=np.float64)).groupby(
+        timestamps // NANOSECONDS_PER_HOUR).mean()
+    return hourly.index.to_numpy(dtype=np.int64), hourly.to_numpy()
+
+
+def load_weather_log(path):
+    with sqlite3.connect(path) as connection:
+        rows = connection.execute("SELECT hour, cloud FROM weather ORDER BY hour").fetchall()
+    hours, clouds = zip(*rows) if rows else ((), ())
+    return np.array(hours, dtype=np.int64), np.array(clouds, dtype=np.float64)
+
+
+def synthetic_history(days, seed=7):
+    rng = np.random.default_rng(seed)
+    first_hour = int(np.datetime64("2024-05-01T00", "h").astype(np.int64))
+    hours = np.arange(first_hour, first_hour + days * 24)
+    clouds = np.empty(len(hours))
+    clouds[0] = 50
+    for index in range(1, len(hours)):
+        clouds[index] = np.clip(0.9 * clouds[index - 1] + 0.1 * 50 + rng.normal(0, 15), 0, 100)
+    shading = 1 - 0.3 * (hours % 24 >= 16)
+    production = (9.0 * pv_forecast.hourly_clear_sky(hours) * pv_forecast.cloud_factor(clouds) * shading
+                  * rng.normal(1, 0.08, len(hours))).clip(0)
+    forecast_clouds = np.clip(clouds + rng.normal(0, 20, len(hours)), 0, 100)
+    return hours, production, hours, forecast_clouds
+
+
+def metrics(errors, actual_daily, predicted_daily):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        daily_error = np.nanmean(np.abs(predicted_daily - actual_daily) / actual_daily)
+    return {"mae_kwh": np.nanmean(np.abs(errors)), "rmse_kwh": np.sqrt(np.nanmean(errors ** 2)),
+            "bias_kwh": np.nanmean(errors), "daily_mape": daily_error}
+
+
+def backtest(hours, production, cloud_hours, clouds, warmup_days):
+    forecaster = pv_forecast.PVForecaster()
+    forecaster.log_weather(cloud_hours, clouds, int(cloud_hours[0]) if len(cloud_hours) else 0)
+    envelope_only = pv_forecast.PVForecaster()
+    by_hour = dict(zip(hours.tolist(), production.tolist()))
+
+    days = np.unique(hours // 24)
+    results = {"model": [], "envelope": [], "persistence": []}
+    actual_daily, predicted_daily = [], {name: [] for name in results}
+    for day in days:
+        day_hours = np.arange(day * 24, day * 24 + 24)
+        actual = np.array([by_hour.get(hour, np.nan) for hour in day_hours.tolist()])
+        if day - days[0] >= warmup_days and not np.isnan(actual).all():
+            predictions = {
+                "model": forecaster.forecast(day_hours, cloud_hours, clouds),
+                "envelope": envelope_only.forecast(day_hours, cloud_hours, clouds),
+                "persistence": np.array([by_hour.get(hour - 24, np.nan) for hour in day_hours.tolist()]),
+            }
+            actual_daily.append(np.nansum(actual))
+            for name, predicted in predictions.items():
+                results[name].append(predicted - actual)
+                predicted_daily[name].append(np.nansum(predicted))
+
+        selection = (hours >= day * 24) & (hours < day * 24 + 24)
+        forecaster.train(hours[selection], production[selection], day * 24 + 24)
+        envelope_only.train(hours[selection], production[selection], day * 24 + 24)
+        envelope_only.model.stats[:] = 0
+
+    return {name: metrics(np.concatenate(errors), np.array(actual_daily), np.array(predicted_daily[name]))
+            for name, errors in results.items() if errors}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Walk-forward backtest of the PV forecast on recorded data.")
+    parser.add_argument("--production", help="Parquet or CSV export of the solar data, e.g. from /solar.parquet")
+    parser.add_argument("--weather-log", default="pv_forecast.sqlite",
+                        help="SQLite store of the forecaster with the logged cloud cover")
+    parser.add_argument("--synthetic-days", type=int, default=0, help="Backtest on generated data instead")
+    parser.add_argument("--warmup-days", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.synthetic_days:
+        history = synthetic_history(args.synthetic_days)
+    elif args.production:
+        history = (*load_production(args.production), *load_weather_log(args.weather_log))
+    else:
+        parser.error("either --production or --synthetic-days is required")
+
+    print(f"{'forecast':>12} {'MAE kWh':>9} {'RMSE kWh':>9} {'bias kWh':>9} {'daily MAPE':>11}")
+    for name, result in backtest(*history, args.warmup_days).items():
+        print(f"{name:>12} {result['mae_kwh']:>9.3f} {result['rmse_kwh']:>9.3f} {result['bias_kwh']:>9.3f} "
+              f"{result['daily_mape']:>11.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import types
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Any, Dict, List
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+import context_budget
+
+LOCAL_TIMEZONE = ZoneInfo("Europe/Berlin")
+CORPUS = [
+    {"query": "How much did we produce in the last three days?",
+     "tools": ["daily_energy_totals", "summed_historic_data"]},
+    {"query": "What is the weather forecast for the next days?", "tools": ["weather_forecaster"]},
+    {"query": "When should I run the dishwasher tomorrow?",
+     "tools": ["pv_forecast", "peak_production_hour", "energy_optimizer"]},
+    {"query": "Plot production and consumption of the last 3 days", "tools": ["energy_plot"]},
+    {"query": "What is the current battery status?", "tools": ["live_data"]},
+    {"query": "What is my self-consumption ratio?", "tools": ["self_consumption_ratio"]},
+    {"query": "Give me some tips to save energy", "tools": []},
+    {"query": "How much did we produce in the last three days and will tomorrow be sunny?",
+     "tools": ["summed_historic_data", "weather_forecaster"]},
+    {"query": "Wann sollte ich morgen die Waschmaschine laufen lassen?",
+     "tools": ["pv_forecast", "peak_production_hour", "energy_optimizer"]},
+]
+NODE_TOOLS = {
+    "Weather Retriever": {"weather_forecaster", "pv_forecast"},
+    "Coder": {"daily_energy_totals", "self_consumption_ratio", "peak_production_hour", "battery_min_max",
+              "energy_plot", "python_sandbox", "summed_historic_data", "live_data"},
+}
+TOOL_ARGS = {
+    "energy_optimizer": {"loads": [{"name": "appliance", "duration_minutes": 120, "power_kw": 1.2,
+                                    "earliest": "08:00", "latest": "20:00"}]},
+    "energy_plot": {"days": 3},
+}
+FILLER = "The solar system covers most of the demand around noon, so shift flexible loads there. "
+
+
+class ScriptedChatModel(BaseChatModel):
+    scripts: Dict[str, List[str]] = {}
+    seconds_per_call: float = 0.05
+    prefill_tokens_per_second: float = 5000.0
+    output_tokens_per_second: float = 80.0
+    answer_tokens: int = 120
+
+    @property
+    def _llm_type(self):
+        return "scripted"
+
+    def bind_functions(self, functions, function_call=None, **kwargs):
+        return self.bind(functions=functions, function_call={"name": function_call} if function_call else None,
+                         **kwargs)
+
+    def needed_nodes(self, query):
+        tools = set(self.scripts.get(query, []))
+        return [node for node, node_tools in NODE_TOOLS.items() if tools & node_tools]
+
+    def function_call(self, name, query, messages):
+        human = [message for message in messages if isinstance(message, HumanMessage)]
+        if name == "plan":
+            arguments = {"nodes": self.needed_nodes(query)}
+        else:
+            from router import visited_nodes
+
+            remaining = [node for node in self.needed_nodes(query) if node not in visited_nodes(human)]
+            arguments = {"next": remaining[0] if remaining else "Energy optimizer"}
+        return AIMessage(content="", additional_kwargs={"function_call": {"name": name,
+                                                                          "arguments": json.dumps(arguments)}})
+
+    def tool_step(self, query, available, messages):
+        called = {call["name"] for message in messages if isinstance(message, AIMessage)
+                  for call in message.tool_calls}
+        pending = [name for name in self.scripts.get(query, []) if name in available and name not in called]
+        if not pending:
+            return AIMessage(content=self.answer(query, messages))
+        return AIMessage(content="", tool_calls=[{"name": pending[0], "args": TOOL_ARGS.get(pending[0], {}),
+                                                  "id": f"call_{uuid.uuid4().hex[:12]}"}])
+
+    def answer(self, query, messages):
+        facts = [message.content.splitlines()[0][:120] for message in messages
+                 if isinstance(message, ToolMessage) and message.content]
+        text = "\n".join([f"Answer to: {query}", *facts])
+        while context_budget.count_tokens(text) < self.answer_tokens:
+            text += FILLER
+        return text
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        query = next((message.content for message in messages if isinstance(message, HumanMessage)), "")
+        if kwargs.get("functions"):
+            message = self.function_call(kwargs["function_call"]["name"], query, messages)
+        elif kwargs.get("tools"):
+            message = self.tool_step(query, {tool["function"]["name"] for tool in kwargs["tools"]}, messages)
+        else:
+            message = AIMessage(content=self.answer(query, messages))
+
+        prompt_tokens = context_budget.message_tokens(messages)
+        completion_tokens = context_budget.count_tokens(
+            message.content + json.dumps(message.tool_calls or message.additional_kwargs))
+        time.sleep(self.seconds_per_call + prompt_tokens / self.prefill_tokens_per_second
+                   + completion_tokens / self.output_tokens_per_second)
+        message.usage_metadata = {"input_tokens": prompt_tokens, "output_tokens": completion_tokens,
+                                  "total_tokens": prompt_tokens + completion_tokens}
+        return ChatResult(generations=[ChatGeneration(message=message)],
+                          llm_output={"token_usage": {"prompt_tokens": prompt_tokens,
+                                                      "completion_tokens": completion_tokens}})
+
+
+def solar_parquet(days=3, seed=0):
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp.now(tz="UTC").floor("min")
+    timestamps = pd.date_range(end - pd.Timedelta(days=days), end, freq="1min")
+    local_hours = timestamps.tz_convert(LOCAL_TIMEZONE).hour + timestamps.minute / 60
+    production = np.clip(np.sin((local_hours - 6) / 14 * np.pi), 0, None) * 8 * rng.uniform(0.4, 1.0, len(timestamps))
+    consumption = rng.gamma(2.0, 0.4, len(timestamps))
+    frame = pd.DataFrame({
+        "timestamp": timestamps,
+        "production": production.astype(np.float32),
+        "grid": (consumption - production).astype(np.float32),
+        "consumption": consumption.astype(np.float32),
+        "battery_status": rng.integers(20, 100, len(timestamps)).astype(np.uint8),
+    })
+    buffer = BytesIO()
+    frame.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+def daily_sums(days=3):
+    today = datetime.now(LOCAL_TIMEZONE).date()
+    return [{"date": (today - timedelta(days=days - 1 - day)).isoformat(), "consumption_positive": 17.6 + day,
+             "grid_negative": -36.1 - day, "grid_positive": 7.4 + day / 10, "production_positive": 46.3 + day}
+            for day in range(days)]
+
+
+def daily_forecast():
+    start = int(time.time()) // 86400 * 86400 + 43200
+    return {"list": [{"dt": start + day * 86400, "temp": {"day": 18.0 + day},
+                      "weather": [{"main": "Clear" if day % 3 else "Clouds"}], "clouds": 30 * (day % 4)}
+                     for day in range(7)]}
+
+
+def hourly_forecast():
+    start = int(time.time()) // 10800 * 10800
+    return {"list": [{"dt": start + step * 10800, "clouds": {"all": (step * 37) % 100}} for step in range(40)]}
+
+
+def live_snapshot():
+    return {"timestamp": datetime.now(LOCAL_TIMEZONE).isoformat(), "production_power": 3.2,
+            "net_consumption_power": -1.1, "total_consumption_power": 2.1, "battery_status": 64}
+
+
+class UpstreamStub:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.parquet = solar_parquet()
+        self.requests = {}
+        self.lock = threading.Lock()
+        self.routes = {
+            "/pi/solar-data": lambda: json.dumps(live_snapshot()).encode(),
+            "/cf/dailysums": lambda: json.dumps(daily_sums()).encode(),
+            "/cf/solar.parquet": lambda: self.parquet,
+            "/owm/forecast/daily": lambda: json.dumps(daily_forecast()).encode(),
+            "/owm/forecast": lambda: json.dumps(hourly_forecast()).encode(),
+        }
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                with stub.lock:
+                    stub.requests[path] = stub.requests.get(path, 0) + 1
+                time.sleep(stub.latency)
+                route = stub.routes.get(path)
+                body = route() if route else b'{"error": "not found"}'
+                self.send_response(200 if route else 404)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+
+
+def install_offline_modules(url):
+    config = types.ModuleType("myconfig")
+    config.url_to_raspberry_rest_api = url + "/pi/solar-data"
+    config.url_summed_up_data = url + "/cf/dailysums"
+    config.url_solar_parquet = url + "/cf/solar.parquet"
+    config.weather_url = url + "/owm/forecast/daily"
+    config.hourly_weather_url = url + "/owm/forecast"
+    config.pv_forecast_path = ":memory:"
+    keys = types.ModuleType("auth_keys")
+    keys.openai_api_key = keys.openweather_api_key = keys.langchain_api_key = "offline"
+    sys.modules.update(myconfig=config, auth_keys=keys)
+
+
+def build_pipelines(llm, names):
+    import streamlit_app_multi
+    import streamlit_app_single
+    from router import Router
+    from shared_utils import figure_sink
+    import http_client
+    import instrumentation
+
+    os.environ["LANGCHAIN_TRACING_V2"] = "false"
+
+    def multi_runner(planning):
+        system = streamlit_app_multi.create_agent_system(llm, Router())
+        graph = system.planning_graph if planning else system.graph
+
+        def run(query):
+            figures = queue.Queue()
+            token = figure_sink.set(figures)
+            try:
+                with instrumentation.request_trace("multi", query) as trace:
+                    events = list(streamlit_app_multi.stream_graph(graph, query, trace, figures))
+            finally:
+                figure_sink.reset(token)
+            return trace, next((payload for kind, payload in events if kind == "final"), None)
+
+        return run
+
+    def single_runner():
+        agent = streamlit_app_single.create_single_agent(llm)
+
+        def run(query):
+            events = queue.Queue()
+            with instrumentation.request_trace("single", query) as trace:
+                http_client.run_async(streamlit_app_single.publish_events(agent, query, events, trace))
+            finals = [payload for kind, payload in list(events.queue) if kind == "final"]
+            return trace, finals[-1] if finals else None
+
+        return run
+
+    factories = {"single": single_runner, "multi": lambda: multi_runner(True),
+                 "multi-supervisor": lambda: multi_runner(False)}
+    return {name: factories[name]() for name in names}
+
+
+def run_benchmark(run, corpus, sessions, rounds, cold):
+    from tool_cache import tool_cache
+
+    tool_cache.invalidate()
+    results = []
+    lock = threading.Lock()
+
+    def session(index):
+        for round_index in range(rounds):
+            for offset in range(len(corpus)):
+                query = corpus[(index + offset) % len(corpus)]["query"]
+                if cold:
+                    tool_cache.invalidate()
+                trace, answer = run(query)
+                summary = trace.summary()
+                with lock:
+                    results.append({"query": query, "answered": bool(answer), **summary})
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        list(executor.map(session, range(sessions)))
+    return results, time.perf_counter() - started
+
+
+def report(name, results, wall_seconds, verbose):
+    latencies = np.array([result["total_seconds"] for result in results]) * 1000
+    per_query = lambda key: np.mean([result[key] for result in results])
+    print(f"{name:>16} {len(results):>8} {np.percentile(latencies, 50):>8.0f} {np.percentile(latencies, 95):>8.0f} "
+          f"{latencies.max():>8.0f} {per_query('llm_calls'):>9.2f} {per_query('tool_calls'):>10.2f} "
+          f"{per_query('http_calls'):>10.2f} {per_query('tokens_in'):>13.0f} {len(results) / wall_seconds:>9.2f} "
+          f"{sum(not result['answered'] for result in results):>8}")
+    if verbose:
+        for query in dict.fromkeys(result["query"] for result in results):
+            selected = [result for result in results if result["query"] == query]
+            print(f"{'':>16} {np.median([result['total_seconds'] for result in selected]) * 1000:>7.0f} ms "
+                  f"{np.mean([result['llm_calls'] for result in selected]):>4.1f} llm "
+                  f"{np.mean([result['tool_calls'] for result in selected]):>4.1f} tools "
+                  f"{np.mean([result['tokens_in'] for result in selected]):>6.0f} tokens  {query}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the single- and multi-agent pipelines with a "
+                                                 "scripted chat model and local upstream stubs.")
+    parser.add_argument("--pipelines", default="single,multi,multi-supervisor")
+    parser.add_argument("--corpus", help="JSON list of {query, tools} entries replacing the built-in prompts")
+    parser.add_argument("--sessions", type=int, default=1, help="Concurrent chat sessions")
+    parser.add_argument("--rounds", type=int, default=2, help="Passes over the corpus per session")
+    parser.add_argument("--cold", action="store_true", help="Clear the tool cache before every query")
+    parser.add_argument("--llm-seconds-per-call", type=float, default=0.05)
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=5000.0)
+    parser.add_argument("--output-tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--upstream-latency-ms", type=float, default=20.0)
+    parser.add_argument("--verbose", action="store_true", help="Also print per-query results")
+    args = parser.parse_args()
+
+    corpus = CORPUS
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as corpus_file:
+            corpus = json.load(corpus_file)
+
+    stub = UpstreamStub(args.upstream_latency_ms / 1000).start()
+    install_offline_modules(stub.url)
+    llm = ScriptedChatModel(scripts={entry["query"]: entry.get("tools", []) for entry in corpus},
+                            seconds_per_call=args.llm_seconds_per_call,
+                            prefill_tokens_per_second=args.prefill_tokens_per_second,
+                            output_tokens_per_second=args.output_tokens_per_second)
+    pipelines = build_pipelines(llm, [name.strip() for name in args.pipelines.split(",") if name.strip()])
+
+    print(f"{len(corpus)} prompts, {args.sessions} concurrent sessions, {args.rounds} rounds, "
+          f"tool cache {'cold' if args.cold else 'warm'}")
+    print(f"{'pipeline':>16} {'queries':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'llm/query':>9} "
+          f"{'tools/query':>10} {'http/query':>10} {'prompt tokens':>13} {'queries/s':>9} {'failed':>8}")
+    try:
+        for name, run in pipelines.items():
+            results, wall_seconds = run_benchmark(run, corpus, args.sessions, args.rounds, args.cold)
+            report(name, results, wall_seconds, args.verbose)
+    finally:
+        stub.close()
+    print(f"upstream requests: {json.dumps(stub.requests)}")
+
+
+if __name__ == "__main__":
+    main()
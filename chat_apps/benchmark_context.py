@@ -0,0 +1,113 @@
+import argparse
+import time
+from datetime import datetime
+
+from langchain_core.messages import HumanMessage
+
+import context_budget
+import shared_utils
+import streamlit_app_multi as app
+
+QUESTION = "When should I run the dishwasher tomorrow and how much did we produce in the last three days?"
+AGENT_REMARK = "\nThe data has been retrieved with the tool."
+
+
+def historic_data():
+    return [{"date": f"2024-05-{day:02d}", "consumption_positive": 17.58 + day, "grid_negative": -36.12 - day,
+             "grid_positive": 7.41 + day / 10, "production_positive": 46.3 + day} for day in range(29, 32)]
+
+
+def weather_data():
+    return {"list": [{"dt": 1717200000 + day * 86400, "temp": {"day": 18.4 + day},
+                      "weather": [{"main": "Clouds" if day % 2 else "Clear"}], "clouds": 20 * day}
+                     for day in range(4)]}
+
+
+def legacy_format_summed_historic_data(data):
+    output_string = "Energy Historic Data last three days: \n"
+    for idx, entry in enumerate(data):
+        date_description = datetime.strptime(entry['date'], "%Y-%m-%d").strftime("%d.%m.%Y")
+        if idx == len(data) - 1:
+            date_description += " (today)"
+        output_string += f"""
+    Date: {date_description}
+    - Consumption Positive: {entry['consumption_positive']}
+    - Grid Negative: {entry['grid_negative']}
+    - Grid Positive: {entry['grid_positive']}
+    - Production Positive: {entry['production_positive']}
+        """
+    return output_string + ("\n \nGrid Positive is how much was drawn from the grid. \nGrid negative is how much "
+                            "was fed into the grid.")
+
+
+def legacy_format_weather_forecast(data):
+    output_string = "\nWeather Forecast\n"
+    for i, day in enumerate(data["list"][:4]):
+        label = "Today's Forecast:" if i == 0 else f"Day {i} -"
+        output_string += f"""{label}
+Date: {datetime.utcfromtimestamp(day["dt"]).strftime('%Y-%m-%d')}
+Temperature: {day["temp"]["day"]} °C
+Weather: {day["weather"][0]["main"]}
+Cloud Coverage: {day["clouds"]}%
+
+"""
+    return output_string
+
+
+def legacy_weather_message(question, output):
+    return HumanMessage(content=f"{question}\n____additional information____\n\n{output}\n"
+                                "The data has successfully been retrieved.")
+
+
+def prompt_tokens(system_prompt, messages, scratchpad=""):
+    return (context_budget.count_tokens(system_prompt) + context_budget.message_tokens(messages)
+            + context_budget.count_tokens(scratchpad))
+
+
+def supervisor_loop(compact):
+    started = time.perf_counter()
+    weather_text = (shared_utils.format_weather_forecast if compact else legacy_format_weather_forecast)(
+        weather_data())
+    historic_text = (shared_utils.format_summed_historic_data if compact else legacy_format_summed_historic_data)(
+        historic_data())
+    prepare = context_budget.apply_budget if compact else list
+
+    messages = [HumanMessage(content=QUESTION)]
+    calls = [prompt_tokens(app.system_prompt, prepare(messages))]
+    calls += [prompt_tokens(app.WEATHER_RETRIEVER_PROMPT, prepare(messages)),
+              prompt_tokens(app.WEATHER_RETRIEVER_PROMPT, prepare(messages), weather_text)]
+    if compact:
+        messages.append(HumanMessage(content="Weather Retriever says: \n" + weather_text + AGENT_REMARK))
+    else:
+        messages.append(legacy_weather_message(QUESTION, weather_text + AGENT_REMARK))
+
+    calls.append(prompt_tokens(app.system_prompt, prepare(messages)))
+    calls += [prompt_tokens(app.CODER_PROMPT, prepare(messages)),
+              prompt_tokens(app.CODER_PROMPT, prepare(messages), historic_text)]
+    messages.append(HumanMessage(content="Coder says: \n" + historic_text + AGENT_REMARK))
+
+    calls.append(prompt_tokens(app.system_prompt, prepare(messages)))
+    calls.append(prompt_tokens(app.ENERGY_OPTIMIZER_PROMPT, prepare(messages)))
+    return calls, (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare prompt tokens per request before and after compaction.")
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=2500.0,
+                        help="Assumed prompt processing speed of the model to estimate latency")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    method = "tiktoken o200k_base" if context_budget.encoding() is not None else "4 characters per token estimate"
+    print(f"token counts: {method}")
+    print(f"{'variant':>8} {'llm calls':>10} {'prompt tokens':>14} {'largest call':>13} {'local ms':>9} "
+          f"{'est. prefill s':>15}")
+    for label, compact in (("before", False), ("after", True)):
+        runs = [supervisor_loop(compact) for _ in range(args.repeat)]
+        calls, local_ms = runs[0][0], sorted(run[1] for run in runs)[len(runs) // 2]
+        print(f"{label:>8} {len(calls):>10} {sum(calls):>14} {max(calls):>13} {local_ms:>9.2f} "
+              f"{sum(calls) / args.prefill_tokens_per_second:>15.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import argparse
+import os
+import runpy
+import subprocess
+import sys
+import time
+
+APPS = {"multi": ("streamlit_app_multi", "build_agent_system"), "single": ("streamlit_app_single", "build_agent")}
+
+
+def rerun(module_name, factory_name):
+    start = time.perf_counter()
+    namespace = runpy.run_module(module_name, run_name=module_name)
+    namespace[factory_name]()
+    return (time.perf_counter() - start) * 1000
+
+
+def measure(app, reruns):
+    module_name, factory_name = APPS[app]
+    timings = [rerun(module_name, factory_name) for _ in range(reruns + 1)]
+    print(f"{app:>8} {timings[0]:>12.1f} {min(timings[1:]):>12.1f} {sum(timings[1:]) / reruns:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time a cold start and warm Streamlit reruns of the chat apps.")
+    parser.add_argument("--reruns", type=int, default=5)
+    parser.add_argument("--app", choices=APPS)
+    args = parser.parse_args()
+
+    if args.app:
+        measure(args.app, args.reruns)
+        return
+
+    print(f"{'app':>8} {'cold ms':>12} {'warm min ms':>12} {'warm avg ms':>12}")
+    environment = dict(os.environ, OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "benchmark"))
+    for app in APPS:
+        subprocess.run([sys.executable, __file__, "--app", app, "--reruns", str(args.reruns)], env=environment,
+                       check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import functools
+import re
+
+MAX_CONTEXT_TOKENS = 3000
+KEEP_RECENT = 2
+SUMMARY_TOKENS = 250
+CHARACTERS_PER_TOKEN = 4
+WHITESPACE = re.compile(r"\s+")
+NUMBER = re.compile(r"\d")
+MIN_CONTAINED_CHARACTERS = 200
+
+
+@functools.lru_cache(maxsize=1)
+def encoding():
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text):
+    tokenizer = encoding()
+    if tokenizer is None:
+        return max(1, len(text) // CHARACTERS_PER_TOKEN) if text else 0
+    return len(tokenizer.encode(text, disallowed_special=()))
+
+
+def message_tokens(messages):
+    return sum(count_tokens(message.content) + 4 for message in messages)
+
+
+def compact_table(columns, rows):
+    lines = [",".join(columns)]
+    for row in rows:
+        lines.append(",".join("" if value is None else str(value) for value in row))
+    return "\n".join(lines)
+
+
+def frame_table(frame, float_format="%.2f"):
+    return frame.to_csv(float_format=float_format, lineterminator="\n").strip()
+
+
+def normalized(text):
+    return WHITESPACE.sub(" ", text).strip().lower()
+
+
+def dedupe(messages):
+    contents = [normalized(message.content) for message in messages]
+    kept, seen = [], set()
+    for index, (message, content) in enumerate(zip(messages, contents)):
+        contained = len(content) >= MIN_CONTAINED_CHARACTERS and any(
+            content in later and content != later for later in contents[index + 1:])
+        if index > 0 and (content in seen or contained):
+            continue
+        kept.append(message)
+        seen.add(content)
+    return kept
+
+
+def summarize(text, max_tokens=SUMMARY_TOKENS):
+    if count_tokens(text) <= max_tokens:
+        return text
+    lines = [line for line in text.splitlines() if line.strip()]
+    budget = max_tokens * CHARACTERS_PER_TOKEN
+    selected = set(range(min(2, len(lines))))
+    used = sum(len(lines[index]) for index in selected)
+    for index, line in enumerate(lines):
+        if index not in selected and NUMBER.search(line) and used + len(line) <= budget:
+            selected.add(index)
+            used += len(line)
+    summary = [lines[index][:budget] for index in sorted(selected)]
+    omitted = len(lines) - len(selected)
+    if omitted:
+        summary.append(f"[{omitted} more lines omitted]")
+    return "\n".join(summary)
+
+
+def apply_budget(messages, max_tokens=MAX_CONTEXT_TOKENS, keep_recent=KEEP_RECENT):
+    messages = dedupe(list(messages))
+    if len(messages) <= keep_recent + 1 or message_tokens(messages) <= max_tokens:
+        return messages
+
+    older = range(1, len(messages) - keep_recent)
+    compacted = list(messages)
+    for index in older:
+        content = summarize(messages[index].content)
+        if content != messages[index].content:
+            compacted[index] = type(messages[index])(content=content)
+        if message_tokens(compacted) <= max_tokens:
+            return compacted
+
+    for index in range(max(1, len(messages) - keep_recent), len(messages)):
+        content = summarize(compacted[index].content, max_tokens // (keep_recent + 1))
+        if content != compacted[index].content:
+            compacted[index] = type(compacted[index])(content=content)
+    return compacted
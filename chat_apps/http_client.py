@@ -0,0 +1,203 @@
+import asyncio
+import threading
+import time
+import weakref
+
+import httpx
+
+import instrumentation
+
+LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60)
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=3, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_running:
+                return False
+            self.trial_running = True
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        with self.lock:
+            self.trial_running = False
+
+
+class Upstream:
+    def __init__(self, name, timeout, retries=2, backoff=0.2, breaker=None):
+        self.name = name
+        self.timeout = httpx.Timeout(timeout, connect=min(timeout, 5.0))
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+
+
+UPSTREAMS = {
+    "raspberry": Upstream("raspberry", timeout=5.0),
+    "cloud_functions": Upstream("cloud_functions", timeout=30.0),
+    "openweathermap": Upstream("openweathermap", timeout=10.0),
+}
+
+sync_client = httpx.Client(limits=LIMITS)
+async_clients = weakref.WeakKeyDictionary()
+background_loop = None
+background_lock = threading.Lock()
+
+
+def event_loop():
+    global background_loop
+    with background_lock:
+        if background_loop is None:
+            background_loop = asyncio.new_event_loop()
+            threading.Thread(target=background_loop.run_forever, name="async-loop", daemon=True).start()
+    return background_loop
+
+
+def run_async(coroutine):
+    return asyncio.run_coroutine_threadsafe(coroutine, event_loop()).result()
+
+
+def iterate_async(iterator):
+    loop = event_loop()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(anext(iterator), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        asyncio.run_coroutine_threadsafe(iterator.aclose(), loop).result()
+
+
+def async_client():
+    loop = asyncio.get_running_loop()
+    client = async_clients.get(loop)
+    if client is None:
+        client = async_clients[loop] = httpx.AsyncClient(limits=LIMITS)
+    return client
+
+
+def upstream_fault(status_code):
+    return status_code >= 500 or status_code == 429
+
+
+def check_response(upstream, response):
+    if response.status_code in RETRY_STATUS_CODES:
+        raise httpx.HTTPStatusError(f"{upstream.name} responded with {response.status_code}",
+                                    request=response.request, response=response)
+    response.raise_for_status()
+    return response
+
+
+def request(upstream_name, url, params=None):
+    upstream = UPSTREAMS[upstream_name]
+    if not upstream.breaker.allow():
+        raise UpstreamError(f"Circuit for {upstream.name} is open")
+
+    try:
+        for attempt in range(upstream.retries + 1):
+            started = time.perf_counter()
+            try:
+                response = check_response(upstream, sync_client.get(url, params=params, timeout=upstream.timeout))
+                instrumentation.record_http(upstream.name, url, started, response.status_code)
+                upstream.breaker.success()
+                return response
+            except httpx.HTTPStatusError as error:
+                status_code = error.response.status_code
+                instrumentation.record_http(upstream.name, url, started, status_code)
+                if not upstream_fault(status_code):
+                    upstream.breaker.success()
+                    raise UpstreamError(str(error)) from error
+                if status_code not in RETRY_STATUS_CODES or attempt == upstream.retries:
+                    upstream.breaker.failure()
+                    raise UpstreamError(str(error)) from error
+            except httpx.TransportError as error:
+                instrumentation.record_http(upstream.name, url, started, type(error).__name__)
+                if attempt == upstream.retries:
+                    upstream.breaker.failure()
+                    raise UpstreamError(f"{upstream.name} is unreachable: {error}") from error
+            time.sleep(upstream.backoff * 2 ** attempt)
+    except UpstreamError:
+        raise
+    except BaseException:
+        upstream.breaker.release()
+        raise
+
+
+async def arequest(upstream_name, url, params=None):
+    upstream = UPSTREAMS[upstream_name]
+    if not upstream.breaker.allow():
+        raise UpstreamError(f"Circuit for {upstream.name} is open")
+
+    try:
+        client = async_client()
+        for attempt in range(upstream.retries + 1):
+            started = time.perf_counter()
+            try:
+                response = check_response(upstream, await client.get(url, params=params, timeout=upstream.timeout))
+                instrumentation.record_http(upstream.name, url, started, response.status_code)
+                upstream.breaker.success()
+                return response
+            except httpx.HTTPStatusError as error:
+                status_code = error.response.status_code
+                instrumentation.record_http(upstream.name, url, started, status_code)
+                if not upstream_fault(status_code):
+                    upstream.breaker.success()
+                    raise UpstreamError(str(error)) from error
+                if status_code not in RETRY_STATUS_CODES or attempt == upstream.retries:
+                    upstream.breaker.failure()
+                    raise UpstreamError(str(error)) from error
+            except httpx.TransportError as error:
+                instrumentation.record_http(upstream.name, url, started, type(error).__name__)
+                if attempt == upstream.retries:
+                    upstream.breaker.failure()
+                    raise UpstreamError(f"{upstream.name} is unreachable: {error}") from error
+            await asyncio.sleep(upstream.backoff * 2 ** attempt)
+    except UpstreamError:
+        raise
+    except BaseException:
+        upstream.breaker.release()
+        raise
+
+
+def decode_json(upstream_name, response):
+    try:
+        return response.json()
+    except ValueError as error:
+        raise UpstreamError(f"{upstream_name} returned invalid JSON: {error}") from error
+
+
+def request_json(upstream_name, url, params=None):
+    return decode_json(upstream_name, request(upstream_name, url, params))
+
+
+async def arequest_json(upstream_name, url, params=None):
+    return decode_json(upstream_name, await arequest(upstream_name, url, params))
@@ -0,0 +1,199 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+import uuid
+from collections import deque, namedtuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+Span = namedtuple("Span", ["kind", "name", "start", "end", "attributes"])
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+recent_traces = deque(maxlen=50)
+metrics_lock = threading.Lock()
+metrics_started = False
+
+if prometheus_client is not None:
+    REQUEST_SECONDS = prometheus_client.Histogram("chat_request_seconds", "Wall time of a chat request", ["app"])
+    SPAN_SECONDS = prometheus_client.Histogram("chat_span_seconds", "Wall time of nodes, tools, LLM and HTTP calls",
+                                               ["kind", "name"])
+    LLM_TOKENS = prometheus_client.Counter("chat_llm_tokens", "LLM tokens", ["direction"])
+    CACHE_EVENTS = prometheus_client.Counter("chat_tool_cache_events", "Tool cache lookups by result", ["result"])
+
+
+class RequestTrace:
+    def __init__(self, app, query):
+        self.id = uuid.uuid4().hex[:12]
+        self.app = app
+        self.query = query
+        self.started = time.perf_counter()
+        self.finished = None
+        self.spans = []
+        self.counters = {"tokens_in": 0, "tokens_out": 0, "llm_calls": 0, "tool_calls": 0, "http_calls": 0,
+                         "cache_hits": 0, "cache_misses": 0}
+        self.lock = threading.Lock()
+
+    def add(self, kind, name, start, end, **attributes):
+        with self.lock:
+            self.spans.append(Span(kind, name, start, end, attributes))
+        if prometheus_client is not None:
+            SPAN_SECONDS.labels(kind, name).observe(end - start)
+
+    def count(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def timeline(self):
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        return [{
+            "offset_ms": round((span.start - self.started) * 1000),
+            "duration_ms": round((span.end - span.start) * 1000),
+            "kind": span.kind,
+            "name": span.name,
+            **span.attributes,
+        } for span in spans]
+
+    def summary(self):
+        total = (self.finished or time.perf_counter()) - self.started
+        busy = {}
+        with self.lock:
+            for span in self.spans:
+                busy[span.kind] = busy.get(span.kind, 0.0) + span.end - span.start
+            counters = dict(self.counters)
+        return {"request_id": self.id, "total_seconds": round(total, 3), **counters,
+                **{f"{kind}_seconds": round(seconds, 3) for kind, seconds in busy.items()}}
+
+
+@contextlib.contextmanager
+def request_trace(app, query):
+    trace = RequestTrace(app, query)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+        trace.finished = time.perf_counter()
+        recent_traces.append(trace)
+        if prometheus_client is not None:
+            REQUEST_SECONDS.labels(app).observe(trace.finished - trace.started)
+
+
+@contextlib.contextmanager
+def span(kind, name, **attributes):
+    trace = current_trace.get()
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        if trace is not None:
+            trace.add(kind, name, start, time.perf_counter(), **attributes)
+
+
+def instrumented(kind, name=None):
+    def decorator(function):
+        label = name or function.__name__
+
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with span(kind, kwargs.get("name", label)):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(kind, kwargs.get("name", label)):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_http(upstream, url, start, status):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.count("http_calls")
+        trace.add("http", upstream, start, time.perf_counter(), url=url, status=status)
+
+
+def record_cache(result):
+    if prometheus_client is not None:
+        CACHE_EVENTS.labels(result).inc()
+    trace = current_trace.get()
+    if trace is not None and result in ("hits", "stale_hits", "misses"):
+        trace.count("cache_misses" if result == "misses" else "cache_hits")
+
+
+def token_usage(response):
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                return metadata.get("input_tokens", 0), metadata.get("output_tokens", 0)
+    return 0, 0
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    def __init__(self, trace):
+        self.trace = trace
+        self.started = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self.started[run_id] = (time.perf_counter(), (metadata or {}).get("langgraph_node", "llm"))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self.started[run_id] = (time.perf_counter(), (metadata or {}).get("langgraph_node", "llm"))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        start, node = self.started.pop(run_id, (time.perf_counter(), "llm"))
+        tokens_in, tokens_out = token_usage(response)
+        self.trace.count("llm_calls")
+        self.trace.count("tokens_in", tokens_in)
+        self.trace.count("tokens_out", tokens_out)
+        self.trace.add("llm", node, start, time.perf_counter(), tokens_in=tokens_in, tokens_out=tokens_out)
+        if prometheus_client is not None:
+            LLM_TOKENS.labels("in").inc(tokens_in)
+            LLM_TOKENS.labels("out").inc(tokens_out)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        start, node = self.started.pop(run_id, (time.perf_counter(), "llm"))
+        self.trace.add("llm", node, start, time.perf_counter(), error=type(error).__name__)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self.started[run_id] = (time.perf_counter(), (serialized or {}).get("name", "tool"))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        start, name = self.started.pop(run_id, (time.perf_counter(), "tool"))
+        self.trace.count("tool_calls")
+        self.trace.add("tool", name, start, time.perf_counter())
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        start, name = self.started.pop(run_id, (time.perf_counter(), "tool"))
+        self.trace.add("tool", name, start, time.perf_counter(), error=type(error).__name__)
+
+
+def start_metrics_server(port):
+    global metrics_started
+    with metrics_lock:
+        if metrics_started or not port:
+            return metrics_started
+        if prometheus_client is None:
+            print("prometheus_client is not installed, /metrics is disabled")
+            return False
+        prometheus_client.start_http_server(port)
+        metrics_started = True
+        return True
@@ -0,0 +1,178 @@
+import json
+import sqlite3
+import threading
+
+import numpy as np
+
+LATITUDE = 49.300652
+LONGITUDE = 10.571460
+SECONDS_PER_HOUR = 3600
+SUBSAMPLES_PER_HOUR = 6
+MIN_CLEAR_SKY = 0.05
+ENVELOPE_BINS = np.linspace(0, 50, 201)
+ENVELOPE_QUANTILE = 0.95
+
+
+def cos_zenith(seconds, latitude=LATITUDE, longitude=LONGITUDE):
+    seconds = np.asarray(seconds, dtype=np.int64)
+    moments = seconds.astype('datetime64[s]')
+    day_of_year = (moments.astype('datetime64[D]') - moments.astype('datetime64[Y]')).astype(np.int64) + 1
+    hours = (seconds % 86400) / 3600
+    gamma = 2 * np.pi / 365 * (day_of_year - 1 + (hours - 12) / 24)
+    equation_of_time = 229.18 * (0.000075 + 0.001868 * np.cos(gamma) - 0.032077 * np.sin(gamma)
+                                 - 0.014615 * np.cos(2 * gamma) - 0.040849 * np.sin(2 * gamma))
+    declination = (0.006918 - 0.399912 * np.cos(gamma) + 0.070257 * np.sin(gamma) - 0.006758 * np.cos(2 * gamma)
+                   + 0.000907 * np.sin(2 * gamma) - 0.002697 * np.cos(3 * gamma) + 0.00148 * np.sin(3 * gamma))
+    hour_angle = np.radians((hours * 60 + equation_of_time + 4 * longitude) / 4 - 180)
+    latitude = np.radians(latitude)
+    return np.sin(latitude) * np.sin(declination) + np.cos(latitude) * np.cos(declination) * np.cos(hour_angle)
+
+
+def clear_sky(seconds, latitude=LATITUDE, longitude=LONGITUDE):
+    cosine = np.clip(cos_zenith(seconds, latitude, longitude), 0, None)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        irradiance = np.where(cosine > 0, 1.098 * cosine * np.exp(-0.059 / np.maximum(cosine, 1e-6)), 0.0)
+    return irradiance
+
+
+def hourly_clear_sky(hours, latitude=LATITUDE, longitude=LONGITUDE):
+    offsets = (np.arange(SUBSAMPLES_PER_HOUR) + 0.5) * SECONDS_PER_HOUR / SUBSAMPLES_PER_HOUR
+    seconds = np.asarray(hours, dtype=np.int64)[:, None] * SECONDS_PER_HOUR + offsets.astype(np.int64)
+    return clear_sky(seconds, latitude, longitude).mean(axis=1)
+
+
+def cloud_factor(cloud_percent):
+    return 1 - 0.75 * (np.clip(np.asarray(cloud_percent, dtype=np.float64), 0, 100) / 100) ** 3.4
+
+
+def features(hours, cloud_percent, latitude=LATITUDE, longitude=LONGITUDE):
+    return hourly_clear_sky(hours, latitude, longitude) * cloud_factor(cloud_percent)
+
+
+def hourly_clouds(weather):
+    entries = weather.get("list", [])
+    if not entries:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    points = np.array([entry["dt"] for entry in entries], dtype=np.int64) / SECONDS_PER_HOUR
+    clouds = np.array([entry["clouds"]["all"] for entry in entries], dtype=np.float64)
+    hours = np.arange(int(np.floor(points[0])) - 1, int(np.ceil(points[-1])) + 2)
+    return hours, np.interp(hours + 0.5, points, clouds)
+
+
+class HourlyRegression:
+    def __init__(self, prior_weight=4.0, prior_slope=0.0):
+        self.stats = np.zeros((24, 5))
+        self.prior_weight = prior_weight
+        self.prior_slope = prior_slope
+
+    def update(self, hours, x, y):
+        hours, x, y = np.asarray(hours, dtype=np.int64), np.asarray(x, dtype=np.float64), np.asarray(y)
+        np.add.at(self.stats, hours % 24, np.stack([np.ones_like(x), x, y, x * x, x * y], axis=1))
+
+    @staticmethod
+    def solve(stats, weight, slope, intercept):
+        count, sum_x, sum_y, sum_xx, sum_xy = stats
+        matrix = np.array([[sum_xx + weight, sum_x], [sum_x, count + weight]])
+        vector = np.array([sum_xy + weight * slope, sum_y + weight * intercept])
+        return np.linalg.solve(matrix, vector)
+
+    def coefficients(self):
+        pooled = self.solve(self.stats.sum(axis=0), self.prior_weight, self.prior_slope, 0.0)
+        return np.array([self.solve(stats, self.prior_weight, *pooled) for stats in self.stats])
+
+    def predict(self, hours, x):
+        coefficients = self.coefficients()[np.asarray(hours, dtype=np.int64) % 24]
+        x = np.asarray(x, dtype=np.float64)
+        return np.where(x > 0, np.maximum(coefficients[:, 0] * x + coefficients[:, 1], 0), 0.0)
+
+
+class PVForecaster:
+    def __init__(self, path=":memory:", latitude=LATITUDE, longitude=LONGITUDE, prior_weight=4.0):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS weather (hour INTEGER PRIMARY KEY, cloud REAL NOT NULL, lead REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+        self.model = HourlyRegression(prior_weight)
+        self.envelope = np.zeros(len(ENVELOPE_BINS) - 1)
+        self.trained_until = None
+        self.load_state()
+
+    def load_state(self):
+        state = dict(self.connection.execute("SELECT key, value FROM state"))
+        if "stats" in state:
+            self.model.stats = np.array(json.loads(state["stats"]))
+            self.envelope = np.array(json.loads(state["envelope"]))
+            self.trained_until = int(state["trained_until"])
+        self.model.prior_slope = self.envelope_slope()
+
+    def save_state(self):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", [
+                ("stats", json.dumps(self.model.stats.tolist())),
+                ("envelope", json.dumps(self.envelope.tolist())),
+                ("trained_until", str(self.trained_until)),
+            ])
+
+    def envelope_slope(self):
+        total = self.envelope.sum()
+        if not total:
+            return 0.0
+        index = np.searchsorted(np.cumsum(self.envelope), ENVELOPE_QUANTILE * total)
+        return float(ENVELOPE_BINS[min(index + 1, len(ENVELOPE_BINS) - 1)])
+
+    def log_weather(self, hours, clouds, now_hour):
+        rows = [(int(hour), float(cloud), float(hour - now_hour)) for hour, cloud in zip(hours, clouds)]
+        with self.lock, self.connection:
+            self.connection.executemany("""
+                INSERT INTO weather (hour, cloud, lead) VALUES (?, ?, ?)
+                ON CONFLICT(hour) DO UPDATE SET cloud = excluded.cloud, lead = excluded.lead
+                WHERE abs(excluded.lead) <= abs(weather.lead)
+            """, rows)
+
+    def logged_clouds(self, first_hour, last_hour):
+        rows = self.connection.execute("SELECT hour, cloud FROM weather WHERE hour BETWEEN ? AND ? ORDER BY hour",
+                                       (first_hour, last_hour)).fetchall()
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        hours, clouds = zip(*rows)
+        return np.array(hours, dtype=np.int64), np.array(clouds)
+
+    def train(self, hours, production_kwh, complete_before):
+        hours = np.asarray(hours, dtype=np.int64)
+        production_kwh = np.asarray(production_kwh, dtype=np.float64)
+        with self.lock:
+            fresh = (hours < complete_before) & ~np.isnan(production_kwh)
+            if self.trained_until is not None:
+                fresh &= hours > self.trained_until
+            hours, production_kwh = hours[fresh], production_kwh[fresh]
+            if not len(hours):
+                return 0
+
+            clear = hourly_clear_sky(hours, self.latitude, self.longitude)
+            daylight = clear > MIN_CLEAR_SKY
+            self.envelope += np.histogram(production_kwh[daylight] / clear[daylight], bins=ENVELOPE_BINS)[0]
+            self.model.prior_slope = self.envelope_slope()
+
+            logged_hours, clouds = self.logged_clouds(int(hours.min()), int(hours.max()))
+            matched = np.isin(hours, logged_hours) & daylight
+            if matched.any():
+                cloud = clouds[np.searchsorted(logged_hours, hours[matched])]
+                x = clear[matched] * cloud_factor(cloud)
+                self.model.update(hours[matched], x, production_kwh[matched])
+
+            self.trained_until = int(hours.max())
+            self.save_state()
+            return int(matched.sum())
+
+    def forecast(self, hours, cloud_hours, clouds):
+        hours = np.asarray(hours, dtype=np.int64)
+        cloud = np.interp(hours, cloud_hours, clouds) if len(cloud_hours) else np.zeros(len(hours))
+        with self.lock:
+            return self.model.predict(hours, features(hours, cloud, self.latitude, self.longitude))
+
+    def close(self):
+        self.connection.close()
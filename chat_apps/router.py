@@ -0,0 +1,237 @@
+import json
+import os
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+WEATHER_RETRIEVER = "Weather Retriever"
+CODER = "Coder"
+ENERGY_OPTIMIZER = "Energy optimizer"
+DATA_NODES = [WEATHER_RETRIEVER, CODER]
+
+APPLIANCES = (r"dishwasher|washing machine|dryer|laundry|charge (my|the) (car|ev)|"
+              r"spülmaschine|geschirrspüler|waschmaschine|trockner|wäsche|auto laden")
+KEYWORD_RULES = {
+    WEATHER_RETRIEVER: re.compile(
+        r"\b(?:weather|forecasts?|rain(?:s|y|ing)?|sunny|sunshine|cloud(?:s|y)?|temperatur\w*|wetter\w*|"
+        r"vorhersage|prognose|regen|sonnig|sonnenschein|wolk\w*|when should i|best time|wann sollte|beste zeit|"
+        rf"{APPLIANCES})\b",
+        re.IGNORECASE),
+    CODER: re.compile(
+        r"\b(?:plot(?:s|ted|ting)?|charts?|graphs?|visuali[sz]\w*|diagrams?|production|produced|consumption|"
+        r"consumed|grid|battery|batteries|kwh|historic(?:al)?|solar data|last (three|3) days|"
+        r"diagramm|grafik|produktion|produziert|erzeugt|verbrauch\w*|netz|netzbezug|netzeinspeisung|"
+        rf"batterie\w*|akku\w*|solardaten|letzten (drei|3) tage|{APPLIANCES})\b",
+        re.IGNORECASE),
+}
+OPTIMIZER_RULE = re.compile(r"\b(?:optimi[sz]\w*|tips?|advice|recommend\w*|save energy|energie sparen|empfehl\w*|"
+                            r"ratschlag)\b",
+                            re.IGNORECASE)
+
+EMBEDDING_DIMENSIONS = 1024
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def embed(text, dimensions=EMBEDDING_DIMENSIONS):
+    vector = np.zeros(dimensions, dtype=np.float32)
+    words = TOKEN_PATTERN.findall(text.lower())
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f"#{word}#"
+        features += [padded[i:i + 3] for i in range(len(padded) - 2)]
+    for feature in features:
+        vector[zlib.crc32(feature.encode()) % dimensions] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def visited_nodes(messages):
+    visited = set()
+    for message in messages[1:]:
+        content = message.content
+        if content.startswith(CODER + ' says:'):
+            visited.add(CODER)
+        elif content.startswith(WEATHER_RETRIEVER + ' says:') or "____additional information____" in content:
+            visited.add(WEATHER_RETRIEVER)
+    return visited
+
+
+class RouterStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.decisions = {"rule": 0, "knn": 0, "llm": 0}
+        self.router_latencies = []
+        self.llm_latencies = []
+
+    def record(self, source, router_seconds, llm_seconds=None):
+        with self.lock:
+            self.decisions[source] += 1
+            self.router_latencies.append(router_seconds)
+            if llm_seconds is not None:
+                self.llm_latencies.append(llm_seconds)
+
+    def summary(self):
+        with self.lock:
+            total = sum(self.decisions.values())
+            avoided = total - self.decisions["llm"]
+            return {
+                "routing_calls": total,
+                "llm_calls_avoided": avoided,
+                "llm_calls_avoided_fraction": avoided / total if total else 0.0,
+                "decisions": dict(self.decisions),
+                "router_p50_ms": percentile(self.router_latencies, 50) * 1000,
+                "router_p95_ms": percentile(self.router_latencies, 95) * 1000,
+                "llm_p50_ms": percentile(self.llm_latencies, 50) * 1000,
+                "llm_p95_ms": percentile(self.llm_latencies, 95) * 1000,
+                "estimated_saved_p50_ms": (percentile(self.llm_latencies, 50)
+                                           - percentile(self.router_latencies, 50)) * 1000,
+                "estimated_saved_p95_ms": (percentile(self.llm_latencies, 95)
+                                           - percentile(self.router_latencies, 95)) * 1000,
+            }
+
+
+class Router:
+    def __init__(self, log_path=None, k=5, min_similarity=0.55, min_vote=0.8, min_support=2):
+        self.log_path = log_path
+        self.k = k
+        self.min_similarity = min_similarity
+        self.min_vote = min_vote
+        self.min_support = min_support
+        self.lock = threading.Lock()
+        self.vectors = np.zeros((0, EMBEDDING_DIMENSIONS), dtype=np.float32)
+        self.labels = []
+        self.stats = RouterStats()
+        if log_path and os.path.exists(log_path):
+            self.load(log_path)
+
+    def load(self, log_path):
+        with open(log_path, encoding="utf-8") as log_file:
+            examples = [json.loads(line) for line in log_file if line.strip()]
+        if examples:
+            self.vectors = np.stack([embed(example["query"]) for example in examples])
+            self.labels = [example["next"] for example in examples]
+
+    def learn(self, query, next_node):
+        with self.lock:
+            self.vectors = np.vstack([self.vectors, embed(query)[None, :]])
+            self.labels.append(next_node)
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as log_file:
+                    log_file.write(json.dumps({"query": query, "next": next_node}, ensure_ascii=False) + "\n")
+
+    def rule_route(self, query, visited):
+        needed = [node for node in DATA_NODES if KEYWORD_RULES[node].search(query)]
+        if needed:
+            remaining = [node for node in needed if node not in visited]
+            return remaining[0] if remaining else ENERGY_OPTIMIZER
+        if OPTIMIZER_RULE.search(query) and not visited:
+            return ENERGY_OPTIMIZER
+        return None
+
+    def knn_route(self, query):
+        with self.lock:
+            vectors, labels = self.vectors, list(self.labels)
+        if not labels:
+            return None
+
+        similarities = vectors @ embed(query)
+        nearest = np.argsort(similarities)[::-1][:self.k]
+        nearest = [index for index in nearest if similarities[index] >= self.min_similarity]
+        if len(nearest) < self.min_support:
+            return None
+
+        votes = {}
+        for index in nearest:
+            votes[labels[index]] = votes.get(labels[index], 0.0) + float(similarities[index])
+        label, weight = max(votes.items(), key=lambda item: item[1])
+        return label if weight / sum(votes.values()) >= self.min_vote else None
+
+    def route(self, state):
+        messages = state["messages"]
+        query = messages[0].content
+        visited = visited_nodes(messages)
+
+        next_node = self.rule_route(query, visited)
+        if next_node is not None:
+            return next_node, "rule"
+        if not visited:
+            next_node = self.knn_route(query)
+            if next_node is not None:
+                return next_node, "knn"
+        return None, "llm"
+
+    def rule_plan(self, query):
+        needed = [node for node in DATA_NODES if KEYWORD_RULES[node].search(query)]
+        if needed:
+            return needed
+        if OPTIMIZER_RULE.search(query):
+            return []
+        return None
+
+    def plan(self, state, planner_chain):
+        started = time.perf_counter()
+        query = state["messages"][0].content
+        source = "rule"
+        plan = self.rule_plan(query)
+        if plan is None:
+            source = "knn"
+            label = self.knn_route(query)
+            if label is not None:
+                plan = [label] if label in DATA_NODES else []
+        planned = time.perf_counter()
+        if plan is not None:
+            self.stats.record(source, planned - started)
+            return plan
+
+        plan = [node for node in planner_chain.invoke(state).get("nodes", []) if node in DATA_NODES]
+        self.stats.record("llm", planned - started, time.perf_counter() - planned)
+        return plan
+
+    def supervise(self, state, supervisor_chain):
+        started = time.perf_counter()
+        next_node, source = self.route(state)
+        routed = time.perf_counter()
+        if next_node is not None:
+            self.stats.record(source, routed - started)
+            return {"next": next_node}
+
+        result = supervisor_chain.invoke(state)
+        self.stats.record(source, routed - started, time.perf_counter() - routed)
+        if not visited_nodes(state["messages"]):
+            self.learn(state["messages"][0].content, result["next"])
+        return result
+
+
+KEYWORD_CASES = [
+    ("Will it rain tomorrow?", [WEATHER_RETRIEVER]),
+    ("Wie wird das Wetter morgen, eher wolkig?", [WEATHER_RETRIEVER]),
+    ("When should I run the dishwasher?", [WEATHER_RETRIEVER, CODER]),
+    ("Wann sollte ich die Waschmaschine anmachen?", [WEATHER_RETRIEVER, CODER]),
+    ("When should I leave for the airport?", [WEATHER_RETRIEVER]),
+    ("Plot the grid feed-in of the last 3 days", [CODER]),
+    ("Wie hoch war der Netzbezug gestern?", [CODER]),
+    ("Wie voll ist der Batteriespeicher?", [CODER]),
+    ("Stuck in gridlock, what can I do?", []),
+    ("Mein Netzwerk ist langsam", []),
+    ("Is cloudflare down right now?", []),
+    ("When should it be finished?", []),
+    ("Explain the raincoat of my graphene jacket", []),
+]
+
+
+if __name__ == "__main__":
+    failures = 0
+    for query, expected in KEYWORD_CASES:
+        matched = [node for node in DATA_NODES if KEYWORD_RULES[node].search(query)]
+        if matched != expected:
+            failures += 1
+            print(f"{query!r}: expected {expected}, matched {matched}")
+    print(f"{len(KEYWORD_CASES) - failures} of {len(KEYWORD_CASES)} keyword cases passed")
+    raise SystemExit(1 if failures else 0)
@@ -0,0 +1,244 @@
+import contextlib
+import io
+import multiprocessing
+import os
+import pickle
+import queue
+import resource
+import select
+import signal
+import threading
+import time
+import traceback
+from collections import namedtuple
+
+SandboxResult = namedtuple("SandboxResult", ["output", "figures", "error"])
+
+REFRESH_INTERVAL = 300
+CPU_SECONDS = 20
+MEMORY_BYTES = 1024 ** 3
+TIMEOUT = 30.0
+MAX_OUTPUT_CHARS = 20000
+
+
+def address_space_bytes():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmSize:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def load_frame():
+    import shared_utils
+
+    try:
+        return shared_utils.load_solar_frame(), time.monotonic()
+    except Exception as error:
+        print(f"Sandbox could not preload the solar data: {error}")
+        return None, 0.0
+
+
+def sandbox_namespace(frame):
+    import matplotlib.pyplot as plt
+    import numpy as np
+    import pandas as pd
+
+    import shared_utils
+
+    figures = []
+    fetch = shared_utils.load_solar_frame
+
+    def show_figure(figure=None):
+        figure = figure or plt.gcf()
+        buffer = io.BytesIO()
+        figure.savefig(buffer, format="png", bbox_inches="tight")
+        plt.close(figure)
+        figures.append(buffer.getvalue())
+        return "The chart has been displayed to the user."
+
+    def load_solar_frame(start=None, end=None, fields=None, resolution=None):
+        if frame is None or start is not None or end is not None or resolution not in (None, "raw"):
+            return fetch(start=start, end=end, fields=fields, resolution=resolution)
+        if fields is None:
+            return frame.copy()
+        fields = fields.split(",") if isinstance(fields, str) else list(fields)
+        return frame[["timestamp"] + [field for field in fields if field != "timestamp"]].copy()
+
+    shared_utils.show_figure = show_figure
+    shared_utils.load_solar_frame = load_solar_frame
+    plt.show = lambda *args, **kwargs: show_figure()
+
+    namespace = {"__name__": "__sandbox__", "pd": pd, "np": np, "plt": plt, "show_figure": show_figure,
+                 "load_solar_frame": load_solar_frame}
+    if frame is not None:
+        namespace["df"] = frame.copy()
+    return namespace, figures
+
+
+def run_child(code, frame, cpu_seconds, memory_bytes, write_fd):
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    limit = address_space_bytes() + memory_bytes
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    import matplotlib.pyplot as plt
+
+    namespace, figures = sandbox_namespace(frame)
+    output = io.StringIO()
+    error = False
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            exec(compile(code, "<sandbox>", "exec"), namespace)
+        except MemoryError:
+            error = True
+            print("MemoryError: the code exceeded the sandbox memory limit")
+        except BaseException:
+            error = True
+            traceback.print_exc()
+
+    for number in plt.get_fignums():
+        namespace["show_figure"](plt.figure(number))
+
+    text = output.getvalue()
+    if len(text) > MAX_OUTPUT_CHARS:
+        text = text[:MAX_OUTPUT_CHARS] + "\n... output truncated"
+    with os.fdopen(write_fd, "wb") as pipe:
+        pickle.dump(SandboxResult(text, figures, error), pipe)
+
+
+def read_result(read_fd, pid, timeout):
+    chunks = []
+    deadline = time.monotonic() + timeout
+    with os.fdopen(read_fd, "rb") as pipe:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([pipe], [], [], remaining)[0]:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+                return SandboxResult(f"Execution timed out after {timeout:.0f} seconds", [], True)
+            chunk = os.read(pipe.fileno(), 1 << 20)
+            if not chunk:
+                break
+            chunks.append(chunk)
+
+    _, status = os.waitpid(pid, 0)
+    if chunks:
+        try:
+            return pickle.loads(b"".join(chunks))
+        except Exception:
+            pass
+    if os.WIFSIGNALED(status):
+        reason = {signal.SIGXCPU: "exceeded the CPU time limit", signal.SIGKILL: "was killed"}.get(
+            os.WTERMSIG(status), f"died with signal {os.WTERMSIG(status)}")
+        return SandboxResult(f"Execution {reason}", [], True)
+    return SandboxResult(f"Execution failed with exit code {os.WEXITSTATUS(status)}", [], True)
+
+
+def execute_forked(code, frame, cpu_seconds, memory_bytes, timeout):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            run_child(code, frame, cpu_seconds, memory_bytes, write_fd)
+        finally:
+            os._exit(0)
+
+    os.close(write_fd)
+    return read_result(read_fd, pid, timeout)
+
+
+def worker_main(connection, refresh_interval, cpu_seconds, memory_bytes, timeout):
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot  # noqa: F401
+    import numpy  # noqa: F401
+    import pandas  # noqa: F401
+
+    frame, loaded_at = load_frame()
+    connection.send("ready")
+    while True:
+        if not connection.poll(max(1.0, refresh_interval - (time.monotonic() - loaded_at))):
+            fresh, fresh_at = load_frame()
+            if fresh is not None:
+                frame, loaded_at = fresh, fresh_at
+            else:
+                loaded_at = time.monotonic()
+            continue
+
+        code = connection.recv()
+        if code is None:
+            return
+        connection.send(execute_forked(code, frame, cpu_seconds, memory_bytes, timeout))
+
+
+class Worker:
+    def __init__(self, context, refresh_interval, cpu_seconds, memory_bytes, timeout):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=worker_main, name="sandbox-worker", daemon=True,
+                                       args=(child_connection, refresh_interval, cpu_seconds, memory_bytes,
+                                             timeout))
+        self.process.start()
+        child_connection.close()
+        self.ready = False
+
+    def wait_ready(self, timeout):
+        if not self.ready and self.connection.poll(timeout):
+            self.ready = self.connection.recv() == "ready"
+        return self.ready
+
+    def stop(self):
+        with contextlib.suppress(Exception):
+            self.connection.send(None)
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+
+
+class SandboxPool:
+    def __init__(self, workers=2, refresh_interval=REFRESH_INTERVAL, cpu_seconds=CPU_SECONDS,
+                 memory_bytes=MEMORY_BYTES, timeout=TIMEOUT):
+        self.size = workers
+        self.options = (refresh_interval, cpu_seconds, memory_bytes, timeout)
+        self.timeout = timeout
+        self.context = multiprocessing.get_context("spawn")
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.started = False
+
+    def start(self):
+        with self.lock:
+            if not self.started:
+                for _ in range(self.size):
+                    self.idle.put(Worker(self.context, *self.options))
+                self.started = True
+        return self
+
+    def execute(self, code, startup_timeout=60.0):
+        self.start()
+        worker = self.idle.get()
+        try:
+            if not worker.wait_ready(startup_timeout):
+                raise RuntimeError("Sandbox worker did not start")
+            worker.connection.send(code)
+            if not worker.connection.poll(self.timeout + 5):
+                raise RuntimeError("Sandbox worker did not respond")
+            return worker.connection.recv()
+        except (RuntimeError, EOFError, OSError) as error:
+            worker.stop()
+            exit_code = worker.process.exitcode
+            worker = Worker(self.context, *self.options)
+            return SandboxResult(f"Sandbox failure: {str(error) or 'the worker exited'} (exit code {exit_code})", [],
+                                 True)
+        finally:
+            self.idle.put(worker)
+
+    def close(self):
+        with self.lock:
+            while not self.idle.empty():
+                self.idle.get_nowait().stop()
+            self.started = False
+
+
+sandbox_pool = SandboxPool()
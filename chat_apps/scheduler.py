@@ -0,0 +1,135 @@
+from collections import namedtuple
+
+import numpy as np
+
+SLOT_MINUTES = 15
+SLOT_HOURS = SLOT_MINUTES / 60
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+Battery = namedtuple("Battery", ["capacity_kwh", "state_of_charge", "max_power_kw", "efficiency"])
+FlexibleLoad = namedtuple("FlexibleLoad", ["name", "duration_slots", "power_kw", "earliest", "latest"])
+
+
+def simulate(net_kw, battery):
+    net_kw = np.atleast_2d(net_kw)
+    stored = np.full(net_kw.shape[0], battery.capacity_kwh * battery.state_of_charge)
+    step_efficiency = np.sqrt(battery.efficiency)
+    max_energy = battery.max_power_kw * SLOT_HOURS
+    grid_import = np.empty_like(net_kw)
+    grid_export = np.empty_like(net_kw)
+
+    for slot in range(net_kw.shape[1]):
+        demand = net_kw[:, slot] * SLOT_HOURS
+        surplus = np.maximum(-demand, 0)
+        deficit = np.maximum(demand, 0)
+        charge = np.minimum(np.minimum(surplus, max_energy), (battery.capacity_kwh - stored) / step_efficiency)
+        discharge = np.minimum(np.minimum(deficit, max_energy), stored * step_efficiency)
+        stored += charge * step_efficiency - discharge / step_efficiency
+        grid_import[:, slot] = deficit - discharge
+        grid_export[:, slot] = surplus - charge
+    return grid_import, grid_export
+
+
+def load_profile(load, start, slots):
+    profile = np.zeros(slots)
+    profile[start:start + load.duration_slots] = load.power_kw
+    return profile
+
+
+def candidate_starts(load, slots):
+    latest_start = min(load.latest, slots) - load.duration_slots
+    return np.arange(max(load.earliest, 0), latest_start + 1)
+
+
+def best_start(net_kw, load, battery):
+    starts = candidate_starts(load, len(net_kw))
+    if len(starts) == 0:
+        return None, np.inf
+    window = np.arange(load.duration_slots)
+    candidates = np.tile(net_kw, (len(starts), 1))
+    candidates[np.arange(len(starts))[:, None], starts[:, None] + window] += load.power_kw
+    imports = simulate(candidates, battery)[0].sum(axis=1)
+    best = int(np.argmin(imports))
+    return int(starts[best]), float(imports[best])
+
+
+def net_load(production_kw, baseline_kw, loads, starts, skip=None):
+    net_kw = np.asarray(baseline_kw, dtype=np.float64) - np.asarray(production_kw, dtype=np.float64)
+    for index, (load, start) in enumerate(zip(loads, starts)):
+        if index != skip and start is not None:
+            net_kw = net_kw + load_profile(load, start, len(net_kw))
+    return net_kw
+
+
+def optimize(production_kw, baseline_kw, battery, loads, max_passes=5):
+    starts = [None] * len(loads)
+    order = sorted(range(len(loads)), key=lambda index: -loads[index].power_kw * loads[index].duration_slots)
+
+    for index in order:
+        starts[index] = best_start(net_load(production_kw, baseline_kw, loads, starts), loads[index], battery)[0]
+
+    for _ in range(max_passes):
+        changed = False
+        for index in order:
+            if starts[index] is None:
+                continue
+            start = best_start(net_load(production_kw, baseline_kw, loads, starts, skip=index), loads[index],
+                               battery)[0]
+            if start != starts[index]:
+                starts[index], changed = start, True
+        if not changed:
+            break
+    return starts
+
+
+def evaluate(production_kw, baseline_kw, battery, loads, starts):
+    grid_import, grid_export = simulate(net_load(production_kw, baseline_kw, loads, starts), battery)
+    production = float(np.sum(production_kw) * SLOT_HOURS)
+    export = float(grid_export.sum())
+    return {
+        "grid_import_kwh": round(float(grid_import.sum()), 2),
+        "grid_export_kwh": round(export, 2),
+        "self_consumption_ratio": round(1 - export / production, 3) if production > 0 else 0.0,
+    }
+
+
+def schedule(production_kw, baseline_kw, battery, loads, max_passes=5):
+    starts = optimize(production_kw, baseline_kw, battery, loads, max_passes)
+    earliest = [candidate_starts(load, len(production_kw))[:1] for load in loads]
+    earliest = [int(start[0]) if len(start) else None for start in earliest]
+
+    total = evaluate(production_kw, baseline_kw, battery, loads, starts)
+    placements = []
+    for index, (load, start) in enumerate(zip(loads, starts)):
+        if start is None:
+            placements.append({"name": load.name, "start_slot": None})
+            continue
+        without = evaluate(production_kw, baseline_kw, battery, loads, starts[:index] + [None] + starts[index + 1:])
+        energy = load.power_kw * load.duration_slots * SLOT_HOURS
+        grid_energy = max(total["grid_import_kwh"] - without["grid_import_kwh"], 0.0)
+        placements.append({
+            "name": load.name,
+            "start_slot": start,
+            "end_slot": start + load.duration_slots,
+            "energy_kwh": round(energy, 2),
+            "grid_kwh": round(grid_energy, 2),
+            "solar_share": round(1 - grid_energy / energy, 3) if energy else 1.0,
+        })
+    return {
+        "loads": placements,
+        "optimized": total,
+        "earliest_start": evaluate(production_kw, baseline_kw, battery, loads, earliest),
+    }
+
+
+def surplus_windows(production_kw, baseline_kw, min_surplus_kw=0.5, limit=5):
+    surplus = np.asarray(production_kw, dtype=np.float64) - np.asarray(baseline_kw, dtype=np.float64)
+    mask = np.concatenate([[False], surplus >= min_surplus_kw, [False]])
+    edges = np.flatnonzero(np.diff(mask.astype(np.int8)))
+    windows = [{
+        "start_slot": int(start),
+        "end_slot": int(end),
+        "mean_surplus_kw": round(float(surplus[start:end].mean()), 2),
+        "surplus_kwh": round(float(surplus[start:end].sum() * SLOT_HOURS), 2),
+    } for start, end in zip(edges[::2], edges[1::2])]
+    return sorted(windows, key=lambda window: -window["surplus_kwh"])[:limit]
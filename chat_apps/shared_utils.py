@@ -1,26 +1,47 @@
+import asyncio
+import contextvars
+import functools
+import json
 import operator
-from datetime import datetime
+from datetime import datetime, timedelta
+from io import BytesIO
 from typing import Annotated
-from typing import Sequence, TypedDict
+from typing import List, Literal, Sequence, TypedDict
+from zoneinfo import ZoneInfo
 
-import requests
+import numpy as np
 from langchain.agents import create_openai_tools_agent, AgentExecutor
 from langchain_core.messages import BaseMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.pydantic_v1 import BaseModel, Field
 from langchain_core.tools import tool
 from langchain_openai import ChatOpenAI
 
+import analytics
 import auth_keys
+import context_budget
+import http_client
+import instrumentation
 import myconfig
+import pv_forecast
+import scheduler
+from sandbox_pool import sandbox_pool
+from tool_cache import cached, tool_cache
 
 
 class AgentState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], operator.add]
     next: str
+    plan: Sequence[str]
 
 
-def agent_node(state: AgentState, agent: AgentExecutor, name: str):
-    result = agent.invoke(state)
+def budget_state(state):
+    return {**state, "messages": context_budget.apply_budget(state["messages"])}
+
+
+@instrumentation.instrumented("node")
+async def agent_node(state: AgentState, agent: AgentExecutor, name: str):
+    result = await agent.ainvoke(budget_state(state))
     if name == "Energy optimizer":
         return {"messages": [HumanMessage(content=result["output"])]}
     else:
@@ -48,130 +69,490 @@ def create_agent(llm: ChatOpenAI, tools: list, system_prompt: str):
     return executor
 
 
+figure_sink = contextvars.ContextVar("figure_sink", default=None)
+
+
+def publish_figure(png_bytes):
+    sink = figure_sink.get()
+    if sink is not None:
+        sink.put(png_bytes)
+
+
+def show_figure(figure=None):
+    import matplotlib.pyplot as plt
+
+    figure = figure or plt.gcf()
+    buffer = BytesIO()
+    figure.savefig(buffer, format="png", bbox_inches="tight")
+    plt.close(figure)
+    publish_figure(buffer.getvalue())
+    return "The chart has been displayed to the user."
+
+
+def load_solar_frame(start=None, end=None, fields=None, resolution=None):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    params = {'start': start, 'end': end, 'resolution': resolution,
+              'fields': ",".join(fields) if isinstance(fields, (list, tuple)) else fields}
+    url = getattr(myconfig, "url_solar_parquet", None)
+    if url is None:
+        raise http_client.UpstreamError("url_solar_parquet is not configured in myconfig")
+    response = http_client.request("cloud_functions", url,
+                                   params={key: value for key, value in params.items() if value is not None})
+
+    frame = pq.read_table(pa.BufferReader(response.content)).to_pandas(split_blocks=True, self_destruct=True)
+    frame['timestamp'] = frame['timestamp'].dt.tz_convert("Europe/Berlin")
+    return frame
+
+
+@cached(ttl=5, stale_ttl=5, name="live_data")
+def fetch_live_data():
+    return http_client.request_json("raspberry", myconfig.url_to_raspberry_rest_api)
+
+
+@cached(ttl=5, stale_ttl=5, name="live_data")
+async def afetch_live_data():
+    return await http_client.arequest_json("raspberry", myconfig.url_to_raspberry_rest_api)
+
+
 @tool("live_data")
 def get_live_data():
     """Retrieves live data of the solar system"""
-    base_url = myconfig.url_to_raspberry_rest_api
+    try:
+        return fetch_live_data()
+    except:
+        return "There was an error retrieving the data."
+
 
+async def aget_live_data():
     try:
-        response = requests.get(base_url)
-        return response.json()
+        return await afetch_live_data()
     except:
         return "There was an error retrieving the data."
 
 
+get_live_data.coroutine = aget_live_data
+
+
+@cached(ttl=5 * 60, stale_ttl=10 * 60, name="summed_historic_data")
+def fetch_summed_historic_data():
+    return http_client.request_json("cloud_functions", myconfig.url_summed_up_data)
+
+
+@cached(ttl=5 * 60, stale_ttl=10 * 60, name="summed_historic_data")
+async def afetch_summed_historic_data():
+    return await http_client.arequest_json("cloud_functions", myconfig.url_summed_up_data)
+
+
+def format_summed_historic_data(data):
+    rows = [(entry['date'] + (" (today)" if idx == len(data) - 1 else ""), entry['consumption_positive'],
+             entry['grid_negative'], entry['grid_positive'], entry['production_positive'])
+            for idx, entry in enumerate(data)]
+    return ("Energy per day in kWh, grid_positive was drawn from the grid, grid_negative was fed into the grid:\n"
+            + context_budget.compact_table(["date", "consumption_positive", "grid_negative", "grid_positive",
+                                            "production_positive"], rows))
+
+
 @tool("summed_historic_data")
 def get_summed_historic_data():
     """Retrieves the summed up historic solar data"""
-    base_url = myconfig.url_summed_up_data
-    response = requests.get(base_url)
-
-    if response.status_code == 200:
-        data = response.json()
-        output_string = "Energy Historic Data last three days: \n"
-        for idx, entry in enumerate(data):
-            date = entry['date']
-            consumption_positive = entry['consumption_positive']
-            grid_negative = entry['grid_negative']
-            grid_positive = entry['grid_positive']
-            production_positive = entry['production_positive']
-
-            if idx == len(data) - 1:
-                date_description = datetime.strptime(date, "%Y-%m-%d").strftime("%d.%m.%Y") + " (today)"
-            else:
-                date_description = datetime.strptime(date, "%Y-%m-%d").strftime("%d.%m.%Y")
-
-            entry_string = f"""
-    Date: {date_description}
-    - Consumption Positive: {consumption_positive}
-    - Grid Negative: {grid_negative}
-    - Grid Positive: {grid_positive}
-    - Production Positive: {production_positive}
-        """
-            output_string += entry_string
-        output_string += ("\n \nGrid Positive is how much was drawn from the grid. \nGrid negative is how much was fed "
-                          "into the grid.")
+    try:
+        return format_summed_historic_data(fetch_summed_historic_data())
+    except http_client.UpstreamError:
+        return "There was an error retrieving the data."
 
-        return output_string
-    else:
+
+async def aget_summed_historic_data():
+    try:
+        return format_summed_historic_data(await afetch_summed_historic_data())
+    except http_client.UpstreamError:
         return "There was an error retrieving the data."
 
 
-@tool("energy_optimizer")
-def energy_optimizer():
-    """Responds with energy optimization methods"""
-    return ""
+get_summed_historic_data.coroutine = aget_summed_historic_data
 
+MAX_ANALYTICS_DAYS = 7
+AnalyticsDays = Annotated[int, "Number of days to analyze including today, between 1 and 7"]
 
-@tool("weather_forecaster")
-def get_weather_forecast():
-    """Retrieves the current weather and the forecast for the next 3 days."""
-    base_url = "https://api.openweathermap.org/data/2.5/forecast/daily"
-    params = {
+
+@cached(ttl=60, stale_ttl=5 * 60, name="solar_frame")
+def fetch_solar_frame(days=3):
+    start = datetime.now(ZoneInfo("Europe/Berlin")).date() - timedelta(days=days - 1)
+    return load_solar_frame(start=start.isoformat())
+
+
+def run_analysis(analysis, days):
+    try:
+        frame = fetch_solar_frame(min(max(int(days), 1), MAX_ANALYTICS_DAYS))
+    except http_client.UpstreamError:
+        return "There was an error retrieving the data."
+    if frame.empty:
+        return "There is no solar data for the requested days."
+    return analysis(frame)
+
+
+def format_daily_totals(frame):
+    return ("Energy per day in kWh (grid_import was drawn from the grid, grid_export was fed into the grid):\n"
+            + context_budget.frame_table(analytics.daily_totals(frame)))
+
+
+def format_self_consumption(frame):
+    return ("self_consumption_ratio is the share of the production used on site, autarky_ratio is the share of the "
+            "consumption not drawn from the grid:\n" + context_budget.frame_table(analytics.self_consumption(frame),
+                                                                               "%.3f"))
+
+
+def format_peak_production_hour(frame):
+    return json.dumps(analytics.peak_production_hour(frame), separators=(',', ':'))
+
+
+def format_battery_extremes(frame):
+    return "Battery status in % per day:\n" + context_budget.frame_table(analytics.battery_extremes(frame), "%.0f")
+
+
+def plot_energy(frame, resolution):
+    publish_figure(analytics.energy_plot(frame, resolution))
+    return "The chart has been displayed to the user."
+
+
+@tool("daily_energy_totals")
+def get_daily_energy_totals(days: AnalyticsDays = 3):
+    """Calculates the produced, consumed, imported and exported energy in kWh per day."""
+    return run_analysis(format_daily_totals, days)
+
+
+@tool("self_consumption_ratio")
+def get_self_consumption_ratio(days: AnalyticsDays = 3):
+    """Calculates the self-consumption ratio and the autarky ratio per day and in total."""
+    return run_analysis(format_self_consumption, days)
+
+
+@tool("peak_production_hour")
+def get_peak_production_hour(days: AnalyticsDays = 3):
+    """Finds the hour of the day with the highest mean solar production and the single highest hour and sample."""
+    return run_analysis(format_peak_production_hour, days)
+
+
+@tool("battery_min_max")
+def get_battery_min_max(days: AnalyticsDays = 3):
+    """Finds the minimum and maximum battery status per day and when they were reached."""
+    return run_analysis(format_battery_extremes, days)
+
+
+@tool("energy_plot")
+def get_energy_plot(days: AnalyticsDays = 3,
+                    resolution: Annotated[Literal["5min", "15min", "1h"], "Averaging interval of the plot"] = "15min"):
+    """Displays the standard chart of solar production, consumption and grid power to the user."""
+    return run_analysis(lambda frame: plot_energy(frame, resolution), days)
+
+
+async def aget_daily_energy_totals(days=3):
+    return await asyncio.to_thread(run_analysis, format_daily_totals, days)
+
+
+async def aget_self_consumption_ratio(days=3):
+    return await asyncio.to_thread(run_analysis, format_self_consumption, days)
+
+
+async def aget_peak_production_hour(days=3):
+    return await asyncio.to_thread(run_analysis, format_peak_production_hour, days)
+
+
+async def aget_battery_min_max(days=3):
+    return await asyncio.to_thread(run_analysis, format_battery_extremes, days)
+
+
+async def aget_energy_plot(days=3, resolution="15min"):
+    return await asyncio.to_thread(run_analysis, lambda frame: plot_energy(frame, resolution), days)
+
+
+get_daily_energy_totals.coroutine = aget_daily_energy_totals
+get_self_consumption_ratio.coroutine = aget_self_consumption_ratio
+get_peak_production_hour.coroutine = aget_peak_production_hour
+get_battery_min_max.coroutine = aget_battery_min_max
+get_energy_plot.coroutine = aget_energy_plot
+
+analytics_tools = [get_daily_energy_totals, get_self_consumption_ratio, get_peak_production_hour, get_battery_min_max,
+                   get_energy_plot]
+
+
+LOCAL_TIMEZONE = ZoneInfo("Europe/Berlin")
+MAX_SCHEDULE_SLOTS = 3 * scheduler.SLOTS_PER_DAY
+
+
+class FlexibleLoadInput(BaseModel):
+    name: str = Field(description="Name of the appliance or task, e.g. dishwasher")
+    duration_minutes: int = Field(description="How long the load runs in minutes")
+    power_kw: float = Field(description="Average power draw while running in kW")
+    earliest: str = Field(description="Earliest start as HH:MM or ISO 8601 local time")
+    latest: str = Field(description="Time by which the load has to be finished as HH:MM or ISO 8601 local time")
+
+
+class EnergyOptimizerInput(BaseModel):
+    loads: List[FlexibleLoadInput] = Field(default_factory=list,
+                                           description="Flexible loads to schedule, empty to only get the expected "
+                                                       "solar surplus windows")
+
+
+def parse_local_time(value, reference):
+    try:
+        hours, minutes = (int(part) for part in value.split(":"))
+        moment = reference.replace(hour=hours, minute=minutes, second=0, microsecond=0)
+        return moment if moment >= reference else moment + timedelta(days=1)
+    except ValueError:
+        moment = datetime.fromisoformat(value)
+        return moment.replace(tzinfo=LOCAL_TIMEZONE) if moment.tzinfo is None else moment
+
+
+def battery_state():
+    try:
+        state_of_charge = float(fetch_live_data()["battery_status"]) / 100
+    except Exception:
+        state_of_charge = None
+    battery = scheduler.Battery(capacity_kwh=getattr(myconfig, "battery_capacity_kwh", 10.0),
+                                state_of_charge=0.0 if state_of_charge is None else state_of_charge,
+                                max_power_kw=getattr(myconfig, "battery_max_power_kw", 3.84),
+                                efficiency=getattr(myconfig, "battery_efficiency", 0.9))
+    return battery, state_of_charge is not None
+
+
+def forecast_slots(first_slot, slots):
+    hours, production = fetch_pv_forecast()
+    slot_hours = (int(first_slot.timestamp()) + np.arange(slots) * scheduler.SLOT_MINUTES * 60) // 3600
+    return production[np.clip(slot_hours - hours[0], 0, len(hours) - 1)]
+
+
+def optimizer_profiles(slots):
+    frame = fetch_solar_frame(MAX_ANALYTICS_DAYS)
+    now = datetime.now(LOCAL_TIMEZONE)
+    first_slot = now.replace(minute=now.minute - now.minute % scheduler.SLOT_MINUTES, second=0, microsecond=0)
+    offset = (first_slot.hour * 60 + first_slot.minute) // scheduler.SLOT_MINUTES
+    days = slots // scheduler.SLOTS_PER_DAY + 2
+    baseline = np.tile(analytics.slot_profile(frame, 'consumption'), days)[offset:offset + slots]
+    try:
+        production, source = forecast_slots(first_slot, slots), "PV forecast from the weather forecast"
+    except Exception as error:
+        print(f"PV forecast unavailable, falling back to the historic production profile: {error}")
+        production = np.tile(analytics.slot_profile(frame, 'production'), days)[offset:offset + slots]
+        source = f"mean 15 minute profile of the last {MAX_ANALYTICS_DAYS} days"
+    return first_slot, np.maximum(production, 0), np.maximum(baseline, 0), source
+
+
+def optimize_schedule(loads):
+    now = datetime.now(LOCAL_TIMEZONE)
+    windows = []
+    for load in loads:
+        load = load if isinstance(load, dict) else load.dict()
+        earliest = parse_local_time(load["earliest"], now)
+        latest = parse_local_time(load["latest"], earliest)
+        windows.append((load, max(earliest, now), latest))
+
+    slot = timedelta(minutes=scheduler.SLOT_MINUTES)
+    horizon = max([scheduler.SLOTS_PER_DAY] + [int((latest - now) / slot) + 1 for _, _, latest in windows])
+    first_slot, production, baseline, source = optimizer_profiles(min(horizon, MAX_SCHEDULE_SLOTS))
+    flexible_loads = [scheduler.FlexibleLoad(name=load["name"],
+                                             duration_slots=max(1, -(-int(load["duration_minutes"])
+                                                                     // scheduler.SLOT_MINUTES)),
+                                             power_kw=float(load["power_kw"]),
+                                             earliest=-(-(earliest - first_slot) // slot),
+                                             latest=(latest - first_slot) // slot)
+                      for load, earliest, latest in windows]
+    battery, measured = battery_state()
+
+    def slot_time(index):
+        return (first_slot + index * slot).strftime("%a %H:%M")
+
+    result = scheduler.schedule(production, baseline, battery, flexible_loads)
+    for placement in result["loads"]:
+        start = placement.pop("start_slot")
+        if start is None:
+            placement["error"] = "The load does not fit into its time window."
+        else:
+            placement["start"] = slot_time(start)
+            placement["end"] = slot_time(placement.pop("end_slot"))
+    result["surplus_windows"] = [{"start": slot_time(window.pop("start_slot")),
+                                  "end": slot_time(window.pop("end_slot")), **window}
+                                 for window in scheduler.surplus_windows(production, baseline)]
+    result["assumptions"] = {
+        "production_forecast": source,
+        "baseline_consumption": f"mean 15 minute profile of the last {MAX_ANALYTICS_DAYS} days",
+        "battery_state_of_charge": round(battery.state_of_charge, 2) if measured else "unknown, assumed empty",
+        "battery_capacity_kwh": battery.capacity_kwh,
+    }
+    return json.dumps(result, separators=(',', ':'))
+
+
+@tool("energy_optimizer", args_schema=EnergyOptimizerInput)
+def energy_optimizer(loads=()):
+    """Calculates the schedule for flexible loads that maximizes the use of solar energy, based on the expected
+    solar production, the baseline consumption and the current battery state. Also returns the expected solar
+    surplus windows. Explain the returned schedule to the user instead of guessing times."""
+    try:
+        return optimize_schedule(loads)
+    except http_client.UpstreamError:
+        return "There was an error retrieving the data."
+    except ValueError as error:
+        return f"Invalid load description: {error}"
+
+
+async def aenergy_optimizer(loads=()):
+    return await asyncio.to_thread(energy_optimizer.func, loads)
+
+
+energy_optimizer.coroutine = aenergy_optimizer
+
+
+WEATHER_URL = getattr(myconfig, "weather_url", "https://api.openweathermap.org/data/2.5/forecast/daily")
+
+
+def weather_params():
+    return {
         'lat': '49.300652',
         'lon': '10.571460',
         'appid': auth_keys.openweather_api_key,
         'units': 'metric'
     }
 
-    response = requests.get(base_url, params=params)
-    print(response.url)
-    if response.status_code == 200:
-        data = response.json()
-        # print(json.dumps(data, indent=4))
-        export_data = {}
-        for i in range(4):
-            export_data[i] = {
-                "date": data["list"][i]["dt"],
-                "temp": data["list"][i]["temp"]["day"],
-                "weather": data["list"][i]["weather"][0]["main"],
-                "clouds": data["list"][i]["clouds"],
-            }
-
-        output_string = f"""
-Weather Forecast
-Today's Forecast:
-Date: {datetime.utcfromtimestamp(data["list"][0]["dt"]).strftime('%Y-%m-%d')}
-Temperature: {export_data[0]["temp"]} °C
-Weather: {export_data[0]["weather"]}
-Cloud Coverage: {export_data[0]["clouds"]}%
-
-Next 3 Days:
-Day 1 - {datetime.utcfromtimestamp(data["list"][1]["dt"]).strftime('%Y-%m-%d')}
-Temperature: {export_data[1]["temp"]} °C
-Weather: {export_data[1]["weather"]}
-Cloud Coverage: {export_data[1]["clouds"]}%
-
-Day 2 - {datetime.utcfromtimestamp(data["list"][2]["dt"]).strftime('%Y-%m-%d')}
-Temperature: {export_data[2]["temp"]} °C
-Weather: {export_data[2]["weather"]}
-Cloud Coverage: {export_data[2]["clouds"]}%
-
-Day 3 - {datetime.utcfromtimestamp(data["list"][3]["dt"]).strftime('%Y-%m-%d')}
-Temperature: {export_data[3]["temp"]} °C
-Weather: {export_data[3]["weather"]}
-Cloud Coverage: {export_data[3]["clouds"]}%
-"""
-        return output_string
+
+@cached(ttl=30 * 60, stale_ttl=30 * 60, name="weather_forecast")
+def fetch_weather_forecast():
+    return http_client.request_json("openweathermap", WEATHER_URL, params=weather_params())
+
+
+@cached(ttl=30 * 60, stale_ttl=30 * 60, name="weather_forecast")
+async def afetch_weather_forecast():
+    return await http_client.arequest_json("openweathermap", WEATHER_URL, params=weather_params())
+
+
+HOURLY_WEATHER_URL = getattr(myconfig, "hourly_weather_url", "https://api.openweathermap.org/data/2.5/forecast")
+FORECAST_HOURS = 72
+TRAINING_DAYS = 30
+
+
+@functools.cache
+def pv_forecaster():
+    return pv_forecast.PVForecaster(getattr(myconfig, "pv_forecast_path", "pv_forecast.sqlite"))
+
+
+@cached(ttl=30 * 60, stale_ttl=30 * 60, name="hourly_weather")
+def fetch_hourly_weather():
+    return http_client.request_json("openweathermap", HOURLY_WEATHER_URL, params=weather_params())
+
+
+def train_pv_forecaster(forecaster, now_hour):
+    if forecaster.trained_until is None:
+        start = datetime.now(LOCAL_TIMEZONE) - timedelta(days=TRAINING_DAYS)
     else:
+        start = datetime.fromtimestamp((forecaster.trained_until + 1) * 3600, LOCAL_TIMEZONE)
+    if now_hour * 3600 - start.timestamp() < 3600:
+        return 0
+    frame = load_solar_frame(start=start.replace(tzinfo=None).isoformat(timespec="seconds"), fields=['production'],
+                             resolution='1h')
+    if frame.empty:
+        return 0
+    hours = frame['timestamp'].to_numpy(dtype='datetime64[ns]').astype(np.int64) // 3_600_000_000_000
+    return forecaster.train(hours, frame['production'].to_numpy(dtype=np.float64), now_hour)
+
+
+@cached(ttl=15 * 60, stale_ttl=45 * 60, name="pv_forecast")
+def fetch_pv_forecast(hours=FORECAST_HOURS):
+    now_hour = int(datetime.now(LOCAL_TIMEZONE).timestamp()) // 3600
+    cloud_hours, clouds = pv_forecast.hourly_clouds(fetch_hourly_weather())
+    forecaster = pv_forecaster()
+    forecaster.log_weather(cloud_hours, clouds, now_hour)
+    try:
+        train_pv_forecaster(forecaster, now_hour)
+    except http_client.UpstreamError as error:
+        print(f"Could not update the PV forecast model: {error}")
+    forecast_hours = np.arange(now_hour, now_hour + hours)
+    return forecast_hours, forecaster.forecast(forecast_hours, cloud_hours, clouds)
+
+
+def format_pv_forecast(forecast):
+    hours, production = forecast
+    times = [datetime.fromtimestamp(int(hour) * 3600, LOCAL_TIMEZONE) for hour in hours]
+    daily = {}
+    for moment, value in zip(times, production):
+        daily[moment.strftime("%a %d.%m.")] = daily.get(moment.strftime("%a %d.%m."), 0.0) + float(value)
+    hourly = {moment.strftime("%a %H:00"): round(float(value), 2) for moment, value in zip(times, production)
+              if value > 0.005}
+    return json.dumps({"daily_kwh": {day: round(value, 1) for day, value in daily.items()}, "hourly_kwh": hourly},
+                      separators=(',', ':'))
+
+
+@tool("pv_forecast")
+def get_pv_forecast():
+    """Forecasts the solar production in kWh per hour and per day for the next 72 hours, based on the weather forecast
+    and the recorded production of the solar system."""
+    try:
+        return format_pv_forecast(fetch_pv_forecast())
+    except http_client.UpstreamError:
         return "There was an error retrieving the data."
 
 
-def weather_state_update(state: AgentState, agent: AgentExecutor, name: str):
-    print("weather_state_update called")
-    result = agent.invoke(state)
+async def aget_pv_forecast():
+    return await asyncio.to_thread(get_pv_forecast.func)
 
-    updated_content = (
-        f"{state.get('messages')[0].content}\n"
-        "____additional information____\n\n"
-        f"{result['output']}\n"
-        "The data has successfully been retrieved."
-    )
 
+get_pv_forecast.coroutine = aget_pv_forecast
+
+
+DATA_BUCKET_SECONDS = 10 * 60
+
+
+@cached(ttl=60, stale_ttl=5 * 60, name="latest_sample")
+def fetch_latest_sample(url):
+    latest = http_client.request_json("cloud_functions", url)["timestamp"]
+    return None if latest is None else datetime.fromisoformat(latest).timestamp()
+
+
+def data_version(bucket_seconds=DATA_BUCKET_SECONDS):
+    url = getattr(myconfig, "url_latest_sample", None)
+    if url is None:
+        return None
+    try:
+        latest = fetch_latest_sample(url)
+    except http_client.UpstreamError as error:
+        print(f"Latest stored sample unknown, bypassing the answer cache: {error}")
+        return None
+    forecasts = [tool_cache.fetched_at(fetch.cache_key()) for fetch in (fetch_weather_forecast, fetch_hourly_weather)]
+    return (None if latest is None else int(latest // bucket_seconds),
+            *(None if fetched is None else round(fetched) for fetched in forecasts))
+
+
+def format_weather_forecast(data):
+    rows = [(datetime.utcfromtimestamp(day["dt"]).strftime('%Y-%m-%d') + (" (today)" if i == 0 else ""),
+             day["temp"]["day"], day["weather"][0]["main"], day["clouds"])
+            for i, day in enumerate(data["list"][:4])]
+    return "Weather forecast:\n" + context_budget.compact_table(["date", "temp_c", "weather", "clouds_pct"], rows)
+
+
+@tool("weather_forecaster")
+def get_weather_forecast():
+    """Retrieves the current weather and the forecast for the next 3 days."""
+    try:
+        return format_weather_forecast(fetch_weather_forecast())
+    except http_client.UpstreamError:
+        return "There was an error retrieving the data."
+
+
+async def aget_weather_forecast():
+    try:
+        return format_weather_forecast(await afetch_weather_forecast())
+    except http_client.UpstreamError:
+        return "There was an error retrieving the data."
+
+
+get_weather_forecast.coroutine = aget_weather_forecast
+
+
+@instrumentation.instrumented("node")
+async def weather_state_update(state: AgentState, agent: AgentExecutor, name: str):
+    result = await agent.ainvoke(budget_state(state))
     return {
-        "messages": [HumanMessage(content=updated_content)],
+        "messages": [HumanMessage(content=name + ' says: \n' + result["output"])],
         "next": "supervisor",
-        "intermediate_steps": [(name, str(result))]
     }
 
 
@@ -187,3 +568,28 @@ def format_response(response):
         return formatted_text, image_data
     else:
         return response, None
+
+
+def run_in_sandbox(code):
+    result = sandbox_pool.execute(code)
+    for png_bytes in result.figures:
+        publish_figure(png_bytes)
+    output = result.output or "The code ran without printing anything. Use print(...) to see values."
+    if result.figures:
+        output += f"\n{len(result.figures)} chart(s) have been displayed to the user."
+    return output
+
+
+@tool("python_sandbox")
+def python_sandbox(code: Annotated[str, "The python code to execute. Use print(...) to see values."]):
+    """Executes python code in a warm sandbox. pandas as pd, numpy as np and matplotlib.pyplot as plt are already
+    imported and the solar data of the last three days is preloaded as the DataFrame df, which is also returned by
+    load_solar_frame() without arguments. Charts are displayed to the user with show_figure() or plt.show()."""
+    return run_in_sandbox(code)
+
+
+async def apython_sandbox(code):
+    return await asyncio.to_thread(run_in_sandbox, code)
+
+
+python_sandbox.coroutine = apython_sandbox
@@ -0,0 +1,68 @@
+import base64
+import time
+from io import BytesIO
+
+import streamlit as st
+
+from shared_utils import format_response
+
+
+def render_stream(events):
+    started = time.perf_counter()
+    first_output = None
+    status = st.status("Generating response...", expanded=False)
+    placeholder = st.empty()
+    text = ""
+    trace = None
+
+    for kind, payload in events:
+        if kind == "node":
+            status.update(label=f"{payload} is working...")
+            status.write(payload)
+        elif kind == "token":
+            text += payload
+            placeholder.markdown(text + "▌")
+        elif kind == "image":
+            st.image(payload, caption="Generated Plot", use_column_width=True)
+        elif kind == "final":
+            text = payload
+        elif kind == "trace":
+            trace = payload
+
+        if kind in ("token", "image") and first_output is None:
+            first_output = time.perf_counter() - started
+
+    formatted_text, image_data = format_response(text)
+    placeholder.markdown(formatted_text, unsafe_allow_html=True)
+    if image_data:
+        image = BytesIO(base64.b64decode(image_data))
+        st.image(image, caption="Generated Plot", use_column_width=True)
+
+    total = time.perf_counter() - started
+    first_output = total if first_output is None else first_output
+    status.update(label=f"Done: first output after {first_output:.1f} s, complete after {total:.1f} s",
+                  state="complete")
+    if trace is not None:
+        render_timeline(trace)
+    return text
+
+
+def render_timeline(trace):
+    summary = trace.summary()
+    st.sidebar.subheader("Request timeline")
+    st.sidebar.caption(f"Request {summary['request_id']}: {summary['total_seconds']:.1f} s, "
+                       f"{summary['llm_calls']} LLM calls ({summary['tokens_in']} tokens in, "
+                       f"{summary['tokens_out']} out), {summary['tool_calls']} tool calls, "
+                       f"{summary['http_calls']} HTTP calls, {summary['cache_hits']} cache hits, "
+                       f"{summary['cache_misses']} cache misses")
+    busy = {key[:-len("_seconds")]: value for key, value in summary.items()
+            if key.endswith("_seconds") and key != "total_seconds"}
+    if busy:
+        st.sidebar.bar_chart(busy)
+    st.sidebar.dataframe(trace.timeline(), use_container_width=True, hide_index=True)
+
+
+def render_cache_stats(stats):
+    st.sidebar.caption(f"Answer cache: {stats['hits']} of {stats['hits'] + stats['misses']} requests answered "
+                       f"from cache ({stats['hit_rate']:.0%}), {stats['saved_seconds']:.1f} s saved, "
+                       f"{stats['entries']} answers stored, {stats['invalidations']} invalidated by new data")
@@ -1,23 +1,30 @@
-import base64
 import functools
+import logging
 import os
+import queue
 import warnings
-from io import BytesIO
+from collections import namedtuple
 
 import streamlit as st
-from langchain.output_parsers.openai_functions import JsonOutputFunctionsParser
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import AIMessageChunk, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_experimental.tools import PythonREPLTool
-from langchain_openai import ChatOpenAI
-from langgraph.graph import StateGraph, END
 
 import auth_keys
+import http_client
+import instrumentation
+import myconfig
+from router import Router
 from shared_utils import (agent_node, get_weather_forecast, AgentState, create_agent, weather_state_update,
-                          format_response, get_summed_historic_data, get_live_data, energy_optimizer)
+                          get_summed_historic_data, get_live_data, energy_optimizer, figure_sink, python_sandbox,
+                          analytics_tools, get_pv_forecast, budget_state, data_version)
+from answer_cache import AnswerCache
+from sandbox_pool import sandbox_pool
+from stream_rendering import render_cache_stats, render_stream
 
 warnings.filterwarnings("ignore")
 
+logger = logging.getLogger(__name__)
+
 os.environ["OPENAI_API_KEY"] = auth_keys.openai_api_key
 os.environ["OPENWEATHERMAP_API_KEY"] = auth_keys.openweather_api_key
 
@@ -25,10 +32,6 @@ os.environ["LANGCHAIN_TRACING_V2"] = "true"
 os.environ["LANGCHAIN_API_KEY"] = auth_keys.langchain_api_key
 os.environ["LANGCHAIN_PROJECT"] = "multi_agent"
 
-llm = ChatOpenAI(model='gpt-4o', temperature=0)
-
-python_repl_tool = PythonREPLTool()
-
 analyzers = ["Weather Retriever", "Coder"]
 nodes = analyzers + ["Energy optimizer"]
 system_prompt = (
@@ -83,30 +86,58 @@ prompt = ChatPromptTemplate.from_messages(
     ]
 ).partial(options=str(options), members=", ".join(nodes))
 
-supervisor_chain = (
-        prompt
-        | llm.bind_functions(functions=[function_def], function_call="route")
-        | JsonOutputFunctionsParser()
-)
+plan_function_def = {
+    "name": "plan",
+    "description": "Select every data source that is needed before the Energy optimizer answers.",
+    "parameters": {
+        "title": "planSchema",
+        "type": "object",
+        "properties": {
+            "nodes": {
+                "title": "Nodes",
+                "type": "array",
+                "items": {"enum": analyzers},
+            }
+        },
+        "required": ["nodes"],
+    },
+}
 
-weather_retriever = create_agent(llm, [get_weather_forecast],
-                                 """You are the Weather Retriever. Your task is to provide the current weather and 
-                                 the weather forecast for a predefined location.""")
-weather_retriever_node = functools.partial(weather_state_update, agent=weather_retriever, name="Weather Retriever")
-
-code_agent = create_agent(llm, [python_repl_tool, get_summed_historic_data, get_live_data],
-                          "You may generate safe Python code to analyze data and generate charts using matplotlib. If "
-                          "your task ist to plot solar data you can request time series data with python from the "
-                          "endpoint <insert url here> "
-                          "it returns the solar data in csv format. The data covers the last three days "
-                          "and includes the following keys: production (in kWh), grid (in kWh), consumption (in kWh), "
-                          "timestamp, battery_status (in %). The timestamp is formatted as follows: "
-                          "YYYY-MM-DDTHH:MM:SS. \n. Don't use double quotes in the code \n"
-                          "  Answer only with your results and never ask follow up questions.")
-code_node = functools.partial(agent_node, agent=code_agent, name="Coder")
-
-analyze_agent = create_agent(llm, [energy_optimizer],
-                             """You are an energy optimizer. You analyze solar and weather data to provide insights 
+planner_prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system", system_prompt),
+        MessagesPlaceholder(variable_name="messages"),
+        (
+            "system",
+            "Given the conversation above, which data sources are required before the Energy optimizer can "
+            "answer? They will be queried in parallel. Select any of: {options}. Select none if no additional "
+            "data is required.",
+        ),
+    ]
+).partial(options=str(analyzers))
+
+WEATHER_RETRIEVER_PROMPT = """You are the Weather Retriever. Your task is to provide the current weather and 
+                                 the weather forecast for a predefined location. Whenever the solar production 
+                                 matters, also provide the hourly PV forecast of the pv_forecast tool."""
+
+CODER_PROMPT = ("For daily energy totals, the self-consumption ratio, the peak production hour, the battery "
+                "minimum and maximum or the standard production, consumption and grid chart always use the matching "
+                "analytics tool instead of writing code. "
+                "You may generate safe Python code to analyze data and generate charts using matplotlib. If "
+                "your task ist to plot or analyze solar data run your code with the python_sandbox tool, where the "
+                "DataFrame df is already loaded, or load it with 'from shared_utils import load_solar_frame' and "
+                "'df = load_solar_frame()'. By default "
+                "the data covers the last three days and includes the following columns: production (in "
+                "kWh), grid (in kWh), consumption (in kWh), timestamp (timezone aware datetime), "
+                "battery_status (in %). load_solar_frame accepts the optional keyword arguments start and "
+                "end (ISO 8601 strings), fields (list of column names besides timestamp) and resolution "
+                "('raw', '1min', '15min' or '1h'), so only request the slice you need. If you need the raw "
+                "csv instead you can request it from the endpoint <insert url here> with the same query "
+                "parameters. To show a chart to the user call show_figure() from shared_utils after "
+                "plotting instead of plt.show(). \n. Don't use double quotes in the code \n"
+                "  Answer only with your results and never ask follow up questions.")
+
+ENERGY_OPTIMIZER_PROMPT = """You are an energy optimizer. You analyze solar and weather data to provide insights 
                              on energy usage and optimization. This includes identifying non-optimal energy usage 
                              periods, suggesting optimal times for high energy consumption based on solar production 
                              and weather forecast, and offering general energy-saving recommendations. Energy from 
@@ -120,61 +151,180 @@ analyze_agent = create_agent(llm, [energy_optimizer],
                              if solar production is insufficient. When you receive information from the coder, 
                              repeat it and analyze it according to the above factors. Please give tips on how to 
                              analyze a visualization if the coder responded with a visualization. Don't interact with 
-                             the coder or weather retriever, just pass the information as it would be yours.""")
-analyze_node = functools.partial(agent_node, agent=analyze_agent, name="Energy optimizer")
+                             the coder or weather retriever, just pass the information as it would be yours. 
+                             Whenever the user wants to know when to run appliances or other flexible loads, call 
+                             the energy_optimizer tool with each load's duration, power and allowed time window 
+                             (estimate typical values if the user gives none) and explain the returned schedule 
+                             instead of guessing times."""
+
+AgentSystem = namedtuple("AgentSystem", ["graph", "planning_graph", "router"])
+
+
+# Cached resources are shared by every Streamlit session; Router, AnswerCache and ToolCache guard their
+# state and counters with their own locks.
+@st.cache_resource
+def build_agent_system(model='gpt-4o', temperature=0.0):
+    from langchain_openai import ChatOpenAI
+
+    sandbox_pool.start()
+    instrumentation.start_metrics_server(getattr(myconfig, "metrics_port", 9108))
+    llm = ChatOpenAI(model=model, temperature=temperature, streaming=True, stream_usage=True)
+    return create_agent_system(llm, Router(log_path="routing_log.jsonl"))
+
+
+def create_agent_system(llm, router):
+    from langchain.output_parsers.openai_functions import JsonOutputFunctionsParser
+    from langgraph.graph import StateGraph, END
+
+    supervisor_chain = (
+            prompt
+            | llm.bind_functions(functions=[function_def], function_call="route")
+            | JsonOutputFunctionsParser()
+    )
+
+    planner_chain = (
+            planner_prompt
+            | llm.bind_functions(functions=[plan_function_def], function_call="plan")
+            | JsonOutputFunctionsParser()
+    )
 
-graph = StateGraph(AgentState)
+    @instrumentation.instrumented("node", "supervisor")
+    def supervisor_node(state):
+        return router.supervise(budget_state(state), supervisor_chain)
 
-graph.add_node("Weather Retriever", weather_retriever_node)
-graph.add_node("Coder", code_node)
-graph.add_node("Energy optimizer", analyze_node)
-graph.add_node("supervisor", supervisor_chain)
+    @instrumentation.instrumented("node", "planner")
+    def planner_node(state):
+        return {"plan": router.plan(budget_state(state), planner_chain)}
 
-for analyzer in analyzers:
-    graph.add_edge(analyzer, "supervisor")
+    weather_retriever = create_agent(llm, [get_weather_forecast, get_pv_forecast], WEATHER_RETRIEVER_PROMPT)
+    weather_retriever_node = functools.partial(weather_state_update, agent=weather_retriever, name="Weather Retriever")
 
-conditional_map = {k: k for k in analyzers}
-conditional_map["Energy optimizer"] = "Energy optimizer"
-graph.add_conditional_edges("supervisor", lambda x: x["next"], conditional_map)
+    code_agent = create_agent(llm, [*analytics_tools, python_sandbox, get_summed_historic_data, get_live_data],
+                              CODER_PROMPT)
+    code_node = functools.partial(agent_node, agent=code_agent, name="Coder")
 
-graph.add_edge("Energy optimizer", END)
+    analyze_agent = create_agent(llm, [energy_optimizer], ENERGY_OPTIMIZER_PROMPT)
+    analyze_node = functools.partial(agent_node, agent=analyze_agent, name="Energy optimizer")
 
-graph.set_entry_point("supervisor")
+    graph = StateGraph(AgentState)
+
+    graph.add_node("Weather Retriever", weather_retriever_node)
+    graph.add_node("Coder", code_node)
+    graph.add_node("Energy optimizer", analyze_node)
+    graph.add_node("supervisor", supervisor_node)
+
+    for analyzer in analyzers:
+        graph.add_edge(analyzer, "supervisor")
+
+    conditional_map = {k: k for k in analyzers}
+    conditional_map["Energy optimizer"] = "Energy optimizer"
+    graph.add_conditional_edges("supervisor", lambda x: x["next"], conditional_map)
+
+    graph.add_edge("Energy optimizer", END)
+
+    graph.set_entry_point("supervisor")
+
+    graph = graph.compile()
+
+    planning_graph = StateGraph(AgentState)
+
+    planning_graph.add_node("Weather Retriever", weather_retriever_node)
+    planning_graph.add_node("Coder", code_node)
+    planning_graph.add_node("Energy optimizer", analyze_node)
+    planning_graph.add_node("planner", planner_node)
+
+    for analyzer in analyzers:
+        planning_graph.add_edge(analyzer, "Energy optimizer")
+
+    planning_graph.add_conditional_edges("planner", lambda x: x["plan"] or ["Energy optimizer"], conditional_map)
+
+    planning_graph.add_edge("Energy optimizer", END)
+
+    planning_graph.set_entry_point("planner")
+
+    planning_graph = planning_graph.compile()
+
+    return AgentSystem(graph, planning_graph, router)
+
+
+@st.cache_resource
+def build_answer_cache():
+    return AnswerCache(max_entries=getattr(myconfig, "answer_cache_entries", 256))
 
-graph = graph.compile()
 
 config = {"recursion_limit": 10}
 
 
-def generate_response(input_text):
+def generate_response(input_text, planning=True):
+    return build_answer_cache().answer(input_text, data_version, lambda: compute_response(input_text, planning))
+
+
+def compute_response(input_text, planning=True):
+    system = build_agent_system()
     output = ""
-    for s in graph.stream(
+    with instrumentation.request_trace("multi", input_text) as trace:
+        for s in http_client.iterate_async((system.planning_graph if planning else system.graph).astream(
+                {
+                    "messages": [HumanMessage(
+                        input_text)]
+                }, config={**config, "callbacks": [instrumentation.TraceCallbackHandler(trace)]}
+        )):
+            output = s
+    logger.debug("Router stats: %s", system.router.stats.summary())
+    logger.debug("Request trace: %s", trace.summary())
+    return output['Energy optimizer']['messages'][0].content
+
+
+def stream_response(input_text, planning=True):
+    system = build_agent_system()
+    figures = queue.Queue()
+    token = figure_sink.set(figures)
+    try:
+        with instrumentation.request_trace("multi", input_text) as trace:
+            yield from stream_graph(system.planning_graph if planning else system.graph, input_text, trace, figures)
+    finally:
+        figure_sink.reset(token)
+        logger.debug("Router stats: %s", system.router.stats.summary())
+    logger.debug("Request trace: %s", trace.summary())
+    yield "trace", trace
+
+
+def stream_graph(graph, input_text, trace, figures):
+    for mode, chunk in http_client.iterate_async(graph.astream(
             {
                 "messages": [HumanMessage(
                     input_text)]
-            }, config=config
-    ):
-        print(s)
-        output = s
-    return output['Energy optimizer']['messages'][0].content
+            }, config={**config, "callbacks": [instrumentation.TraceCallbackHandler(trace)]},
+            stream_mode=["debug", "messages"]
+    )):
+        if mode == "messages":
+            message, metadata = chunk
+            if (isinstance(message, AIMessageChunk) and message.content
+                    and metadata.get("langgraph_node") == "Energy optimizer"):
+                yield "token", message.content
+        elif chunk["type"] == "task":
+            yield "node", chunk["payload"]["name"]
+        elif chunk["type"] == "task_result" and chunk["payload"]["name"] == "Energy optimizer":
+            for channel, value in chunk["payload"]["result"]:
+                if channel == "messages":
+                    yield "final", value[0].content
+
+        while not figures.empty():
+            yield "image", figures.get_nowait()
 
 
 def main():
     st.title("Multi-Agenten System")
 
+    planning = st.sidebar.checkbox("Query data sources in parallel", value=True)
     user_input = st.text_input("Enter your request:", "")
 
     if st.button("Generate Response"):
         if user_input:
-            with st.spinner("Generating response..."):
-                response = generate_response(user_input)
-                formatted_text, image_data = format_response(response)
-
-                st.markdown(formatted_text, unsafe_allow_html=True)
-
-                if image_data:
-                    image = BytesIO(base64.b64decode(image_data))
-                    st.image(image, caption="Generated Plot", use_column_width=True)
+            answers = build_answer_cache()
+            render_stream(answers.stream(user_input, data_version, stream_response(user_input, planning)))
+            logger.debug("Answer cache stats: %s", answers.stats())
+            render_cache_stats(answers.stats())
         else:
             st.warning("Please enter a request.")
 
@@ -1,18 +1,27 @@
-import base64
+import logging
 import os
+import queue
+import threading
 import warnings
-from io import BytesIO
 
 import streamlit as st
 from langchain_core.messages import HumanMessage
-from langchain_experimental.tools import PythonREPLTool
-from langchain_openai import ChatOpenAI
 
 import auth_keys
-from shared_utils import (get_weather_forecast, create_agent, format_response, get_summed_historic_data, get_live_data)
+import http_client
+import instrumentation
+import myconfig
+from shared_utils import (get_weather_forecast, create_agent, get_summed_historic_data, get_live_data, figure_sink,
+                          python_sandbox, analytics_tools, energy_optimizer,
+                          get_pv_forecast, data_version)
+from answer_cache import AnswerCache
+from sandbox_pool import sandbox_pool
+from stream_rendering import render_cache_stats, render_stream
 
 warnings.filterwarnings("ignore")
 
+logger = logging.getLogger(__name__)
+
 os.environ["OPENAI_API_KEY"] = auth_keys.openai_api_key
 os.environ["OPENWEATHERMAP_API_KEY"] = auth_keys.openweather_api_key
 
@@ -20,47 +29,120 @@ os.environ["LANGCHAIN_TRACING_V2"] = "true"
 os.environ["LANGCHAIN_API_KEY"] = auth_keys.langchain_api_key
 os.environ["LANGCHAIN_PROJECT"] = "single_agent"
 
-python_repl_tool = PythonREPLTool()
-
-llm = ChatOpenAI(model='gpt-4o', temperature=0)
-
-agent_all = create_agent(llm=llm,
-                         tools=[get_weather_forecast, python_repl_tool, get_summed_historic_data, get_live_data],
-                         system_prompt="You are the Weather Retriever, Energy Optimizer, and Python Code Generator. "
-                                       "Your task is to provide the current weather and weather forecast for a "
-                                       "predefined location, analyze solar and weather data to provide insights on "
-                                       "energy usage and optimization, and generate safe Python code to analyze data "
-                                       "and create charts using matplotlib. If your task ist to plot solar data you "
-                                       "can request time series data with python from the endpoint "
-                                       "<insert url here> "
-                                       "which returns CSV data covering the last three days with keys for "
-                                       "production (kWh), grid (kWh), consumption (kWh), timestamp ("
-                                       "YYYY-MM-DDTHH:MM:SS format), and battery_status (%). When analyzing energy "
-                                       "usage, prioritize power from solar panels and recommend energy-intensive "
-                                       "tasks during sunny periods to utilize free solar energy. Consider the "
-                                       "following hierarchy of factors: 1) Solar Production, prioritizing "
-                                       "recommendations for periods with highest expected solar energy production, "
-                                       "2) Weather Conditions, considering cloud cover and precipitation affecting "
-                                       "solar production, and 3) Temperature, suggesting energy-intensive tasks "
-                                       "during favorable temperatures if solar production is insufficient. Provide "
-                                       "insights on non-optimal energy usage periods, suggest optimal times for high "
-                                       "energy consumption based on solar production and weather forecasts, "
-                                       "and offer general energy-saving recommendations. When analyzing data or "
-                                       "visualizations, provide tips on interpretation and further analysis. Treat "
-                                       "all information as your own, without referencing separate roles or "
-                                       "interactions. Always answer in the language of the prompt.")
+SYSTEM_PROMPT = ("You are the Weather Retriever, Energy Optimizer, and Python Code Generator. "
+                 "Your task is to provide the current weather and weather forecast for a "
+                 "predefined location, forecast the solar production with the pv_forecast tool, "
+                 "analyze solar and weather data to provide insights on "
+                 "energy usage and optimization, and generate safe Python code to analyze data "
+                 "and create charts using matplotlib. For daily energy totals, the self-consumption "
+                 "ratio, the peak production hour, the battery minimum and maximum or the standard "
+                 "production, consumption and grid chart always use the matching analytics tool "
+                 "instead of writing code. If your task ist to plot or analyze solar "
+                 "data run your code with the python_sandbox tool, where the DataFrame df is "
+                 "already loaded, or load it with 'from shared_utils import "
+                 "load_solar_frame' and 'df = load_solar_frame()', which covers the last three "
+                 "days by default with columns for production (kWh), grid (kWh), consumption "
+                 "(kWh), timestamp (timezone aware datetime), and battery_status (%). "
+                 "load_solar_frame accepts the optional keyword arguments start and end (ISO "
+                 "8601 strings), fields (list of column names besides timestamp) and "
+                 "resolution ('raw', '1min', '15min' or '1h'), so "
+                 "only request the slice you need. To show a chart to the user call "
+                 "show_figure() from shared_utils after plotting instead of plt.show(). "
+                 "When analyzing energy "
+                 "usage, prioritize power from solar panels and recommend energy-intensive "
+                 "tasks during sunny periods to utilize free solar energy. Consider the "
+                 "following hierarchy of factors: 1) Solar Production, prioritizing "
+                 "recommendations for periods with highest expected solar energy production, "
+                 "2) Weather Conditions, considering cloud cover and precipitation affecting "
+                 "solar production, and 3) Temperature, suggesting energy-intensive tasks "
+                 "during favorable temperatures if solar production is insufficient. Provide "
+                 "insights on non-optimal energy usage periods, suggest optimal times for high "
+                 "energy consumption based on solar production and weather forecasts, "
+                 "always calling the energy_optimizer tool with each load's duration, power and "
+                 "allowed time window and explaining its schedule instead of guessing times, "
+                 "and offer general energy-saving recommendations. When analyzing data or "
+                 "visualizations, provide tips on interpretation and further analysis. Treat "
+                 "all information as your own, without referencing separate roles or "
+                 "interactions. Always answer in the language of the prompt.")
+
+
+# Cached resources are shared by every Streamlit session; Router, AnswerCache and ToolCache guard their
+# state and counters with their own locks.
+@st.cache_resource
+def build_agent(model='gpt-4o', temperature=0.0):
+    from langchain_openai import ChatOpenAI
+
+    sandbox_pool.start()
+    instrumentation.start_metrics_server(getattr(myconfig, "metrics_port_single", 9109))
+    llm = ChatOpenAI(model=model, temperature=temperature, streaming=True, stream_usage=True)
+    return create_single_agent(llm)
+
+
+def create_single_agent(llm):
+    return create_agent(llm=llm,
+                        tools=[get_weather_forecast, get_pv_forecast, *analytics_tools, python_sandbox,
+                               get_summed_historic_data, get_live_data, energy_optimizer],
+                        system_prompt=SYSTEM_PROMPT)
+
+
+@st.cache_resource
+def build_answer_cache():
+    return AnswerCache(max_entries=getattr(myconfig, "answer_cache_entries", 256))
+
 
 config = {"recursion_limit": 7}
 
 
 def generate_response(input_text):
-    output = agent_all.invoke({
+    return build_answer_cache().answer(input_text, data_version, lambda: compute_response(input_text))
+
+
+def compute_response(input_text):
+    output = build_agent().invoke({
         "messages": [HumanMessage(
             input_text)]
     }, config=config)
     return output.get("output")
 
 
+async def publish_events(agent, input_text, events, trace):
+    figures = queue.Queue()
+    figure_sink.set(figures)
+    async for event in agent.astream_events({
+        "messages": [HumanMessage(
+            input_text)]
+    }, config={**config, "callbacks": [instrumentation.TraceCallbackHandler(trace)]}, version="v2"):
+        if event["event"] == "on_tool_start":
+            events.put(("node", f"Tool {event['name']}"))
+        elif event["event"] == "on_chat_model_stream" and event["data"]["chunk"].content:
+            events.put(("token", event["data"]["chunk"].content))
+        elif event["event"] == "on_chain_end" and not event["parent_ids"]:
+            events.put(("final", event["data"]["output"].get("output")))
+
+        while not figures.empty():
+            events.put(("image", figures.get_nowait()))
+
+
+def stream_response(input_text):
+    agent = build_agent()
+    events = queue.Queue()
+
+    def run():
+        try:
+            with instrumentation.request_trace("single", input_text) as trace:
+                http_client.run_async(publish_events(agent, input_text, events, trace))
+            logger.debug("Request trace: %s", trace.summary())
+            events.put(("trace", trace))
+        finally:
+            events.put(None)
+
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    while (event := events.get()) is not None:
+        yield event
+    worker.join()
+
+
 def main():
     st.title("Single-Agenten System")
 
@@ -68,15 +150,10 @@ def main():
 
     if st.button("Generate Response"):
         if user_input:
-            with st.spinner("Generating response..."):
-                response = generate_response(user_input)
-                formatted_text, image_data = format_response(response)
-
-                st.markdown(formatted_text, unsafe_allow_html=True)
-
-                if image_data:
-                    image = BytesIO(base64.b64decode(image_data))
-                    st.image(image, caption="Generated Plot", use_column_width=True)
+            answers = build_answer_cache()
+            render_stream(answers.stream(user_input, data_version, stream_response(user_input)))
+            logger.debug("Answer cache stats: %s", answers.stats())
+            render_cache_stats(answers.stats())
         else:
             st.warning("Please enter a request.")
 
@@ -0,0 +1,223 @@
+import asyncio
+import functools
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import instrumentation
+
+Entry = namedtuple("Entry", ["value", "fetched_at", "ttl", "stale_ttl"])
+
+
+class Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.error = None
+
+
+class ToolCache:
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        self.refresh_tasks = set()
+        self.lock = threading.Lock()
+        self.metrics = {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0, "refreshes": 0, "evictions": 0,
+                        "errors": 0}
+
+    def count(self, metric):
+        with self.lock:
+            self.metrics[metric] += 1
+        instrumentation.record_cache(metric)
+
+    def lookup(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def store(self, key, value, ttl, stale_ttl):
+        with self.lock:
+            self.entries[key] = Entry(value, time.monotonic(), ttl, stale_ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.metrics["evictions"] += 1
+
+    def fetched_at(self, key):
+        entry = self.lookup(key)
+        return None if entry is None else time.time() - (time.monotonic() - entry.fetched_at)
+
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def get(self, key, fetch, ttl, stale_ttl=0.0):
+        entry = self.lookup(key)
+        if entry is not None:
+            age = time.monotonic() - entry.fetched_at
+            if age <= ttl:
+                self.count("hits")
+                return entry.value
+            if age <= ttl + stale_ttl:
+                self.count("stale_hits")
+                self.revalidate(key, fetch, ttl, stale_ttl)
+                return entry.value
+
+        self.count("misses")
+        return self.load(key, fetch, ttl, stale_ttl)
+
+    def claim(self, key):
+        with self.lock:
+            flight = self.in_flight.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self.in_flight[key] = Flight()
+            return flight, True
+
+    def release(self, key, flight, error=None):
+        flight.error = error
+        with self.lock:
+            self.in_flight.pop(key, None)
+        flight.event.set()
+
+    def follow(self, key, flight):
+        if flight.error is not None:
+            raise flight.error
+        return self.lookup(key)
+
+    def load(self, key, fetch, ttl, stale_ttl):
+        flight, leader = self.claim(key)
+        if not leader:
+            self.count("coalesced")
+            flight.event.wait()
+            entry = self.follow(key, flight)
+            if entry is not None:
+                return entry.value
+            return self.load(key, fetch, ttl, stale_ttl)
+
+        error = None
+        try:
+            value = fetch()
+            self.store(key, value, ttl, stale_ttl)
+            return value
+        except Exception as failure:
+            error = failure
+            self.count("errors")
+            raise
+        finally:
+            self.release(key, flight, error)
+
+    def revalidate(self, key, fetch, ttl, stale_ttl):
+        flight, leader = self.claim(key)
+        if not leader:
+            return
+
+        def refresh():
+            error = None
+            try:
+                self.store(key, fetch(), ttl, stale_ttl)
+                self.count("refreshes")
+            except Exception as failure:
+                error = failure
+                self.count("errors")
+            finally:
+                self.release(key, flight, error)
+
+        threading.Thread(target=refresh, name="tool-cache-refresh", daemon=True).start()
+
+    async def aget(self, key, afetch, ttl, stale_ttl=0.0):
+        entry = self.lookup(key)
+        if entry is not None:
+            age = time.monotonic() - entry.fetched_at
+            if age <= ttl:
+                self.count("hits")
+                return entry.value
+            if age <= ttl + stale_ttl:
+                self.count("stale_hits")
+                self.arevalidate(key, afetch, ttl, stale_ttl)
+                return entry.value
+
+        self.count("misses")
+        return await self.aload(key, afetch, ttl, stale_ttl)
+
+    async def aload(self, key, afetch, ttl, stale_ttl):
+        flight, leader = self.claim(key)
+        if not leader:
+            self.count("coalesced")
+            await asyncio.to_thread(flight.event.wait)
+            entry = self.follow(key, flight)
+            if entry is not None:
+                return entry.value
+            return await self.aload(key, afetch, ttl, stale_ttl)
+
+        error = None
+        try:
+            value = await afetch()
+            self.store(key, value, ttl, stale_ttl)
+            return value
+        except Exception as failure:
+            error = failure
+            self.count("errors")
+            raise
+        finally:
+            self.release(key, flight, error)
+
+    def arevalidate(self, key, afetch, ttl, stale_ttl):
+        flight, leader = self.claim(key)
+        if not leader:
+            return
+
+        async def refresh():
+            error = None
+            try:
+                self.store(key, await afetch(), ttl, stale_ttl)
+                self.count("refreshes")
+            except Exception as failure:
+                error = failure
+                self.count("errors")
+            finally:
+                self.release(key, flight, error)
+                self.refresh_tasks.discard(task)
+
+        task = asyncio.get_running_loop().create_task(refresh())
+        self.refresh_tasks.add(task)
+
+    def stats(self):
+        with self.lock:
+            metrics = dict(self.metrics)
+            metrics["entries"] = len(self.entries)
+        lookups = metrics["hits"] + metrics["stale_hits"] + metrics["misses"]
+        metrics["hit_rate"] = (metrics["hits"] + metrics["stale_hits"]) / lookups if lookups else 0.0
+        return metrics
+
+
+tool_cache = ToolCache()
+
+
+def cached(ttl, stale_ttl=0.0, name=None, cache=tool_cache):
+    def decorator(function):
+        def cache_key(*args, **kwargs):
+            return name or function.__name__, args, tuple(sorted(kwargs.items()))
+
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                return await cache.aget(cache_key(*args, **kwargs), lambda: function(*args, **kwargs), ttl,
+                                        stale_ttl)
+
+            async_wrapper.cache_key = cache_key
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            return cache.get(cache_key(*args, **kwargs), lambda: function(*args, **kwargs), ttl, stale_ttl)
+
+        wrapper.cache_key = cache_key
+        return wrapper
+
+    return decorator
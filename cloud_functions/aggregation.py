@@ -0,0 +1,205 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+LOCAL_TIMEZONE = "Europe/Berlin"
+RAW_COLLECTION = "SolarDataV1"
+
+POWER_FIELDS = ['production', 'grid', 'consumption']
+CSV_COLUMNS = ['timestamp', 'production', 'grid', 'consumption', 'battery_status']
+BATTERY_MISSING = 255
+NANOSECONDS_PER_HOUR = 3_600_000_000_000
+PAGE_SIZE = 5000
+
+
+def frame_from_columns(timestamp, production, grid, consumption, battery_status):
+    return pd.DataFrame({
+        'timestamp': np.asarray(timestamp, dtype=np.int64),
+        'production': np.asarray(production, dtype=np.float32),
+        'grid': np.asarray(grid, dtype=np.float32),
+        'consumption': np.asarray(consumption, dtype=np.float32),
+        'battery_status': np.asarray(battery_status, dtype=np.uint8),
+    })
+
+
+def frame_from_documents(documents):
+    size = len(documents)
+    timestamp = np.empty(size, dtype=np.int64)
+    powers = {field: np.full(size, np.nan, dtype=np.float32) for field in POWER_FIELDS}
+    battery_status = np.full(size, BATTERY_MISSING, dtype=np.uint8)
+
+    for index, data in enumerate(documents):
+        timestamp[index] = int(data['timestamp'].timestamp() * 1_000_000_000)
+        for field in POWER_FIELDS:
+            value = data.get(field)
+            if value is not None:
+                powers[field][index] = value
+        if data.get('battery_status') is not None:
+            battery_status[index] = data['battery_status']
+
+    frame = frame_from_columns(timestamp, powers['production'], powers['grid'], powers['consumption'],
+                               battery_status)
+    return frame.sort_values('timestamp', kind='stable', ignore_index=True)
+
+
+def load_window(db, start, end=None):
+    query = db.collection(RAW_COLLECTION).where("timestamp", ">=", start)
+    if end is not None:
+        query = query.where("timestamp", "<", end)
+    return frame_from_documents([doc.to_dict() for doc in query.stream()])
+
+
+def iter_window_pages(db, start, end=None, fields=None, page_size=PAGE_SIZE):
+    query = db.collection(RAW_COLLECTION).where("timestamp", ">=", start)
+    if end is not None:
+        query = query.where("timestamp", "<", end)
+    if fields is not None:
+        query = query.select(['timestamp', *fields])
+    query = query.order_by("timestamp").limit(page_size)
+
+    last_snapshot = None
+    while True:
+        page_query = query if last_snapshot is None else query.start_after(last_snapshot)
+        snapshots = list(page_query.stream())
+        if not snapshots:
+            return
+        yield frame_from_documents([snapshot.to_dict() for snapshot in snapshots])
+        if len(snapshots) < page_size:
+            return
+        last_snapshot = snapshots[-1]
+
+
+def resample(frame, bucket_seconds):
+    keys = frame['timestamp'].to_numpy() // (bucket_seconds * 1_000_000_000)
+    numeric = frame.drop(columns='timestamp').astype(np.float64)
+    numeric['battery_status'] = numeric['battery_status'].where(numeric['battery_status'] != BATTERY_MISSING)
+    means = numeric.groupby(keys, sort=True).mean()
+
+    return frame_from_columns(
+        means.index.to_numpy() * bucket_seconds * 1_000_000_000,
+        means['production'], means['grid'], means['consumption'],
+        means['battery_status'].round().fillna(BATTERY_MISSING),
+    )
+
+
+def iter_resampled(pages, bucket_seconds):
+    carry = None
+    for page in pages:
+        if carry is not None:
+            page = pd.concat([carry, page], ignore_index=True)
+        if page.empty:
+            continue
+
+        keys = page['timestamp'].to_numpy() // (bucket_seconds * 1_000_000_000)
+        complete = keys < keys[-1]
+        carry = page[~complete]
+        if complete.any():
+            yield resample(page[complete], bucket_seconds)
+
+    if carry is not None and not carry.empty:
+        yield resample(carry, bucket_seconds)
+
+
+def wall_clock(frame, timezone=LOCAL_TIMEZONE):
+    timestamp = frame['timestamp'].to_numpy()
+    if timestamp.size == 0:
+        return timestamp.astype('datetime64[ns]')
+
+    utc_hours = timestamp // NANOSECONDS_PER_HOUR
+    first_hour = utc_hours.min()
+    hour_starts = (np.arange(utc_hours.max() - first_hour + 1) + first_hour) * NANOSECONDS_PER_HOUR
+    local_starts = pd.to_datetime(hour_starts, utc=True).tz_convert(timezone).tz_localize(None)
+    offsets = local_starts.to_numpy().astype(np.int64) - hour_starts
+    return (timestamp + offsets[utc_hours - first_hour]).astype('datetime64[ns]')
+
+
+def masked_hourly_means(hour_index, hours, values, mask):
+    sums = np.bincount(hour_index, weights=np.where(mask, values, 0), minlength=hours)
+    counts = np.bincount(hour_index, weights=mask, minlength=hours)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+def hourly_means(frame, timezone=LOCAL_TIMEZONE):
+    wall_hours = wall_clock(frame, timezone).astype('datetime64[h]').astype(np.int64)
+    first_hour = wall_hours.min()
+    hour_index = wall_hours - first_hour
+    hours = int(hour_index.max()) + 1
+
+    consumption = frame['consumption'].to_numpy(dtype=np.float64)
+    grid = frame['grid'].to_numpy(dtype=np.float64)
+    production = frame['production'].to_numpy(dtype=np.float64)
+
+    means = pd.DataFrame({
+        'consumption_positive': masked_hourly_means(hour_index, hours, consumption, consumption > 0),
+        'grid_positive': masked_hourly_means(hour_index, hours, grid, grid >= 0),
+        'grid_negative': masked_hourly_means(hour_index, hours, grid, grid < 0),
+        'production_positive': masked_hourly_means(hour_index, hours, production, production > 0),
+    }, index=pd.Index((np.arange(hours) + first_hour).astype('datetime64[h]'), name='hour'))
+    return means.dropna(how='all')
+
+
+def daily_sums(frame, timezone=LOCAL_TIMEZONE):
+    if frame.empty:
+        return []
+
+    means = hourly_means(frame, timezone)
+    totals = means.groupby(means.index.normalize()).sum().round(2)
+
+    result = []
+    for day, row in totals.iterrows():
+        result.append({
+            'date': day.date().isoformat(),
+            'consumption_positive': float(row['consumption_positive']),
+            'grid_positive': float(row['grid_positive']),
+            'grid_negative': float(row['grid_negative']),
+            'production_positive': float(row['production_positive']),
+        })
+    return result
+
+
+def csv_frame(frame, timezone=LOCAL_TIMEZONE, columns=CSV_COLUMNS):
+    output = frame[columns].copy()
+    output['timestamp'] = np.datetime_as_string(wall_clock(frame, timezone), unit='m')
+    if 'battery_status' in output:
+        output['battery_status'] = output['battery_status'].where(
+            output['battery_status'] != BATTERY_MISSING).astype('UInt8')
+    return output
+
+
+def iter_csv(pages, timezone=LOCAL_TIMEZONE, columns=CSV_COLUMNS):
+    yield ",".join(columns) + "\n"
+    for page in pages:
+        yield csv_frame(page, timezone, columns).to_csv(index=False, header=False)
+
+
+def arrow_table(frame, columns=CSV_COLUMNS):
+    arrays = {'timestamp': pa.array(frame['timestamp'].to_numpy() // 1_000_000, type=pa.timestamp('ms', tz='UTC'))}
+    for column in columns[1:]:
+        values = frame[column].to_numpy()
+        if column == 'battery_status':
+            arrays[column] = pa.array(values, type=pa.uint8(), mask=values == BATTERY_MISSING)
+        else:
+            arrays[column] = pa.array(values, type=pa.float32(), from_pandas=True)
+    return pa.table(arrays)
+
+
+def parquet_bytes(pages, columns=CSV_COLUMNS):
+    output = io.BytesIO()
+    writer = None
+    for page in pages:
+        table = arrow_table(page, columns)
+        if writer is None:
+            writer = pq.ParquetWriter(
+                output, table.schema, compression='zstd',
+                use_dictionary=[column for column in columns if column != 'timestamp'],
+                column_encoding={'timestamp': 'DELTA_BINARY_PACKED'},
+            )
+        writer.write_table(table)
+    if writer is None:
+        return None
+    writer.close()
+    return output.getvalue()
@@ -0,0 +1,96 @@
+import argparse
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+import aggregation
+
+SAMPLE_INTERVAL_SECONDS = 10
+WINDOWS = {"3 days": 3, "30 days": 30, "1 year": 365}
+
+
+def synthetic_columns(days, seed=0):
+    rng = np.random.default_rng(seed)
+    end = int(datetime(2024, 6, 1, tzinfo=ZoneInfo("UTC")).timestamp())
+    seconds = np.arange(end - days * 86400, end, SAMPLE_INTERVAL_SECONDS, dtype=np.int64)
+
+    daylight = np.clip(np.sin((seconds % 86400 - 5 * 3600) / (14 * 3600) * np.pi), 0, None)
+    production = np.round(daylight * 8 * rng.uniform(0.3, 1.0, seconds.size), 1)
+    consumption = np.round(rng.gamma(2.0, 0.4, seconds.size), 1)
+    grid = np.round(consumption - production, 1)
+    battery_status = rng.integers(0, 101, seconds.size)
+
+    return seconds * 1_000_000_000, production, grid, consumption, battery_status
+
+
+def legacy_daily_sums(documents):
+    daily_data = {}
+    for data in documents:
+        timestamp = data['timestamp'].astimezone(ZoneInfo("Europe/Berlin"))
+        day_key = timestamp.date().isoformat()
+        hour_key = timestamp.hour
+        if day_key not in daily_data:
+            daily_data[day_key] = {
+                'consumption': {'pos': [0] * 24, 'pos_count': [0] * 24},
+                'grid': {'pos': [0] * 24, 'neg': [0] * 24, 'pos_count': [0] * 24, 'neg_count': [0] * 24},
+                'production': {'pos': [0] * 24, 'pos_count': [0] * 24}
+            }
+        for field in ['consumption', 'grid', 'production']:
+            value = data[field]
+            if field == 'grid':
+                sign = 'pos' if value >= 0 else 'neg'
+                daily_data[day_key][field][sign][hour_key] += value
+                daily_data[day_key][field][f'{sign}_count'][hour_key] += 1
+            elif value > 0:
+                daily_data[day_key][field]['pos'][hour_key] += value
+                daily_data[day_key][field]['pos_count'][hour_key] += 1
+    return daily_data
+
+
+def documents_from_columns(timestamp, production, grid, consumption, battery_status):
+    epoch = datetime(1970, 1, 1, tzinfo=ZoneInfo("UTC"))
+    return [
+        {
+            'timestamp': epoch + timedelta(seconds=int(ts // 1_000_000_000)),
+            'production': float(production[i]),
+            'grid': float(grid[i]),
+            'consumption': float(consumption[i]),
+            'battery_status': int(battery_status[i]),
+        }
+        for i, ts in enumerate(timestamp)
+    ]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized daily sums against the legacy loop.")
+    parser.add_argument("--legacy-max-days", type=int, default=30,
+                        help="skip the per-document loop for windows longer than this")
+    args = parser.parse_args()
+
+    print(f"{'window':>8} {'samples':>10} {'daily_sums ms':>14} {'csv ms':>10} {'legacy ms':>10}")
+    for label, days in WINDOWS.items():
+        columns = synthetic_columns(days)
+        frame = aggregation.frame_from_columns(*columns)
+
+        _, sums_ms = timed(aggregation.daily_sums, frame)
+        _, csv_ms = timed(lambda: aggregation.csv_frame(frame).to_csv(index=False))
+
+        legacy_ms = "skipped"
+        if days <= args.legacy_max_days:
+            documents = documents_from_columns(*columns)
+            _, elapsed = timed(legacy_daily_sums, documents)
+            legacy_ms = f"{elapsed:.1f}"
+
+        print(f"{label:>8} {len(frame):>10} {sums_ms:>14.1f} {csv_ms:>10.1f} {legacy_ms:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import time
+
+import aggregation
+import buckets
+from benchmark_aggregation import documents_from_columns, synthetic_columns
+
+WINDOWS = {"3 days": 3, "30 days": 30}
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    print(f"{'window':>8} {'layout':>10} {'documents read':>15} {'decode ms':>10}")
+    for label, days in WINDOWS.items():
+        columns = synthetic_columns(days)
+        documents = documents_from_columns(*columns)
+        grouped = buckets.frame_rows(aggregation.frame_from_columns(*columns), buckets.BUCKET_SECONDS)
+        bucket_documents = [buckets.bucket_document(start, rows, buckets.BUCKET_SECONDS, "benchmark")
+                            for start, rows in sorted(grouped.items())]
+
+        _, documents_ms = timed(lambda: aggregation.frame_from_documents(documents))
+        _, buckets_ms = timed(lambda: buckets.frame_from_buckets(bucket_documents))
+
+        print(f"{label:>8} {'samples':>10} {len(documents):>15} {documents_ms:>10.1f}")
+        print(f"{label:>8} {'buckets':>10} {len(bucket_documents):>15} {buckets_ms:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import io
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import aggregation
+from benchmark_aggregation import synthetic_columns
+
+WINDOWS = {"3 days": 3, "30 days": 30}
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    print(f"{'window':>8} {'format':>8} {'bytes':>12} {'encode ms':>10} {'parse ms':>10}")
+    for label, days in WINDOWS.items():
+        frame = aggregation.frame_from_columns(*synthetic_columns(days))
+        pages = [frame.iloc[i:i + aggregation.PAGE_SIZE] for i in range(0, len(frame), aggregation.PAGE_SIZE)]
+
+        csv_payload, csv_encode_ms = timed(lambda: "".join(aggregation.iter_csv(pages)).encode())
+        _, csv_parse_ms = timed(lambda: pd.read_csv(io.BytesIO(csv_payload), parse_dates=['timestamp']))
+
+        parquet_payload, parquet_encode_ms = timed(lambda: aggregation.parquet_bytes(pages))
+        _, parquet_parse_ms = timed(
+            lambda: pq.read_table(pa.BufferReader(parquet_payload)).to_pandas(split_blocks=True, self_destruct=True))
+
+        print(f"{label:>8} {'csv':>8} {len(csv_payload):>12} {csv_encode_ms:>10.1f} {csv_parse_ms:>10.1f}")
+        print(f"{label:>8} {'parquet':>8} {len(parquet_payload):>12} {parquet_encode_ms:>10.1f} "
+              f"{parquet_parse_ms:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
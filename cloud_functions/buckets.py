@@ -0,0 +1,172 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+import aggregation
+
+BUCKET_COLLECTION = "SolarBucketsV1"
+BUCKET_SECONDS = 3600
+FIELDS = ['production', 'grid', 'consumption', 'battery_status']
+BACKFILL_WRITER = "backfill"
+PAGE_BUCKETS = 48
+BATCH_LIMIT = 500
+
+
+def bucket_start(timestamp, bucket_seconds=BUCKET_SECONDS):
+    seconds = int(timestamp.timestamp()) // bucket_seconds * bucket_seconds
+    return datetime.fromtimestamp(seconds, timezone.utc)
+
+
+def bucket_id(start):
+    return start.strftime("%Y-%m-%dT%H:%MZ")
+
+
+def bucket_timestamps(bucket):
+    start = int(bucket['start'].timestamp()) * 1_000_000_000
+    return start + np.asarray(bucket.get('offset_ms', []), dtype=np.int64) * 1_000_000
+
+
+def bucket_values(bucket, field):
+    values = bucket.get(field)
+    if values is None:
+        return np.full(len(bucket.get('offset_ms', [])), np.nan)
+    return np.array(values, dtype=np.float64)
+
+
+def frame_from_buckets(buckets):
+    timestamp = [bucket_timestamps(bucket) for bucket in buckets]
+    columns = {field: [bucket_values(bucket, field) for bucket in buckets] for field in FIELDS}
+    concatenated = {field: np.concatenate(values) if values else np.zeros(0) for field, values in columns.items()}
+    battery_status = concatenated['battery_status']
+
+    frame = aggregation.frame_from_columns(
+        np.concatenate(timestamp) if timestamp else np.zeros(0, dtype=np.int64),
+        concatenated['production'], concatenated['grid'], concatenated['consumption'],
+        np.where(np.isnan(battery_status), aggregation.BATTERY_MISSING, battery_status),
+    )
+    return frame.sort_values('timestamp', kind='stable', ignore_index=True)
+
+
+def iter_bucket_pages(db, start, end=None, fields=None, page_buckets=PAGE_BUCKETS, bucket_seconds=BUCKET_SECONDS,
+                      collection=BUCKET_COLLECTION):
+    query = db.collection(collection).where("start", ">=", bucket_start(start, bucket_seconds))
+    if end is not None:
+        query = query.where("start", "<", end)
+    if fields is not None:
+        query = query.select(['start', 'offset_ms', *fields])
+    query = query.order_by("start").limit(page_buckets)
+
+    start_ns = int(start.timestamp() * 1_000_000_000)
+    end_ns = None if end is None else int(end.timestamp() * 1_000_000_000)
+    last_snapshot = None
+    while True:
+        page_query = query if last_snapshot is None else query.start_after(last_snapshot)
+        snapshots = list(page_query.stream())
+        if not snapshots:
+            return
+
+        frame = frame_from_buckets([snapshot.to_dict() for snapshot in snapshots])
+        timestamps = frame['timestamp'].to_numpy()
+        inside = timestamps >= start_ns
+        if end_ns is not None:
+            inside &= timestamps < end_ns
+        if inside.any():
+            yield frame[inside].reset_index(drop=True)
+        if len(snapshots) < page_buckets:
+            return
+        last_snapshot = snapshots[-1]
+
+
+def added_samples(before, after):
+    known = set((before or {}).get('offset_ms', []))
+    start = after['start']
+    samples = []
+    for index, offset in enumerate(after.get('offset_ms', [])):
+        if offset not in known:
+            samples.append({
+                'timestamp': start + timedelta(milliseconds=offset),
+                **{field: after[field][index] for field in FIELDS if field in after},
+            })
+    return samples
+
+
+def merge_rows(existing, rows):
+    merged = {}
+    if existing:
+        for index, offset in enumerate(existing.get('offset_ms', [])):
+            merged[offset] = [existing[field][index] for field in FIELDS]
+    merged.update(rows)
+    return merged
+
+
+def bucket_document(start, rows, bucket_seconds, writer):
+    offsets = sorted(rows)
+    return {
+        'start': start,
+        'seconds': bucket_seconds,
+        'count': len(offsets),
+        'writer': writer,
+        'offset_ms': offsets,
+        **{field: [rows[offset][index] for offset in offsets] for index, field in enumerate(FIELDS)},
+    }
+
+
+def frame_rows(frame, bucket_seconds):
+    timestamps = frame['timestamp'].to_numpy()
+    bucket_ns = bucket_seconds * 1_000_000_000
+    keys = timestamps // bucket_ns
+    values = {field: frame[field].to_numpy() for field in FIELDS}
+
+    grouped = {}
+    for index, key in enumerate(keys.tolist()):
+        row = [None if np.isnan(values[field][index]) else round(float(values[field][index]), 3)
+               for field in aggregation.POWER_FIELDS]
+        battery_status = int(values['battery_status'][index])
+        row.append(None if battery_status == aggregation.BATTERY_MISSING else battery_status)
+        offset = int(timestamps[index] - key * bucket_ns) // 1_000_000
+        grouped.setdefault(key, {})[offset] = row
+    return {datetime.fromtimestamp(key * bucket_seconds, timezone.utc): rows for key, rows in grouped.items()}
+
+
+def write_buckets(db, grouped, bucket_seconds=BUCKET_SECONDS, writer=BACKFILL_WRITER, collection=BUCKET_COLLECTION):
+    collection = db.collection(collection)
+    starts = sorted(grouped)
+    for offset in range(0, len(starts), BATCH_LIMIT):
+        refs = [collection.document(bucket_id(start)) for start in starts[offset:offset + BATCH_LIMIT]]
+        existing = {snapshot.id: snapshot.to_dict() for snapshot in db.get_all(refs) if snapshot.exists}
+        batch = db.batch()
+        for start, ref in zip(starts[offset:offset + BATCH_LIMIT], refs):
+            rows = merge_rows(existing.get(ref.id), grouped[start])
+            batch.set(ref, bucket_document(start, rows, bucket_seconds, writer))
+        batch.commit()
+    return len(starts)
+
+
+def migrate(db, start, end=None):
+    documents = 0
+    written = set()
+    for page in aggregation.iter_window_pages(db, start, end):
+        documents += len(page)
+        grouped = frame_rows(page, BUCKET_SECONDS)
+        write_buckets(db, grouped)
+        written.update(grouped)
+    return documents, len(written)
+
+
+if __name__ == "__main__":
+    import argparse
+    from zoneinfo import ZoneInfo
+
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    parser = argparse.ArgumentParser(description="Backfill SolarBucketsV1 from the per-sample SolarDataV1 documents.")
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    firebase_admin.initialize_app(credentials.Certificate("auth.json"))
+    start_day = datetime.now(ZoneInfo(aggregation.LOCAL_TIMEZONE)) - timedelta(days=args.days)
+    start_day = start_day.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    documents, bucket_count = migrate(firestore.client(), start_day)
+    print(f"Packed {documents} sample documents into {bucket_count} bucket documents")
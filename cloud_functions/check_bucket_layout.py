@@ -0,0 +1,66 @@
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+
+import aggregation
+import buckets
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "raspberry_pi_scripts"))
+import sample_buckets  # noqa: E402
+
+START = datetime(2026, 3, 29, 0, 59, 30, tzinfo=timezone.utc)
+
+
+def samples(count, offset_seconds=0):
+    return [{
+        "timestamp": START + timedelta(seconds=offset_seconds + 10 * index, milliseconds=250 * (index % 3)),
+        "production": round(1.5 + 0.125 * index, 3),
+        "grid": None if index % 7 == 3 else round(-0.75 + 0.5 * index, 3),
+        "consumption": round(0.5 + 0.001 * index, 3),
+        "battery_status": None if index % 5 == 4 else 40 + index,
+    } for index in range(count)]
+
+
+def backfill_documents(batch, existing):
+    columns = [np.array([int(sample["timestamp"].timestamp() * 1000) * 1_000_000 for sample in batch])]
+    columns += [np.array([np.nan if sample[field] is None else sample[field] for sample in batch])
+                for field in aggregation.POWER_FIELDS]
+    columns.append(np.array([aggregation.BATTERY_MISSING if sample["battery_status"] is None
+                             else sample["battery_status"] for sample in batch]))
+    grouped = buckets.frame_rows(aggregation.frame_from_columns(*columns), buckets.BUCKET_SECONDS)
+    return {buckets.bucket_id(start): buckets.bucket_document(start, buckets.merge_rows(existing.get(
+        buckets.bucket_id(start)), rows), buckets.BUCKET_SECONDS, "check") for start, rows in grouped.items()}
+
+
+def ingester_documents(batch, existing):
+    return {key: sample_buckets.merge_bucket(existing.get(key), start, bucket_samples, writer="check")
+            for key, (start, bucket_samples) in sample_buckets.group_by_bucket(batch).items()}
+
+
+def main():
+    failures = []
+    constants = ("BUCKET_COLLECTION", "BUCKET_SECONDS", "FIELDS")
+    for name in constants:
+        if list(np.atleast_1d(getattr(buckets, name))) != list(np.atleast_1d(getattr(sample_buckets, name))):
+            failures.append(f"{name} differs")
+
+    first, second = samples(12), samples(12, offset_seconds=55)
+    ingested = ingester_documents(first, {})
+    ingested.update(ingester_documents(second, ingested))
+    backfilled = backfill_documents(first, {})
+    backfilled.update(backfill_documents(second, backfilled))
+
+    for key in sorted(set(ingested) | set(backfilled)):
+        if ingested.get(key) != backfilled.get(key):
+            failures.append(f"bucket {key}: ingester wrote {ingested.get(key)}, backfill wrote {backfilled.get(key)}")
+
+    for failure in failures:
+        print(failure)
+    print(f"{len(ingested)} buckets compared, {len(failures)} differences")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,47 @@
+from zoneinfo import ZoneInfo
+
+import aggregation
+
+ENERGY_COLLECTION = "SolarEnergyV1"
+ENERGY_FIELDS = ['production_kwh', 'consumption_kwh', 'grid_import_kwh', 'grid_export_kwh']
+
+
+def empty_totals():
+    return {**dict.fromkeys(ENERGY_FIELDS, 0.0), 'battery_min': None, 'battery_max': None, 'covered_seconds': 0.0}
+
+
+def add_interval(totals, interval):
+    for field in ENERGY_FIELDS:
+        totals[field] += interval.get(field) or 0.0
+    totals['covered_seconds'] += interval.get('covered_seconds') or 0.0
+    for key, pick in (('battery_min', min), ('battery_max', max)):
+        value = interval.get(key)
+        if value is not None:
+            totals[key] = value if totals[key] is None else pick(totals[key], value)
+    return totals
+
+
+def daily_energy(intervals, timezone=aggregation.LOCAL_TIMEZONE):
+    days = {}
+    for interval in intervals:
+        day = interval['start'].astimezone(ZoneInfo(timezone)).date().isoformat()
+        add_interval(days.setdefault(day, empty_totals()), interval)
+
+    return [{
+        'date': day,
+        'consumption_positive': round(totals['consumption_kwh'], 2),
+        'grid_positive': round(totals['grid_import_kwh'], 2),
+        'grid_negative': -round(totals['grid_export_kwh'], 2),
+        'production_positive': round(totals['production_kwh'], 2),
+        'battery_min': totals['battery_min'],
+        'battery_max': totals['battery_max'],
+        'coverage': round(totals['covered_seconds'] / 86400, 3),
+    } for day, totals in sorted(days.items())]
+
+
+def read_daily_energy(db, start, end=None):
+    query = db.collection(ENERGY_COLLECTION).where("start", ">=", start)
+    if end is not None:
+        query = query.where("start", "<", end)
+    query = query.select(['start', 'covered_seconds', 'battery_min', 'battery_max', *ENERGY_FIELDS])
+    return daily_energy(snapshot.to_dict() for snapshot in query.stream())
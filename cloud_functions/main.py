@@ -1,22 +1,36 @@
-import csv
-import datetime
-import io
+import os
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
 import firebase_admin
 from firebase_admin import credentials
+from firebase_admin import db as realtime_db
 from firebase_admin import firestore
-from firebase_functions import https_fn
-from flask import Flask, Response, jsonify
+from firebase_functions import firestore_fn, https_fn, options, scheduler_fn
+from flask import Flask, Response, jsonify, request, stream_with_context
+import pandas as pd
+
+import aggregation
+import buckets
+import energy
+import retention
+import rollups
+
+DATABASE_URL = os.environ.get("FIREBASE_DATABASE_URL")
 
 cred = credentials.Certificate("auth.json")
-firebase_admin.initialize_app(cred)
+firebase_admin.initialize_app(cred, {'databaseURL': DATABASE_URL} if DATABASE_URL else None)
 
 db = firestore.client()
 
 app = Flask(__name__)
 
+MAX_ROLLUP_DAYS = 366
+RESOLUTIONS = {'raw': None, '1min': 60, '15min': 15 * 60, '1h': 60 * 60}
+STORAGE_LAYOUT = os.environ.get("SOLAR_STORAGE_LAYOUT", "documents")
+COMPACTION_TIMEOUT_SECONDS = 540
+COMPACTION_MARGIN_SECONDS = 60
+
 
 def to_zoned_time(timestamp, timezone):
     return timestamp.replace(tzinfo=ZoneInfo(timezone))
@@ -26,34 +40,69 @@ def format_datetime(dt, format_string, timezone):
     return dt.astimezone(ZoneInfo(timezone)).strftime(format_string)
 
 
+def parse_time_arg(name, default):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is None:
+        timestamp = to_zoned_time(timestamp, "Europe/Berlin")
+    return timestamp
+
+
+def parse_range_args():
+    now = datetime.now(ZoneInfo("UTC"))
+    start = parse_time_arg('start', now - timedelta(days=3))
+    end = parse_time_arg('end', None)
+    if end is not None and end <= start:
+        raise ValueError("end must be after start")
+
+    fields = request.args.get('fields')
+    if fields is None:
+        fields = aggregation.CSV_COLUMNS[1:]
+    else:
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = set(fields) - set(aggregation.CSV_COLUMNS[1:])
+        if unknown or not fields:
+            raise ValueError(f"fields must be a subset of {', '.join(aggregation.CSV_COLUMNS[1:])}")
+
+    resolution = request.args.get('resolution', 'raw')
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"resolution must be one of {', '.join(RESOLUTIONS)}")
+
+    return start, end, fields, RESOLUTIONS[resolution]
+
+
+def iter_pages(start, end=None, fields=None, bucket_seconds=None):
+    return retention.iter_planned_pages(db, STORAGE_LAYOUT, start, end, fields=fields,
+                                        resolution_seconds=bucket_seconds)
+
+
+def load_window(start, end=None):
+    pages = list(iter_pages(start, end))
+    return pd.concat(pages, ignore_index=True) if pages else aggregation.frame_from_documents([])
+
+
 @app.route('/solarcsv')
 def get_solar_data_three_days_csv():
     try:
-        all_entries = []
-        three_days_ago = datetime.now(ZoneInfo("UTC")) - timedelta(days=3)
-
-        query_snapshot = db.collection("SolarDataV1").where("timestamp", ">=", three_days_ago).get()
+        start, end, fields, bucket_seconds = parse_range_args()
+    except ValueError as error:
+        return str(error), 400
 
-        for doc in query_snapshot:
-            data = doc.to_dict()
-            timestamp = data['timestamp'].astimezone(ZoneInfo("Europe/Berlin"))
-            formatted_data = {
-                **data,
-                'timestamp': timestamp.strftime("%Y-%m-%dT%H:%M")
-            }
-
-            all_entries.append(formatted_data)
+    try:
+        pages = iter_pages(start, end, fields=fields, bucket_seconds=bucket_seconds)
 
-        if not all_entries:
+        first_page = next(pages, None)
+        if first_page is None:
             return "No data available", 404
 
-        output = io.StringIO()
-        writer = csv.DictWriter(output, fieldnames=all_entries[0].keys())
-        writer.writeheader()
-        writer.writerows(all_entries)
+        def stream_pages():
+            yield first_page
+            yield from pages
 
         return Response(
-            output.getvalue(),
+            stream_with_context(aggregation.iter_csv(stream_pages(), columns=['timestamp', *fields])),
             mimetype="text/csv",
             headers={"Content-disposition": "attachment; filename=solar_data.csv"}
         )
@@ -63,63 +112,61 @@ def get_solar_data_three_days_csv():
         return "We found an error fetching your request!", 500
 
 
+@app.route('/solar.parquet')
+def get_solar_data_parquet():
+    try:
+        start, end, fields, bucket_seconds = parse_range_args()
+    except ValueError as error:
+        return str(error), 400
+
+    try:
+        pages = iter_pages(start, end, fields=fields, bucket_seconds=bucket_seconds)
+
+        payload = aggregation.parquet_bytes(pages, columns=['timestamp', *fields])
+        if payload is None:
+            return "No data available", 404
+
+        return Response(
+            payload,
+            mimetype="application/vnd.apache.parquet",
+            headers={"Content-disposition": "attachment; filename=solar_data.parquet"}
+        )
+
+    except Exception as error:
+        print(f"Error fetching data: {error}")
+        return "We found an error fetching your request!", 500
+
+
+@app.route('/latest')
+def get_latest_sample():
+    try:
+        latest = retention.latest_raw_timestamp(db, STORAGE_LAYOUT)
+        return jsonify({'timestamp': None if latest is None else latest.isoformat()})
+
+    except Exception as error:
+        print(f"Error reading the latest sample: {error}")
+        return "We found an error reading the latest sample!", 500
+
+
 @app.route('/dailysums')
 def get_daily_sums_last_three_days():
     try:
-        three_days_ago = datetime.now(ZoneInfo("Europe/Berlin")) - timedelta(days=3)
-        three_days_ago = three_days_ago.replace(hour=0, minute=0, second=0, microsecond=0)
-
-        query_snapshot = db.collection("SolarDataV1").where("timestamp", ">=", three_days_ago).get()
-
-        daily_data = {}
-
-        for doc in query_snapshot:
-            data = doc.to_dict()
-            timestamp = data['timestamp'].astimezone(ZoneInfo("Europe/Berlin"))
-            day_key = timestamp.date().isoformat()
-            hour_key = timestamp.hour
-
-            if day_key not in daily_data:
-                daily_data[day_key] = {
-                    'consumption': {'pos': [0] * 24, 'pos_count': [0] * 24},
-                    'grid': {'pos': [0] * 24, 'neg': [0] * 24, 'pos_count': [0] * 24, 'neg_count': [0] * 24},
-                    'production': {'pos': [0] * 24, 'pos_count': [0] * 24}
-                }
-
-            for field in ['consumption', 'grid', 'production']:
-                if field in data:
-                    value = data[field]
-                    if field == 'grid':
-                        if value >= 0:
-                            daily_data[day_key][field]['pos'][hour_key] += value
-                            daily_data[day_key][field]['pos_count'][hour_key] += 1
-                        else:
-                            daily_data[day_key][field]['neg'][hour_key] += value
-                            daily_data[day_key][field]['neg_count'][hour_key] += 1
-                    elif value > 0:
-                        daily_data[day_key][field]['pos'][hour_key] += value
-                        daily_data[day_key][field]['pos_count'][hour_key] += 1
-
-        result = []
-        for day, data in daily_data.items():
-            day_sums = {'date': day}
-            for field in ['consumption', 'grid', 'production']:
-                pos_total = 0
-                for hour in range(24):
-                    if data[field]['pos_count'][hour] > 0:
-                        pos_total += data[field]['pos'][hour] / data[field]['pos_count'][hour]
-                day_sums[f'{field}_positive'] = round(pos_total, 2)
-
-                if field == 'grid':
-                    neg_total = 0
-                    for hour in range(24):
-                        if data[field]['neg_count'][hour] > 0:
-                            neg_total += data[field]['neg'][hour] / data[field]['neg_count'][hour]
-                    day_sums[f'{field}_negative'] = round(neg_total, 2)
-
-            result.append(day_sums)
-
-        return jsonify(result)
+        days = request.args.get('days', default=3, type=int)
+        if days < 0 or days > MAX_ROLLUP_DAYS:
+            return f"days must be between 0 and {MAX_ROLLUP_DAYS}", 400
+
+        source = request.args.get('source')
+        if source in ('raw', 'energy'):
+            start = datetime.now(ZoneInfo("Europe/Berlin")) - timedelta(days=days)
+            start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+            if source == 'energy':
+                return jsonify(energy.read_daily_energy(db, start))
+            raw_start = retention.raw_start(db)
+            if raw_start is not None and start < raw_start:
+                return f"source=raw only covers samples since {raw_start.isoformat()}, request fewer days", 400
+            return jsonify(aggregation.daily_sums(load_window(start)))
+
+        return jsonify(rollups.read_daily_sums(db, days))
 
     except Exception as error:
         print(f"Error calculating daily sums: {error}")
@@ -130,3 +177,31 @@ def get_daily_sums_last_three_days():
 def solar_data_function(request):
     with app.request_context(request.environ):
         return app.full_dispatch_request()
+
+
+@firestore_fn.on_document_created(document="SolarDataV1/{sample_id}")
+def update_solar_rollups(event):
+    if event.data is None:
+        return
+    rollups.apply_sample(db, event.data.to_dict(), event.id)
+
+
+@firestore_fn.on_document_written(document="SolarBucketsV1/{bucket_id}")
+def update_bucket_rollups(event):
+    after = event.data.after if event.data is not None else None
+    if after is None or not after.exists:
+        return
+    bucket = after.to_dict()
+    if bucket.get("writer") == buckets.BACKFILL_WRITER:
+        return
+    before = event.data.before.to_dict() if event.data.before is not None and event.data.before.exists else None
+    rollups.apply_samples(db, buckets.added_samples(before, bucket), event.id)
+
+
+@scheduler_fn.on_schedule(schedule="every day 03:00", timezone=scheduler_fn.Timezone("Europe/Berlin"),
+                          timeout_sec=COMPACTION_TIMEOUT_SECONDS, memory=options.MemoryOption.GB_1)
+def compact_solar_data(event):
+    reference = realtime_db.reference('SolarData') if DATABASE_URL else None
+    summary = retention.run(db, STORAGE_LAYOUT, reference,
+                            time_budget=COMPACTION_TIMEOUT_SECONDS - COMPACTION_MARGIN_SECONDS)
+    print(f"Compaction finished: {summary}")
@@ -0,0 +1,228 @@
+import os
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+
+import aggregation
+import buckets
+
+RAW_RETENTION_DAYS = int(os.environ.get("SOLAR_RAW_RETENTION_DAYS", 14))
+MINUTE_RETENTION_DAYS = int(os.environ.get("SOLAR_MINUTE_RETENTION_DAYS", 180))
+MINUTE_COLLECTION = "SolarMinutesV1"
+HOUR_COLLECTION = "SolarHoursV1"
+STATE_DOCUMENT = ("SolarCompactionV1", "state")
+COMPACTION_WRITER = "compaction"
+MAX_DAYS_PER_RUN = 31
+COMPACTION_SHARE = 0.6
+RECOMPACT_DAYS = 2
+DELETE_BATCH = 500
+REALTIME_DELETE_BATCH = 1000
+REALTIME_KEY_FORMAT = '%Y-%m-%d::%H:%M:%S'
+
+Tier = namedtuple("Tier", ["name", "seconds", "collection", "document_seconds", "retention_days"])
+RAW = Tier("raw", 0, None, None, RAW_RETENTION_DAYS)
+MINUTE = Tier("1min", 60, MINUTE_COLLECTION, 3600, MINUTE_RETENTION_DAYS)
+HOUR = Tier("1h", 3600, HOUR_COLLECTION, 86400, None)
+TIERS = [RAW, MINUTE, HOUR]
+
+RAW_SOURCES = {
+    "documents": (aggregation.RAW_COLLECTION, "timestamp"),
+    "buckets": (buckets.BUCKET_COLLECTION, "start"),
+}
+
+
+def day_floor(moment):
+    return moment.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def raw_pages(db, layout, start, end=None, fields=None):
+    if layout == "buckets":
+        return buckets.iter_bucket_pages(db, start, end, fields=fields)
+    return aggregation.iter_window_pages(db, start, end, fields=fields)
+
+
+def tier_pages(db, layout, tier, start, end=None, fields=None):
+    if tier is RAW:
+        return raw_pages(db, layout, start, end, fields)
+    return buckets.iter_bucket_pages(db, start, end, fields=fields, bucket_seconds=tier.document_seconds,
+                                     collection=tier.collection)
+
+
+def read_state(db):
+    snapshot = db.collection(STATE_DOCUMENT[0]).document(STATE_DOCUMENT[1]).get()
+    return snapshot.to_dict().get('compacted_until') if snapshot.exists else None
+
+
+def write_state(db, compacted_until):
+    db.collection(STATE_DOCUMENT[0]).document(STATE_DOCUMENT[1]).set({'compacted_until': compacted_until},
+                                                                      merge=True)
+
+
+def expired(deadline):
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def retention_cutoff(tier, today, compacted_until):
+    if tier.retention_days is None or compacted_until is None:
+        return None
+    return min(today - timedelta(days=tier.retention_days), compacted_until)
+
+
+def tier_windows(compacted_until, today):
+    windows = [(RAW, retention_cutoff(RAW, today, compacted_until), None)]
+    if compacted_until is not None:
+        windows += [(tier, retention_cutoff(tier, today, compacted_until), compacted_until) for tier in TIERS[1:]]
+    return windows
+
+
+def raw_start(db, now=None):
+    return retention_cutoff(RAW, day_floor(now or datetime.now(timezone.utc)), read_state(db))
+
+
+def plan(start, end, resolution_seconds, compacted_until, now=None):
+    now = now or datetime.now(timezone.utc)
+    windows = tier_windows(compacted_until, day_floor(now))
+    boundaries = sorted({bound for _, low, high in windows for bound in (low, high) if bound is not None})
+
+    segments = []
+    cursor = start
+    while cursor < end:
+        available = [window for window in windows
+                     if (window[1] is None or window[1] <= cursor) and (window[2] is None or cursor < window[2])]
+        if not available:
+            break
+        suitable = [window for window in available if window[0].seconds <= (resolution_seconds or 0)]
+        tier = (max(suitable, key=lambda window: window[0].seconds) if suitable
+                else min(available, key=lambda window: window[0].seconds))[0]
+        segment_end = min([end, *[bound for bound in boundaries if bound > cursor]])
+        if segments and segments[-1][0] is tier:
+            segments[-1] = (tier, segments[-1][1], segment_end)
+        else:
+            segments.append((tier, cursor, segment_end))
+        cursor = segment_end
+    return segments
+
+
+def iter_planned_pages(db, layout, start, end=None, fields=None, resolution_seconds=None, now=None):
+    now = now or datetime.now(timezone.utc)
+    for tier, segment_start, segment_end in plan(start, end or now, resolution_seconds, read_state(db), now):
+        open_ended = end is None and segment_end >= now
+        pages = tier_pages(db, layout, tier, segment_start, None if open_ended else segment_end, fields)
+        if resolution_seconds and resolution_seconds > tier.seconds:
+            pages = aggregation.iter_resampled(pages, resolution_seconds)
+        yield from pages
+
+
+def first_raw_day(db, layout):
+    collection, field = RAW_SOURCES[layout]
+    snapshots = list(db.collection(collection).order_by(field).limit(1).stream())
+    return day_floor(snapshots[0].to_dict()[field]) if snapshots else None
+
+
+def latest_raw_timestamp(db, layout):
+    collection, field = RAW_SOURCES[layout]
+    snapshots = list(db.collection(collection).order_by(field, direction="DESCENDING").limit(1).stream())
+    if not snapshots:
+        return None
+    latest = snapshots[0].to_dict()
+    if layout == "buckets":
+        return latest[field] + timedelta(milliseconds=max(latest.get('offset_ms') or [0]))
+    return latest[field]
+
+
+def compact_day(db, layout, day_start):
+    pages = list(raw_pages(db, layout, day_start, day_start + timedelta(days=1)))
+    if not pages:
+        return 0
+    frame = pd.concat(pages, ignore_index=True)
+    for tier in TIERS[1:]:
+        grouped = buckets.frame_rows(aggregation.resample(frame, tier.seconds), tier.document_seconds)
+        buckets.write_buckets(db, grouped, tier.document_seconds, COMPACTION_WRITER, tier.collection)
+    return len(frame)
+
+
+def delete_before(db, collection, field, cutoff, deadline=None):
+    deleted = 0
+    while not expired(deadline):
+        query = db.collection(collection).where(field, "<", cutoff).select([]).limit(DELETE_BATCH)
+        snapshots = list(query.stream())
+        if not snapshots:
+            return deleted
+        batch = db.batch()
+        for snapshot in snapshots:
+            batch.delete(snapshot.reference)
+        batch.commit()
+        deleted += len(snapshots)
+    return deleted
+
+
+def delete_realtime_before(reference, cutoff, deadline=None):
+    cutoff_key = cutoff.astimezone(ZoneInfo(aggregation.LOCAL_TIMEZONE)).strftime(REALTIME_KEY_FORMAT)
+    deleted = 0
+    while not expired(deadline):
+        samples = reference.order_by_key().end_at(cutoff_key).limit_to_first(REALTIME_DELETE_BATCH).get() or {}
+        keys = [key for key in samples if key < cutoff_key]
+        if not keys:
+            return deleted
+        reference.update({key: None for key in keys})
+        deleted += len(keys)
+    return deleted
+
+
+def run(db, layout="documents", realtime_reference=None, now=None, max_days=MAX_DAYS_PER_RUN, time_budget=None):
+    started = time.monotonic()
+    deadline = None if time_budget is None else started + time_budget
+    compaction_deadline = None if time_budget is None else started + time_budget * COMPACTION_SHARE
+    today = day_floor(now or datetime.now(timezone.utc))
+    compacted_until = read_state(db)
+    day = first_raw_day(db, layout) if compacted_until is None else compacted_until - timedelta(days=RECOMPACT_DAYS)
+
+    summary = {"compacted_days": 0, "compacted_samples": 0}
+    while (day is not None and day < today and summary["compacted_days"] < max_days
+           and not expired(compaction_deadline)):
+        summary["compacted_samples"] += compact_day(db, layout, day)
+        summary["compacted_days"] += 1
+        day += timedelta(days=1)
+        if compacted_until is None or day > compacted_until:
+            compacted_until = day
+            write_state(db, compacted_until)
+
+    if compacted_until is None:
+        return summary
+    raw_collection, raw_field = RAW_SOURCES[layout]
+    summary["deleted_raw"] = delete_before(db, raw_collection, raw_field,
+                                           retention_cutoff(RAW, today, compacted_until), deadline)
+    summary["deleted_minutes"] = delete_before(db, MINUTE_COLLECTION, "start",
+                                               retention_cutoff(MINUTE, today, compacted_until), deadline)
+    if realtime_reference is not None:
+        summary["deleted_realtime"] = delete_realtime_before(realtime_reference,
+                                                             retention_cutoff(RAW, today, compacted_until), deadline)
+    summary["pending_days"] = max((today - day).days, 0)
+    summary["out_of_time"] = expired(deadline)
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import firebase_admin
+    from firebase_admin import credentials, db as realtime_db, firestore
+
+    parser = argparse.ArgumentParser(description="Compact raw solar samples into 1-minute and hourly tiers and "
+                                                 "delete data past its retention.")
+    parser.add_argument("--layout", choices=list(RAW_SOURCES), default=os.environ.get("SOLAR_STORAGE_LAYOUT",
+                                                                                       "documents"))
+    parser.add_argument("--database-url", default=os.environ.get("FIREBASE_DATABASE_URL"),
+                        help="Also trim the Realtime Database SolarData node")
+    parser.add_argument("--max-days", type=int, default=MAX_DAYS_PER_RUN)
+    parser.add_argument("--time-budget", type=float, help="Seconds after which the run stops and leaves the rest "
+                                                          "to the next run")
+    args = parser.parse_args()
+
+    options = {'databaseURL': args.database_url} if args.database_url else None
+    firebase_admin.initialize_app(credentials.Certificate("auth.json"), options)
+    reference = realtime_db.reference('SolarData') if args.database_url else None
+    print(run(firestore.client(), args.layout, reference, max_days=args.max_days, time_budget=args.time_budget))
@@ -0,0 +1,203 @@
+import zlib
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists
+
+ROLLUP_COLLECTION = "SolarRollupsV1"
+RAW_COLLECTION = "SolarDataV1"
+PROCESSED_COLLECTION = "SolarRollupEventsV1"
+PROCESSED_TTL_DAYS = 7
+ROLLUP_SHARDS = 16
+LOCAL_TIMEZONE = "Europe/Berlin"
+
+FIELDS = ['consumption', 'grid', 'production']
+
+
+def sample_counters(data):
+    counters = {}
+    for field in FIELDS:
+        value = data.get(field)
+        if value is None:
+            continue
+        if field == 'grid':
+            sign = 'pos' if value >= 0 else 'neg'
+            counters[f'grid_{sign}_sum'] = value
+            counters[f'grid_{sign}_count'] = 1
+        elif value > 0:
+            counters[f'{field}_pos_sum'] = value
+            counters[f'{field}_pos_count'] = 1
+    return counters
+
+
+def rollup_key(timestamp):
+    local_time = timestamp.astimezone(ZoneInfo(LOCAL_TIMEZONE))
+    return local_time.date().isoformat(), local_time.hour
+
+
+def merge_counters(target, counters):
+    for key, value in counters.items():
+        target[key] = target.get(key, 0) + value
+    return target
+
+
+def rollup_update(day_key, hour_key, counters):
+    return {
+        "date": day_key,
+        "hours": {str(hour_key): {key: firestore.Increment(value) for key, value in counters.items()}},
+        "totals": {key: firestore.Increment(value) for key, value in counters.items()},
+    }
+
+
+def rollup_shard(db, day_key, event_id):
+    shard = zlib.crc32(event_id.encode()) % ROLLUP_SHARDS
+    return db.collection(ROLLUP_COLLECTION).document(f"{day_key}_{shard}")
+
+
+def apply_once(db, event_id, updates):
+    batch = db.batch()
+    batch.create(db.collection(PROCESSED_COLLECTION).document(event_id),
+                 {"expires_at": datetime.now(timezone.utc) + timedelta(days=PROCESSED_TTL_DAYS)})
+    for day_key, update in updates.items():
+        batch.set(rollup_shard(db, day_key, event_id), update, merge=True)
+    try:
+        batch.commit()
+    except AlreadyExists:
+        return False
+    return True
+
+
+def apply_sample(db, data, event_id):
+    counters = sample_counters(data)
+    if not counters:
+        return False
+    day_key, hour_key = rollup_key(data['timestamp'])
+    return apply_once(db, event_id, {day_key: rollup_update(day_key, hour_key, counters)})
+
+
+def apply_samples(db, samples, event_id):
+    updates = {}
+    for data in samples:
+        counters = sample_counters(data)
+        if counters:
+            merge_counters(updates.setdefault(rollup_key(data['timestamp']), {}), counters)
+
+    days = {}
+    for (day_key, hour_key), counters in updates.items():
+        update = days.setdefault(day_key, {"date": day_key, "hours": {}, "totals": {}})
+        update["hours"][str(hour_key)] = {key: firestore.Increment(value) for key, value in counters.items()}
+        merge_counters(update["totals"], counters)
+
+    for update in days.values():
+        update["totals"] = {key: firestore.Increment(value) for key, value in update["totals"].items()}
+    if days and not apply_once(db, event_id, days):
+        return 0
+    return len(samples)
+
+
+def window_days(days, now=None):
+    now = now or datetime.now(ZoneInfo(LOCAL_TIMEZONE))
+    today = now.astimezone(ZoneInfo(LOCAL_TIMEZONE)).date()
+    return [(today - timedelta(days=offset)).isoformat() for offset in range(days, -1, -1)]
+
+
+def daily_sums_from_rollup(rollup):
+    hours = rollup.get('hours', {})
+    day_sums = {'date': rollup['date']}
+    for field in FIELDS:
+        signs = ['pos', 'neg'] if field == 'grid' else ['pos']
+        for sign in signs:
+            total = 0
+            for counters in hours.values():
+                count = counters.get(f'{field}_{sign}_count', 0)
+                if count > 0:
+                    total += counters.get(f'{field}_{sign}_sum', 0) / count
+            day_sums[f'{field}_{"positive" if sign == "pos" else "negative"}'] = round(total, 2)
+    return day_sums
+
+
+def merge_shards(snapshots):
+    rollups = {}
+    for snapshot in snapshots:
+        shard = snapshot.to_dict()
+        rollup = rollups.setdefault(shard['date'], {"date": shard['date'], "hours": {}})
+        for hour_key, counters in shard.get('hours', {}).items():
+            merge_counters(rollup["hours"].setdefault(hour_key, {}), counters)
+    return rollups
+
+
+def rollup_query(db, first_day, last_day):
+    return db.collection(ROLLUP_COLLECTION).where("date", ">=", first_day).where("date", "<=", last_day)
+
+
+def read_daily_sums(db, days):
+    day_keys = window_days(days)
+    rollups = merge_shards(rollup_query(db, day_keys[0], day_keys[-1]).stream())
+    return [daily_sums_from_rollup(rollups[day_key]) for day_key in day_keys if day_key in rollups]
+
+
+def backfill_rollups(db, start, end=None):
+    query = db.collection(RAW_COLLECTION).where("timestamp", ">=", start)
+    if end is not None:
+        query = query.where("timestamp", "<", end)
+
+    rollups = {}
+    for doc in query.stream():
+        data = doc.to_dict()
+        counters = sample_counters(data)
+        if not counters:
+            continue
+        day_key, hour_key = rollup_key(data['timestamp'])
+        rollup = rollups.setdefault(day_key, {"date": day_key, "hours": {}, "totals": {}})
+        merge_counters(rollup["hours"].setdefault(str(hour_key), {}), counters)
+        merge_counters(rollup["totals"], counters)
+
+    writes = {f"{day_key}_0": rollup for day_key, rollup in rollups.items()}
+    stale = []
+    if rollups:
+        stale = [snapshot.reference for snapshot in rollup_query(db, min(rollups), max(rollups)).select([]).stream()
+                 if snapshot.id not in writes]
+
+    batch = db.batch()
+    pending = 0
+    for ref, rollup in [*((ref, None) for ref in stale),
+                        *((db.collection(ROLLUP_COLLECTION).document(key), rollup) for key, rollup in writes.items())]:
+        if rollup is None:
+            batch.delete(ref)
+        else:
+            batch.set(ref, rollup)
+        pending += 1
+        if pending == 500:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+
+    return sorted(rollups)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import firebase_admin
+    from firebase_admin import credentials
+
+    parser = argparse.ArgumentParser(description="Rebuild SolarRollupsV1 from raw SolarDataV1 samples. The rebuild "
+                                                 "overwrites all shards of a day, so increments applied by the "
+                                                 "update_solar_rollups trigger while it runs are lost.")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--trigger-stopped", action="store_true",
+                        help="Confirm that the rollup triggers are disabled for the duration of the rebuild")
+    args = parser.parse_args()
+    if not args.trigger_stopped:
+        parser.error("stop the update_solar_rollups and update_bucket_rollups triggers first, then pass "
+                     "--trigger-stopped")
+
+    firebase_admin.initialize_app(credentials.Certificate("auth.json"))
+    start_day = datetime.now(ZoneInfo(LOCAL_TIMEZONE)) - timedelta(days=args.days)
+    start_day = start_day.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    rebuilt = backfill_rollups(firestore.client(), start_day)
+    print(f"Rebuilt {len(rebuilt)} daily rollups")
@@ -0,0 +1,185 @@
+import json
+import sqlite3
+from datetime import datetime, timezone
+
+ENERGY_COLLECTION = "SolarEnergyV1"
+INTERVAL_SECONDS = 900
+MAX_GAP_SECONDS = 120
+POWER_FIELDS = ("production", "grid", "consumption")
+ENERGY_FIELDS = ("production", "consumption", "grid_import", "grid_export")
+
+
+def trapezoid(power_start, power_end, seconds):
+    return (power_start + power_end) / 2 * seconds / 3600
+
+
+def split_trapezoid(power_start, power_end, seconds):
+    if power_start >= 0 and power_end >= 0:
+        return trapezoid(power_start, power_end, seconds), 0.0
+    if power_start <= 0 and power_end <= 0:
+        return 0.0, -trapezoid(power_start, power_end, seconds)
+    crossing = seconds * power_start / (power_start - power_end)
+    before = trapezoid(power_start, 0.0, crossing)
+    after = trapezoid(0.0, power_end, seconds - crossing)
+    return (before, -after) if power_start > 0 else (after, -before)
+
+
+def segment_energy(start, end, seconds):
+    grid_import, grid_export = split_trapezoid(start["grid"], end["grid"], seconds)
+    return {
+        "production": split_trapezoid(start["production"], end["production"], seconds)[0],
+        "consumption": split_trapezoid(start["consumption"], end["consumption"], seconds)[0],
+        "grid_import": grid_import,
+        "grid_export": grid_export,
+    }
+
+
+def interpolate(start, end, fraction):
+    return {field: start[field] + (end[field] - start[field]) * fraction for field in POWER_FIELDS}
+
+
+def interval_id(start):
+    return start.strftime("%Y-%m-%dT%H:%MZ")
+
+
+def empty_state():
+    return {
+        "interval_start": None,
+        "last_time": None,
+        "last_powers": None,
+        "energy": dict.fromkeys(ENERGY_FIELDS, 0.0),
+        "counters": dict.fromkeys(ENERGY_FIELDS, 0.0),
+        "battery_min": None,
+        "battery_max": None,
+        "samples": 0,
+        "gaps": 0,
+        "covered_seconds": 0.0,
+    }
+
+
+class EnergyAccumulator:
+    def __init__(self, path="sample_buffer.db", interval_seconds=INTERVAL_SECONDS, max_gap_seconds=MAX_GAP_SECONDS):
+        self.interval_seconds = interval_seconds
+        self.max_gap_seconds = max_gap_seconds
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS energy_state (id INTEGER PRIMARY KEY, payload TEXT NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS energy_deltas ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "interval_id TEXT NOT NULL, "
+            "payload TEXT NOT NULL, "
+            "done INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS energy_deltas_pending ON energy_deltas (done, id)")
+
+        row = self.connection.execute("SELECT payload FROM energy_state WHERE id = 1").fetchone()
+        self.state = json.loads(row[0]) if row else empty_state()
+
+    def interval_floor(self, time):
+        return int(time) // self.interval_seconds * self.interval_seconds
+
+    def integrate(self, start, end, seconds):
+        for field, energy in segment_energy(start, end, seconds).items():
+            self.state["energy"][field] += energy
+            self.state["counters"][field] += energy
+        self.state["covered_seconds"] += seconds
+
+    def close_interval(self):
+        state = self.state
+        start = datetime.fromtimestamp(state["interval_start"], timezone.utc)
+        delta = {
+            "interval_id": interval_id(start),
+            "start": start.isoformat(),
+            "seconds": self.interval_seconds,
+            **{f"{field}_kwh": round(state["energy"][field], 6) for field in ENERGY_FIELDS},
+            "counters": {f"{field}_kwh": round(state["counters"][field], 6) for field in ENERGY_FIELDS},
+            "battery_min": state["battery_min"],
+            "battery_max": state["battery_max"],
+            "samples": state["samples"],
+            "gaps": state["gaps"],
+            "covered_seconds": round(state["covered_seconds"], 3),
+        }
+        state.update(energy=dict.fromkeys(ENERGY_FIELDS, 0.0), battery_min=None, battery_max=None, samples=0,
+                     gaps=0, covered_seconds=0.0)
+        return delta
+
+    def add(self, timestamp, powers, battery_status=None):
+        state = self.state
+        time = timestamp.timestamp()
+        if state["last_time"] is not None and time <= state["last_time"]:
+            return []
+        if None in (powers.get(field) for field in POWER_FIELDS):
+            return []
+
+        previous, previous_time = state["last_powers"], state["last_time"]
+        if previous is not None and time - previous_time > self.max_gap_seconds:
+            state["gaps"] += 1
+            previous = None
+
+        closed = []
+        if state["interval_start"] is None:
+            state["interval_start"] = self.interval_floor(time)
+        while time >= state["interval_start"] + self.interval_seconds:
+            boundary = state["interval_start"] + self.interval_seconds
+            if previous is None:
+                if state["samples"] or state["covered_seconds"]:
+                    closed.append(self.close_interval())
+                state["interval_start"] = self.interval_floor(time)
+                break
+            point = interpolate(previous, powers, (boundary - previous_time) / (time - previous_time))
+            self.integrate(previous, point, boundary - previous_time)
+            previous, previous_time = point, boundary
+            closed.append(self.close_interval())
+            state["interval_start"] = boundary
+
+        if previous is not None:
+            self.integrate(previous, powers, time - previous_time)
+        if battery_status is not None:
+            for key, pick in (("battery_min", min), ("battery_max", max)):
+                state[key] = battery_status if state[key] is None else pick(state[key], battery_status)
+        state["samples"] += 1
+        state["last_time"] = time
+        state["last_powers"] = {field: powers[field] for field in POWER_FIELDS}
+
+        self.checkpoint(closed)
+        return closed
+
+    def checkpoint(self, closed=()):
+        self.connection.execute("BEGIN")
+        self.connection.executemany(
+            "INSERT INTO energy_deltas (interval_id, payload) VALUES (?, ?)",
+            [(delta["interval_id"], json.dumps(delta)) for delta in closed],
+        )
+        self.connection.execute(
+            "INSERT OR REPLACE INTO energy_state (id, payload) VALUES (1, ?)", (json.dumps(self.state),)
+        )
+        self.connection.execute("COMMIT")
+
+    def pending(self, limit):
+        rows = self.connection.execute(
+            "SELECT id, payload FROM energy_deltas WHERE done = 0 ORDER BY id LIMIT ?", (limit,)
+        ).fetchall()
+        deltas = []
+        for row_id, payload in rows:
+            delta = json.loads(payload)
+            delta["start"] = datetime.fromisoformat(delta["start"])
+            deltas.append((row_id, delta))
+        return deltas
+
+    def mark_done(self, row_ids):
+        self.connection.execute("BEGIN")
+        self.connection.executemany("UPDATE energy_deltas SET done = 1 WHERE id = ?", [(row_id,) for row_id in row_ids])
+        self.connection.execute("COMMIT")
+
+    def backlog(self):
+        return self.connection.execute("SELECT COUNT(*) FROM energy_deltas WHERE done = 0").fetchone()[0]
+
+    def prune(self):
+        self.connection.execute("DELETE FROM energy_deltas WHERE done = 1")
+
+    def close(self):
+        self.connection.close()
@@ -1,12 +1,16 @@
-import urllib3
+import argparse
+import time
+
 import firebase_admin
 from firebase_admin import credentials, firestore, db as realtime_db
-import requests
 from datetime import datetime
 import myconfig
 import pytz
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from energy_accumulator import ENERGY_COLLECTION, EnergyAccumulator
+from envoy_client import DEFAULT_ENVOY_URL, EnvoyClient
+import sample_buckets
+from sample_buffer import SampleBuffer
 
 cred = credentials.Certificate('auth.json')
 firebase_admin.initialize_app(cred, {
@@ -15,32 +19,10 @@ firebase_admin.initialize_app(cred, {
 
 firestore_db = firestore.client()
 
+envoy = EnvoyClient(myconfig.SOLAR_API_KEY, getattr(myconfig, "envoy_url", DEFAULT_ENVOY_URL))
 
-def fetch_data(url, headers):
-    response = requests.get(url, headers=headers, verify=False)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Failed to fetch data from API. Status code: {response.status_code}")
-        return None
-
-
-def fetch_solar_data():
-    url = "https://192.168.178.170/ivp/meters/reports"
-    headers = {
-        'Authorization': myconfig.SOLAR_API_KEY,
-        'Accept': 'application/json'
-    }
-    return fetch_data(url, headers)
-
-
-def fetch_inventory_data():
-    url = "https://192.168.178.170/ivp/ensemble/inventory"
-    headers = {
-        'Authorization': myconfig.SOLAR_API_KEY,
-        'Accept': 'application/json'
-    }
-    return fetch_data(url, headers)
+FIRESTORE_BATCH_LIMIT = 500
+REALTIME_UPDATE_LIMIT = 1000
 
 
 def extract_relevant_data(data):
@@ -71,7 +53,12 @@ def extract_relevant_data(data):
         "timestamp": timestamp,
         "production_power": round(production_power/1000, 1),
         "net_consumption_power": round(net_consumption_power/1000, 1),
-        "total_consumption_power": round(total_consumption_power/1000, 1)
+        "total_consumption_power": round(total_consumption_power/1000, 1),
+        "powers": {
+            "production": production_power/1000,
+            "grid": net_consumption_power/1000,
+            "consumption": total_consumption_power/1000
+        }
     }
 
 
@@ -91,48 +78,185 @@ def extract_inventory_data(data):
     return percent_full
 
 
-def store_data_in_firestore(data, inventory_data):
-    if data:
-        doc_ref = firestore_db.collection('SolarDataV1').document(data["document_id"])
-        doc_ref.set({
-            "timestamp": data["timestamp"],
-            "production": data["production_power"],
-            "grid": data["net_consumption_power"],
-            "consumption": data["total_consumption_power"],
-            "battery_status": inventory_data
-        })
-        print("Data stored successfully in Firestore")
-
-        with open("data_log.txt", "a") as log_file:
-            log_file.write(f"{data['timestamp']}: Data stored successfully in Firestore\n")
-    else:
-        print("No data to store in Firestore")
+def log(message):
+    print(message)
+    with open("data_log.txt", "a") as log_file:
+        log_file.write(f"{datetime.now().isoformat()}: {message}\n")
 
 
-def store_data_in_realtime_database(data, inventory_data):
+def sample_record(data, inventory_data):
+    return {
+        "timestamp": data["timestamp"],
+        "production": data["production_power"],
+        "grid": data["net_consumption_power"],
+        "consumption": data["total_consumption_power"],
+        "battery_status": inventory_data
+    }
+
+
+def buffer_sample(buffer, data, inventory_data):
     if data:
-        ref = realtime_db.reference('SolarData')
-        ref.child(data["document_id"]).set({
-            "timestamp": data["timestamp"].isoformat(),
-            "production": data["production_power"],
-            "grid": data["net_consumption_power"],
-            "consumption": data["total_consumption_power"],
-            "battery_status": inventory_data
-        })
-        print("Data stored successfully in Realtime Database")
-
-        with open("data_log.txt", "a") as log_file:
-            log_file.write(f"{data['timestamp']}: Data stored successfully in Realtime Database\n")
+        buffer.append({"document_id": data["document_id"], **sample_record(data, inventory_data)})
     else:
-        print("No data to store in Realtime Database")
+        print("No data to buffer")
 
 
-if __name__ == "__main__":
-    raw_solar_data = fetch_solar_data()
-    relevant_solar_data = extract_relevant_data(raw_solar_data)
+def flush_to_firestore(buffer):
+    flushed = 0
+    while True:
+        pending = buffer.pending("firestore", FIRESTORE_BATCH_LIMIT)
+        if not pending:
+            return flushed
+
+        batch = firestore_db.batch()
+        for _, sample in pending:
+            record = {key: value for key, value in sample.items() if key != "document_id"}
+            batch.set(firestore_db.collection('SolarDataV1').document(sample["document_id"]), record)
+        batch.commit()
+
+        buffer.mark_done("firestore", [row_id for row_id, _ in pending])
+        flushed += len(pending)
+
+
+def flush_buckets_to_firestore(buffer, bucket_seconds=sample_buckets.BUCKET_SECONDS):
+    collection = firestore_db.collection(sample_buckets.BUCKET_COLLECTION)
+    flushed = 0
+    while True:
+        pending = buffer.pending("firestore", FIRESTORE_BATCH_LIMIT)
+        if not pending:
+            return flushed
+
+        grouped = sample_buckets.group_by_bucket([sample for _, sample in pending], bucket_seconds)
+        refs = [collection.document(bucket_id) for bucket_id in grouped]
+        existing = {snapshot.id: snapshot.to_dict() for snapshot in firestore_db.get_all(refs) if snapshot.exists}
+
+        batch = firestore_db.batch()
+        for ref in refs:
+            start, samples = grouped[ref.id]
+            batch.set(ref, sample_buckets.merge_bucket(existing.get(ref.id), start, samples, bucket_seconds))
+        batch.commit()
 
-    raw_inventory_data = fetch_inventory_data()
-    relevant_inventory_data = extract_inventory_data(raw_inventory_data)
+        buffer.mark_done("firestore", [row_id for row_id, _ in pending])
+        flushed += len(pending)
+
+
+def flush_energy_to_firestore(energy):
+    collection = firestore_db.collection(ENERGY_COLLECTION)
+    flushed = 0
+    while True:
+        pending = energy.pending(FIRESTORE_BATCH_LIMIT)
+        if not pending:
+            return flushed
+
+        batch = firestore_db.batch()
+        for _, delta in pending:
+            batch.set(collection.document(delta["interval_id"]),
+                      {key: value for key, value in delta.items() if key != "interval_id"})
+        batch.commit()
+
+        energy.mark_done([row_id for row_id, _ in pending])
+        flushed += len(pending)
+
+
+def flush_to_realtime_database(buffer):
+    flushed = 0
+    while True:
+        pending = buffer.pending("realtime", REALTIME_UPDATE_LIMIT)
+        if not pending:
+            return flushed
+
+        updates = {}
+        for _, sample in pending:
+            updates[sample["document_id"]] = {
+                **{key: value for key, value in sample.items() if key != "document_id"},
+                "timestamp": sample["timestamp"].isoformat()
+            }
+        realtime_db.reference('SolarData').update(updates)
+
+        buffer.mark_done("realtime", [row_id for row_id, _ in pending])
+        flushed += len(pending)
+
+
+def flush_buffer(buffer, layout="documents", energy=None):
+    flush_firestore = flush_buckets_to_firestore if layout == "buckets" else flush_to_firestore
+    targets = [("samples", "Firestore", flush_firestore, buffer),
+               ("samples", "Realtime Database", flush_to_realtime_database, buffer)]
+    if energy is not None:
+        targets.append(("energy intervals", "Firestore", flush_energy_to_firestore, energy))
+    for unit, target, flush, source in targets:
+        try:
+            flushed = flush(source)
+            if flushed:
+                log(f"{flushed} {unit} stored successfully in {target}")
+        except Exception as error:
+            log(f"Failed to flush {unit} to {target}, keeping backlog for retry: {error}")
+    buffer.prune()
+    if energy is not None:
+        energy.prune()
+
+
+def accumulate_energy(energy, data, inventory_data):
+    if energy is not None and data:
+        energy.add(data["timestamp"], data["powers"], inventory_data)
+
+
+def collect_sample(buffer, energy=None):
+    try:
+        raw_solar_data, raw_inventory_data = envoy.fetch_all()
+        relevant_solar_data = extract_relevant_data(raw_solar_data)
+        relevant_inventory_data = extract_inventory_data(raw_inventory_data)
+        buffer_sample(buffer, relevant_solar_data, relevant_inventory_data)
+        accumulate_energy(energy, relevant_solar_data, relevant_inventory_data)
+    except Exception as error:
+        print(f"Failed to collect sample: {error}")
+
+
+def run_daemon(sample_interval, flush_interval, buffer_path, layout="documents", energy_interval=0,
+               energy_max_gap=None):
+    buffer = SampleBuffer(buffer_path)
+    energy = None
+    if energy_interval:
+        energy = EnergyAccumulator(buffer_path, energy_interval, energy_max_gap or max(60.0, 6 * sample_interval))
+    log(f"Ingestion daemon started, backlog: {buffer.backlog('firestore')} samples for Firestore, "
+        f"{buffer.backlog('realtime')} samples for Realtime Database, Firestore layout: {layout}, "
+        f"energy intervals: {energy.backlog() if energy else 'disabled'}")
+    flush_buffer(buffer, layout, energy)
+
+    next_sample = time.monotonic()
+    next_flush = next_sample + flush_interval
+    try:
+        while True:
+            collect_sample(buffer, energy)
+
+            now = time.monotonic()
+            if now >= next_flush:
+                flush_buffer(buffer, layout, energy)
+                next_flush = now + flush_interval
+
+            next_sample += sample_interval
+            time.sleep(max(0.0, next_sample - time.monotonic()))
+    except KeyboardInterrupt:
+        flush_buffer(buffer, layout, energy)
+    finally:
+        buffer.close()
+        if energy is not None:
+            energy.close()
+        envoy.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Buffer Envoy samples locally and flush them to Firebase in batches.")
+    parser.add_argument("--sample-interval", type=float, default=getattr(myconfig, "sample_interval", 10.0))
+    parser.add_argument("--flush-interval", type=float, default=getattr(myconfig, "flush_interval", 60.0))
+    parser.add_argument("--buffer-path", default=getattr(myconfig, "buffer_path", "sample_buffer.db"))
+    parser.add_argument("--layout", choices=["documents", "buckets"],
+                        default=getattr(myconfig, "firestore_layout", "documents"),
+                        help="One Firestore document per sample or hourly bucket documents with packed arrays")
+    parser.add_argument("--energy-interval", type=int, default=getattr(myconfig, "energy_interval", 900),
+                        help="Seconds per published energy delta, 0 disables edge energy integration")
+    parser.add_argument("--energy-max-gap", type=float, default=getattr(myconfig, "energy_max_gap", None),
+                        help="Longest sample gap in seconds that is still integrated")
+    args = parser.parse_args()
 
-    store_data_in_firestore(relevant_solar_data, relevant_inventory_data)
-    store_data_in_realtime_database(relevant_solar_data, relevant_inventory_data)
+    run_daemon(args.sample_interval, args.flush_interval, args.buffer_path, args.layout, args.energy_interval,
+               args.energy_max_gap)
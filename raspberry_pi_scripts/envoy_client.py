@@ -0,0 +1,66 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENVOY_URL = "https://192.168.178.170"
+METERS_PATH = "/ivp/meters/reports"
+INVENTORY_PATH = "/ivp/ensemble/inventory"
+
+
+def create_session(retries=2, backoff_factor=0.2, pool_size=4):
+    session = requests.Session()
+    retry = Retry(total=retries, connect=retries, read=retries, backoff_factor=backoff_factor,
+                  status_forcelist=(429, 500, 502, 503, 504), allowed_methods=("GET",))
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.verify = False
+    return session
+
+
+class EnvoyClient:
+    def __init__(self, api_key, base_url=DEFAULT_ENVOY_URL, session=None, timeout=(2.0, 5.0)):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = session or create_session()
+        self.session.headers.update({
+            'Authorization': api_key,
+            'Accept': 'application/json'
+        })
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="envoy")
+
+    def fetch_data(self, path):
+        try:
+            response = self.session.get(self.base_url + path, timeout=self.timeout)
+        except requests.RequestException as error:
+            logger.error(f"Failed to fetch data from API {path}: {error}")
+            return None
+
+        if response.status_code == 200:
+            return response.json()
+        else:
+            logger.error(f"Failed to fetch data from API {path}. Status code: {response.status_code}")
+            return None
+
+    def fetch_solar_data(self):
+        return self.fetch_data(METERS_PATH)
+
+    def fetch_inventory_data(self):
+        return self.fetch_data(INVENTORY_PATH)
+
+    def fetch_all(self):
+        solar_future = self.executor.submit(self.fetch_solar_data)
+        inventory_data = self.fetch_inventory_data()
+        return solar_future.result(), inventory_data
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
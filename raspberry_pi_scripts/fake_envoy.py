@@ -0,0 +1,49 @@
+import argparse
+import math
+import random
+import time
+
+from flask import Flask, jsonify
+
+app = Flask(__name__)
+app.config["LATENCY"] = 0.0
+
+
+def simulated_powers():
+    hour = time.localtime().tm_hour + time.localtime().tm_min / 60
+    production = max(0.0, math.sin((hour - 6) / 14 * math.pi)) * 8000 * random.uniform(0.6, 1.0)
+    consumption = random.uniform(300, 2500)
+    return production, consumption - production, consumption
+
+
+@app.before_request
+def simulate_latency():
+    if app.config["LATENCY"]:
+        time.sleep(app.config["LATENCY"])
+
+
+@app.route('/ivp/meters/reports')
+def meters_reports():
+    production, net_consumption, total_consumption = simulated_powers()
+    return jsonify([
+        {"reportType": "production", "cumulative": {"actPower": production}},
+        {"reportType": "net-consumption", "cumulative": {"actPower": net_consumption}},
+        {"reportType": "total-consumption", "cumulative": {"actPower": total_consumption}},
+    ])
+
+
+@app.route('/ivp/ensemble/inventory')
+def ensemble_inventory():
+    return jsonify([
+        {"type": "ENCHARGE", "devices": [{"percentFull": random.randint(10, 100)}]},
+    ])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve canned Envoy responses for local testing.")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    args = parser.parse_args()
+
+    app.config["LATENCY"] = args.latency
+    app.run(host='127.0.0.1', port=args.port, threaded=True)
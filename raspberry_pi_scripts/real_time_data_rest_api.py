@@ -1,45 +1,22 @@
+import json
+import queue
+import time
 from datetime import datetime
 
 import pytz
-import requests
-import urllib3
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, request, stream_with_context
 
 import myconfig
+from envoy_client import DEFAULT_ENVOY_URL, EnvoyClient
+from snapshot_cache import SnapshotCache
 
 app = Flask(__name__)
 
-# Disable insecure request warnings
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
 API_KEY = myconfig.SOLAR_API_KEY
 
+STREAM_KEEPALIVE_SECONDS = 15.0
 
-def fetch_data(url, headers):
-    response = requests.get(url, headers=headers, verify=False)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        app.logger.error(f"Failed to fetch data from API. Status code: {response.status_code}")
-        return None
-
-
-def fetch_solar_data():
-    url = "https://192.168.178.170/ivp/meters/reports"
-    headers = {
-        'Authorization': API_KEY,
-        'Accept': 'application/json'
-    }
-    return fetch_data(url, headers)
-
-
-def fetch_inventory_data():
-    url = "https://192.168.178.170/ivp/ensemble/inventory"
-    headers = {
-        'Authorization': API_KEY,
-        'Accept': 'application/json'
-    }
-    return fetch_data(url, headers)
+envoy = EnvoyClient(API_KEY, getattr(myconfig, "envoy_url", DEFAULT_ENVOY_URL))
 
 
 def extract_relevant_data(data):
@@ -88,23 +65,92 @@ def extract_inventory_data(data):
     return percent_full
 
 
-@app.route('/solar-data', methods=['GET'])
-def get_solar_data():
-    raw_solar_data = fetch_solar_data()
+def collect_snapshot():
+    raw_solar_data, raw_inventory_data = envoy.fetch_all()
     relevant_solar_data = extract_relevant_data(raw_solar_data)
-
-    raw_inventory_data = fetch_inventory_data()
     relevant_inventory_data = extract_inventory_data(raw_inventory_data)
 
     if relevant_solar_data and relevant_inventory_data is not None:
-        response_data = {
+        return {
             **relevant_solar_data,
             "battery_status": relevant_inventory_data
         }
-        return jsonify(response_data), 200
-    else:
+    return None
+
+
+snapshots = SnapshotCache(collect_snapshot,
+                          interval=getattr(myconfig, "snapshot_interval", 5.0),
+                          max_age=getattr(myconfig, "snapshot_max_age", 10.0))
+
+
+@app.route('/solar-data', methods=['GET'])
+def get_solar_data():
+    snapshots.start()
+    snapshot = snapshots.get()
+
+    if snapshot is None:
         return jsonify({"error": "Failed to fetch or process data"}), 500
 
+    headers = {
+        "ETag": snapshot.etag,
+        "Cache-Control": f"max-age={max(0, int(snapshots.max_age - snapshots.age(snapshot)))}"
+    }
+    if request.if_none_match.contains_weak(snapshot.etag.strip('"')):
+        return Response(status=304, headers=headers)
+    return Response(snapshot.body, status=200, mimetype="application/json", headers=headers)
+
+
+def snapshot_delta(previous, current):
+    if previous is None:
+        return current
+    return {key: value for key, value in current.items() if previous.get(key) != value}
+
+
+def stream_snapshots(subscription, interval):
+    last_data = None
+    last_sent = 0.0
+    try:
+        while True:
+            try:
+                snapshot = subscription.get(timeout=STREAM_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+
+            wait = interval - (time.monotonic() - last_sent)
+            if wait > 0:
+                time.sleep(wait)
+                try:
+                    snapshot = subscription.get_nowait()
+                except queue.Empty:
+                    pass
+
+            event = "snapshot" if last_data is None else "delta"
+            delta = snapshot_delta(last_data, snapshot.data)
+            last_data = snapshot.data
+            last_sent = time.monotonic()
+            if delta:
+                event_id = snapshot.etag.strip('"')
+                yield f"event: {event}\nid: {event_id}\ndata: {json.dumps(delta)}\n\n"
+    finally:
+        snapshots.unsubscribe(subscription)
+
+
+@app.route('/solar-data/stream', methods=['GET'])
+def stream_solar_data():
+    interval = request.args.get('interval', default=snapshots.interval, type=float)
+    if interval <= 0:
+        return jsonify({"error": "interval must be positive"}), 400
+
+    snapshots.start()
+    subscription = snapshots.subscribe()
+    return Response(
+        stream_with_context(stream_snapshots(subscription, interval)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 
 if __name__ == '__main__':
+    snapshots.start()
     app.run(host='0.0.0.0', port=8080)
@@ -0,0 +1,53 @@
+from datetime import datetime, timezone
+
+BUCKET_COLLECTION = "SolarBucketsV1"
+BUCKET_SECONDS = 3600
+FIELDS = ("production", "grid", "consumption", "battery_status")
+WRITER = "ingester"
+
+
+def bucket_start(timestamp, bucket_seconds=BUCKET_SECONDS):
+    seconds = int(timestamp.timestamp()) // bucket_seconds * bucket_seconds
+    return datetime.fromtimestamp(seconds, timezone.utc)
+
+
+def bucket_id(start):
+    return start.strftime("%Y-%m-%dT%H:%MZ")
+
+
+def group_by_bucket(samples, bucket_seconds=BUCKET_SECONDS):
+    buckets = {}
+    for sample in samples:
+        start = bucket_start(sample["timestamp"], bucket_seconds)
+        buckets.setdefault(bucket_id(start), (start, []))[1].append(sample)
+    return buckets
+
+
+def merge_rows(existing, rows):
+    merged = {}
+    if existing:
+        for index, offset in enumerate(existing.get("offset_ms", [])):
+            merged[offset] = [existing[field][index] for field in FIELDS]
+    merged.update(rows)
+    return merged
+
+
+def bucket_document(start, rows, bucket_seconds, writer):
+    offsets = sorted(rows)
+    return {
+        "start": start,
+        "seconds": bucket_seconds,
+        "count": len(offsets),
+        "writer": writer,
+        "offset_ms": offsets,
+        **{field: [rows[offset][index] for offset in offsets] for index, field in enumerate(FIELDS)},
+    }
+
+
+def sample_rows(start, samples):
+    return {round((sample["timestamp"] - start).total_seconds() * 1000): [sample.get(field) for field in FIELDS]
+            for sample in samples}
+
+
+def merge_bucket(existing, start, samples, bucket_seconds=BUCKET_SECONDS, writer=WRITER):
+    return bucket_document(start, merge_rows(existing, sample_rows(start, samples)), bucket_seconds, writer)
@@ -0,0 +1,62 @@
+import json
+import sqlite3
+from datetime import datetime
+
+TARGETS = ("firestore", "realtime")
+
+
+class SampleBuffer:
+    def __init__(self, path="sample_buffer.db", max_rows=500_000):
+        self.max_rows = max_rows
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS samples ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "document_id TEXT NOT NULL, "
+            "payload TEXT NOT NULL, "
+            "firestore_done INTEGER NOT NULL DEFAULT 0, "
+            "realtime_done INTEGER NOT NULL DEFAULT 0)"
+        )
+        for target in TARGETS:
+            self.connection.execute(
+                f"CREATE INDEX IF NOT EXISTS samples_{target}_pending ON samples ({target}_done, id)"
+            )
+
+    def append(self, sample):
+        payload = {**sample, "timestamp": sample["timestamp"].isoformat()}
+        self.connection.execute(
+            "INSERT INTO samples (document_id, payload) VALUES (?, ?)",
+            (sample["document_id"], json.dumps(payload)),
+        )
+
+    def pending(self, target, limit):
+        rows = self.connection.execute(
+            f"SELECT id, payload FROM samples WHERE {target}_done = 0 ORDER BY id LIMIT ?", (limit,)
+        ).fetchall()
+        samples = []
+        for row_id, payload in rows:
+            sample = json.loads(payload)
+            sample["timestamp"] = datetime.fromisoformat(sample["timestamp"])
+            samples.append((row_id, sample))
+        return samples
+
+    def mark_done(self, target, row_ids):
+        self.connection.execute("BEGIN")
+        self.connection.executemany(
+            f"UPDATE samples SET {target}_done = 1 WHERE id = ?", [(row_id,) for row_id in row_ids]
+        )
+        self.connection.execute("COMMIT")
+
+    def backlog(self, target):
+        return self.connection.execute(f"SELECT COUNT(*) FROM samples WHERE {target}_done = 0").fetchone()[0]
+
+    def prune(self):
+        self.connection.execute("DELETE FROM samples WHERE firestore_done = 1 AND realtime_done = 1")
+        self.connection.execute(
+            "DELETE FROM samples WHERE id <= (SELECT MAX(id) FROM samples) - ?", (self.max_rows,)
+        )
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+Snapshot = namedtuple("Snapshot", ["data", "body", "etag", "fetched_at"])
+
+
+class SnapshotCache:
+    def __init__(self, fetch, interval=5.0, max_age=10.0, fetch_timeout=15.0):
+        self.fetch = fetch
+        self.interval = interval
+        self.max_age = max_age
+        self.fetch_timeout = fetch_timeout
+        self.snapshot = None
+        self.lock = threading.Lock()
+        self.in_flight = None
+        self.sampler = None
+        self.stopped = threading.Event()
+        self.subscribers = set()
+
+    def start(self):
+        with self.lock:
+            if self.sampler is not None:
+                return
+            self.sampler = threading.Thread(target=self.run_sampler, name="snapshot-sampler", daemon=True)
+        self.sampler.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run_sampler(self):
+        while not self.stopped.is_set():
+            started = time.monotonic()
+            self.refresh()
+            self.stopped.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def age(self, snapshot=None):
+        snapshot = snapshot or self.snapshot
+        return float("inf") if snapshot is None else time.monotonic() - snapshot.fetched_at
+
+    def get(self):
+        snapshot = self.snapshot
+        if snapshot is not None and self.age(snapshot) <= self.max_age:
+            return snapshot
+        return self.refresh()
+
+    def refresh(self):
+        with self.lock:
+            in_flight = self.in_flight
+            if in_flight is None:
+                in_flight = self.in_flight = threading.Event()
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            in_flight.wait(self.fetch_timeout)
+            return self.snapshot
+
+        try:
+            data = self.fetch()
+            if data is not None:
+                body = json.dumps(data).encode()
+                self.snapshot = Snapshot(data, body, f'"{hashlib.sha1(body).hexdigest()[:16]}"', time.monotonic())
+                self.publish(self.snapshot)
+        except Exception as error:
+            logger.error(f"Failed to refresh snapshot: {error}")
+        finally:
+            with self.lock:
+                self.in_flight = None
+            in_flight.set()
+
+        return self.snapshot
+
+    def subscribe(self):
+        subscription = queue.Queue(maxsize=1)
+        with self.lock:
+            self.subscribers.add(subscription)
+        if self.snapshot is not None:
+            try:
+                subscription.put_nowait(self.snapshot)
+            except queue.Full:
+                pass
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def publish(self, snapshot):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                subscription.put_nowait(snapshot)
+            except queue.Full:
+                pass